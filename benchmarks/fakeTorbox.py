@@ -0,0 +1,273 @@
+"""
+Local stand-in for the TorBox API, search API and CDN, used by the benchmarks.
+
+Serves paginated /{type}/mylist listings of a synthetic library (gzip compressed, with ETags), /{type}/requestdl redirects,
+/meta/search lookups with configurable latency and 429 injection, an optional multi-query /meta/search/batch
+endpoint and Range-capable file downloads.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from collections import Counter
+import threading
+import hashlib
+import gzip
+import json
+import time
+
+DOWNLOAD_TYPES = ("torrents", "usenet", "webdl")
+ID_PARAMS = {"torrents": "torrent_id", "usenet": "usenet_id", "webdl": "web_id"}
+PATTERN = bytes(range(251)) * 4096 # content byte at offset n is n % 251
+WRITE_CHUNK_SIZE = 251 * 1024
+
+def getContent(offset: int, size: int):
+    """
+    Returns the synthetic file content for a range, for verifying reads.
+    """
+    start = offset % 251
+    data = bytearray()
+    while len(data) < size:
+        data.extend(PATTERN[start:start + size - len(data)])
+        start = 0
+    return bytes(data)
+
+def getSearchResults(title: str):
+    show = title.split(".S01")[0].replace(".", " ").strip()
+    return [{
+        "title": show,
+        "type": "series",
+        "releaseYears": "2024",
+        "link": None,
+        "image": None,
+        "backdrop": None,
+    }]
+
+class FakeLibrary:
+    def __init__(self, file_count: int, files_per_item: int = 10, file_size: int = 2 * 1024 * 1024 * 1024):
+        self.files_per_item = files_per_item
+        self.file_size = file_size
+        self.items: dict[str, list[dict]] = {download_type: [] for download_type in DOWNLOAD_TYPES}
+        self.next_item_id = 1
+        self.next_file_id = 1
+        self.lock = threading.Lock()
+        self.addFiles(file_count)
+
+    def addFiles(self, file_count: int):
+        """
+        Adds new items holding file_count files, spread across the download types.
+        """
+        with self.lock:
+            added = 0
+            while added < file_count:
+                download_type = DOWNLOAD_TYPES[self.next_item_id % len(DOWNLOAD_TYPES)]
+                count = min(self.files_per_item, file_count - added)
+                self.items[download_type].insert(0, self.buildItem(self.next_item_id, count))
+                self.next_item_id += 1
+                added += count
+
+    def buildItem(self, item_id: int, file_count: int):
+        show = f"Synthetic Show {item_id}"
+        name = f"Synthetic.Show.{item_id}.S01.1080p.WEB-DL"
+        files = []
+        for episode in range(1, file_count + 1):
+            short_name = f"Synthetic.Show.{item_id}.S01E{episode:02}.1080p.WEB-DL.mkv"
+            files.append({
+                "id": self.next_file_id,
+                "short_name": short_name,
+                "name": f"{name}/{short_name}",
+                "size": self.file_size,
+                "mimetype": "video/x-matroska",
+            })
+            self.next_file_id += 1
+        return {
+            "id": item_id,
+            "hash": f"{item_id:040x}",
+            "name": name,
+            "title": show,
+            "cached": True,
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-01T00:00:00Z",
+            "files": files,
+        }
+
+    def getPage(self, download_type: str, offset: int, limit: int):
+        with self.lock:
+            return self.items.get(download_type, [])[offset:offset + limit]
+
+    def getItem(self, download_type: str, item_id: int):
+        with self.lock:
+            return next((item for item in self.items.get(download_type, []) if item["id"] == item_id), None)
+
+    def getFileSize(self, download_type: str, item_id: int, file_id: int):
+        return self.file_size
+
+class FakeTorboxServer:
+    def __init__(self, library: FakeLibrary, api_latency: float = 0.0, search_latency: float = 0.0, cdn_latency: float = 0.0, rate_limit_every: int = 0, batch_search: bool = True, host: str = "127.0.0.1", port: int = 0):
+        self.library = library
+        self.batch_search = batch_search
+        self.api_latency = api_latency
+        self.search_latency = search_latency
+        self.cdn_latency = cdn_latency
+        self.rate_limit_every = rate_limit_every
+        self.requests = Counter()
+        self.bytes_served = 0
+        self.listing_bytes = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.buildHandler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def countRequest(self, endpoint: str):
+        with self.lock:
+            self.requests[endpoint] += 1
+            return self.requests[endpoint]
+
+    def buildHandler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def sendJson(self, status: int, data, headers: dict | None = None):
+                self.sendBody(status, json.dumps(data).encode(), headers)
+
+            def sendBody(self, status: int, body: bytes, headers: dict | None = None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                parts = [unquote(part) for part in url.path.split("/") if part]
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                if parts[:2] == ["v1", "api"] and len(parts) == 4 and parts[3] == "mylist":
+                    return self.handleListing(parts[2], query)
+                if parts[:2] == ["v1", "api"] and len(parts) == 4 and parts[3] == "requestdl":
+                    return self.handleRequestDownload(parts[2], query)
+                if parts[:2] == ["meta", "search"] and len(parts) >= 3:
+                    return self.handleSearch("/".join(parts[2:]))
+                if parts[:1] == ["cdn"] and len(parts) == 4:
+                    return self.handleCdn(parts[1], int(parts[2]), int(parts[3]))
+                self.sendJson(404, {"success": False, "detail": "Not found."})
+
+            def handleListing(self, download_type: str, query: dict):
+                server.countRequest("mylist")
+                time.sleep(server.api_latency)
+                if "id" in query:
+                    item = server.library.getItem(download_type, int(query["id"]))
+                    if item is None:
+                        return self.sendJson(404, {"success": False, "detail": "Item not found."})
+                    return self.sendJson(200, {"success": True, "data": item})
+                offset = int(query.get("offset", 0))
+                limit = int(query.get("limit", 1000))
+                body = json.dumps({"success": True, "data": server.library.getPage(download_type, offset, limit)}).encode()
+                # the page is its own validator, so unchanged pages can be answered with a 304
+                etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.countRequest("mylist_not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    return self.end_headers()
+                headers = {"ETag": etag}
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=5)
+                    headers["Content-Encoding"] = "gzip"
+                with server.lock:
+                    server.listing_bytes += len(body)
+                self.sendBody(200, body, headers)
+
+            def handleRequestDownload(self, download_type: str, query: dict):
+                server.countRequest("requestdl")
+                time.sleep(server.api_latency)
+                item_id = query.get(ID_PARAMS.get(download_type, ""), "0")
+                file_id = query.get("file_id", "0")
+                self.send_response(307)
+                self.send_header("Location", f"{server.url}/cdn/{download_type}/{item_id}/{file_id}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if url.path == "/meta/search/batch" and server.batch_search:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    queries = json.loads(self.rfile.read(length) or b"{}").get("queries", [])
+                    return self.handleBatchSearch([query.get("query", "") for query in queries])
+                self.sendJson(404, {"success": False, "detail": "Not found."})
+
+            def isRateLimited(self, count: int):
+                if server.rate_limit_every and count % server.rate_limit_every == 0:
+                    server.countRequest("search_429")
+                    self.sendJson(429, {"success": False, "detail": "Rate limited."}, {"Retry-After": "0"})
+                    return True
+                return False
+
+            def handleSearch(self, title: str):
+                if self.isRateLimited(server.countRequest("search")):
+                    return
+                time.sleep(server.search_latency)
+                self.sendJson(200, {"success": True, "data": getSearchResults(title)})
+
+            def handleBatchSearch(self, titles: list[str]):
+                if self.isRateLimited(server.countRequest("search_batch")):
+                    return
+                time.sleep(server.search_latency)
+                self.sendJson(200, {"success": True, "data": [getSearchResults(title) for title in titles]})
+
+            def handleCdn(self, download_type: str, item_id: int, file_id: int):
+                server.countRequest("cdn")
+                time.sleep(server.cdn_latency)
+                file_size = server.library.getFileSize(download_type, item_id, file_id)
+                start, end = 0, file_size - 1
+                status = 200
+                range_header = self.headers.get("Range")
+                if range_header and range_header.startswith("bytes="):
+                    first, _, last = range_header[6:].split(",")[0].partition("-")
+                    start = int(first) if first else max(0, file_size - int(last))
+                    end = min(int(last), file_size - 1) if first and last else file_size - 1
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{file_size}")
+                        self.send_header("Content-Length", "0")
+                        return self.end_headers()
+                    status = 206
+
+                self.send_response(status)
+                self.send_header("Content-Type", "video/x-matroska")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+                self.end_headers()
+
+                position = start
+                while position <= end:
+                    pattern_offset = position % 251
+                    length = min(WRITE_CHUNK_SIZE, end - position + 1)
+                    self.wfile.write(PATTERN[pattern_offset:pattern_offset + length])
+                    position += length
+                with server.lock:
+                    server.bytes_served += end - start + 1
+
+        return Handler
@@ -0,0 +1,73 @@
+"""
+Measures memory per file for the legacy per-file dicts and the compact FileRecord on a synthetic library.
+
+Run from the repository root with `python -m benchmarks.recordMemory [file_count]`.
+"""
+import gc
+import sys
+import tracemalloc
+
+from functions.recordFunctions import FileRecord
+
+DEFAULT_FILE_COUNT = 100_000
+FILES_PER_DOWNLOAD = 10
+FAKE_API_KEY = "00000000-0000-0000-0000-000000000000"
+
+def buildSyntheticFile(index: int):
+    # simulates the values that come out of the API and the database, so shared values are not pre-interned
+    item_id = index // FILES_PER_DOWNLOAD
+    episode = index % FILES_PER_DOWNLOAD + 1
+    item_name = "".join(["Synthetic Show ", str(item_id), " S01 1080p WEB-DL"])
+    item_hash = f"{item_id:040x}"
+    file_name = f"Synthetic.Show.{item_id}.S01E{episode:02}.1080p.WEB-DL.mkv"
+    title = "".join(["Synthetic Show ", str(item_id)])
+    return {
+        "item_id": item_id,
+        "type": "".join(["torrent", "s"]),
+        "folder_name": item_name,
+        "DEBUG_name": item_name,
+        "DEBUG_hash": item_hash,
+        "DEBUG_file_name": file_name,
+        "folder_hash": "".join([item_hash]),
+        "file_id": index,
+        "file_name": file_name,
+        "file_size": 1_500_000_000 + index,
+        "file_mimetype": "".join(["video/", "x-matroska"]),
+        "path": f"{item_name}/{file_name}",
+        "download_link": f"https://api.torbox.app/v1/api/torrents/requestdl?token={FAKE_API_KEY}&torrent_id={item_id}&file_id={index}&redirect=true",
+        "extension": "".join([".", "mkv"]),
+        "metadata_title": title,
+        "metadata_link": None,
+        "metadata_mediatype": "".join(["ser", "ies"]),
+        "metadata_image": None,
+        "metadata_backdrop": None,
+        "metadata_years": 2020,
+        "metadata_season": 1,
+        "metadata_episode": episode,
+        "metadata_filename": f"{title} S01E{episode:02}.mkv",
+        "metadata_rootfoldername": "".join([title, " (2020)"]),
+        "metadata_foldername": "".join(["Season ", "1"]),
+    }
+
+def measure(build, file_count: int):
+    gc.collect()
+    tracemalloc.start()
+    files = [build(index) for index in range(file_count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del files
+    gc.collect()
+    return current, peak
+
+def runBenchmark(file_count: int = DEFAULT_FILE_COUNT):
+    results = {
+        "dict": measure(buildSyntheticFile, file_count),
+        "record": measure(lambda index: FileRecord.fromDict(buildSyntheticFile(index)), file_count),
+    }
+    print(f"Synthetic library of {file_count} files")
+    for name, (current, peak) in results.items():
+        print(f"{name:>8}: {current / file_count:8.1f} bytes/file retained, {peak / 1024 / 1024:8.1f} MiB peak")
+    return results
+
+if __name__ == "__main__":
+    runBenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILE_COUNT)
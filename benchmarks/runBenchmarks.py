@@ -0,0 +1,365 @@
+"""
+Runs end to end benchmarks against a local TorBox stand-in and reports throughput, latency and peak RSS.
+
+Every scenario runs in its own process so peak RSS is measured per scenario.
+Run from the repository root, for example:
+
+    python -m benchmarks.runBenchmarks --files 50000 --output results.json
+    python -m benchmarks.runBenchmarks --scenarios fuse_sequential,fuse_probe_storm --compare results.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakeTorbox import FakeLibrary, FakeTorboxServer, getContent
+
+SCENARIOS = ("cold_refresh", "incremental_refresh", "strm_sync", "strm_proxy_play", "fuse_sequential", "fuse_probe_storm", "vfs_index")
+OFFLINE_SCENARIOS = ("vfs_index",) # scenarios that do not need the TorBox stand-in
+INCREMENTAL_NEW_FILES_RATIO = 0.01
+SEQUENTIAL_READ_SIZE = 128 * 1024
+SEQUENTIAL_BYTES = 512 * 1024 * 1024
+PROBE_FILES = 200
+PLAY_START_BYTES = 1024 * 1024
+VFS_LOOKUPS = 20_000
+
+def percentiles(samples: list[float]):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    def pick(fraction: float):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def peakRssMb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+def currentRssMb():
+    # only Linux exposes the current RSS cheaply, elsewhere memory deltas are reported as 0
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return 0.0
+
+def configureEnvironment(server: FakeTorboxServer, work_dir: str, metadata: bool, search_batch: bool):
+    os.environ.update({
+        "TORBOX_API_KEY": "benchmark-key",
+        "TORBOX_API_URL": f"{server.url}/v1/api",
+        "TORBOX_SEARCH_API_URL": server.url,
+        "MOUNT_PATH": os.path.join(work_dir, "mount"),
+        "MOUNT_REFRESH_TIME": "normal",
+        "ENABLE_METADATA": "true" if metadata else "false",
+        "RAW_MODE": "false",
+        "METADATA_SEARCH_BATCH_PATH": "/meta/search/batch" if search_batch else "",
+        "METADATA_SEARCH_RATE": "1000",
+    })
+    os.chdir(work_dir)
+
+def runRefresh():
+    from functions.appFunctions import getAllUserDownloadsFresh
+    started_at = time.perf_counter()
+    file_count = getAllUserDownloadsFresh()
+    return file_count, time.perf_counter() - started_at
+
+def waitForEnrichment():
+    from functions.enrichmentFunctions import getEnrichmentQueue
+    started_at = time.perf_counter()
+    getEnrichmentQueue().join()
+    return time.perf_counter() - started_at
+
+def scenarioColdRefresh(server: FakeTorboxServer, args):
+    file_count, duration = runRefresh()
+    result = {"files": file_count, "seconds": duration, "files_per_second": file_count / duration if duration else 0}
+    if args.metadata:
+        # files are visible after the refresh, metadata is complete once the background lookups finish
+        result["enrichment_seconds"] = waitForEnrichment()
+    return result
+
+def scenarioIncrementalRefresh(server: FakeTorboxServer, args):
+    runRefresh()
+    server.requests.clear()
+    server.library.addFiles(max(1, int(args.files * INCREMENTAL_NEW_FILES_RATIO)))
+    file_count, duration = runRefresh()
+    return {"files": file_count, "seconds": duration, "files_per_second": file_count / duration if duration else 0}
+
+def scenarioStrmSync(server: FakeTorboxServer, args):
+    runRefresh()
+    server.requests.clear()
+    from functions.stremFilesystemFunctions import runStrm
+    started_at = time.perf_counter()
+    runStrm()
+    duration = time.perf_counter() - started_at
+    # a second sync without a refresh in between finds the library snapshot unchanged
+    started_at = time.perf_counter()
+    runStrm()
+    idle_duration = time.perf_counter() - started_at
+    return {"files": args.files, "seconds": duration, "files_per_second": args.files / duration if duration else 0, "idle_seconds": idle_duration}
+
+def getBenchmarkFiles(library: FakeLibrary, count: int):
+    from functions.recordFunctions import FileRecord
+    files = []
+    for download_type, items in library.items.items():
+        for item in items:
+            for file in item["files"]:
+                files.append(FileRecord(
+                    type=download_type,
+                    item_id=item["id"],
+                    file_id=file["id"],
+                    file_name=file["short_name"],
+                    file_size=file["size"],
+                ))
+                if len(files) >= count:
+                    return files
+    return files
+
+def scenarioFuseSequential(server: FakeTorboxServer, args):
+    # drives the stream layer that backs TorBoxMediaCenterFuse.read, with the read sizes the kernel uses
+    from functions.linkFunctions import LinkManager
+    from functions.streamFunctions import StreamManager
+    links = LinkManager()
+    streams = StreamManager(links)
+    file = getBenchmarkFiles(server.library, 1)[0]
+    handle = streams.open(file)
+    latencies = []
+    started_at = time.perf_counter()
+    for offset in range(0, min(SEQUENTIAL_BYTES, file.file_size), SEQUENTIAL_READ_SIZE):
+        read_started_at = time.perf_counter()
+        data = streams.read(handle, SEQUENTIAL_READ_SIZE, offset)
+        latencies.append(time.perf_counter() - read_started_at)
+        if offset == 0 and data != getContent(0, SEQUENTIAL_READ_SIZE):
+            raise AssertionError("Unexpected content returned by the stream layer.")
+    duration = time.perf_counter() - started_at
+    streams.release(handle)
+    streams.stop()
+    links.stop()
+    bytes_read = len(latencies) * SEQUENTIAL_READ_SIZE
+    return {"reads": len(latencies), "seconds": duration, "mb_per_second": bytes_read / duration / 1024 / 1024, **percentiles(latencies)}
+
+def scenarioFuseProbeStorm(server: FakeTorboxServer, args):
+    # ffprobe style pattern: the head, the tail for MKV cues or MP4 moov atoms and a few spots in the middle
+    from functions.linkFunctions import LinkManager
+    from functions.streamFunctions import StreamManager
+    links = LinkManager(max_links=PROBE_FILES * 2)
+    streams = StreamManager(links)
+    files = getBenchmarkFiles(server.library, min(PROBE_FILES, args.files))
+    latencies = []
+    started_at = time.perf_counter()
+    for file in files:
+        handle = streams.open(file)
+        size = file.file_size
+        for offset, read_size in ((0, 4096), (4096, 65536), (size - 65536, 65536), (size // 2, 16384), (size // 3, 16384), (0, 4096)):
+            read_started_at = time.perf_counter()
+            streams.read(handle, read_size, offset)
+            latencies.append(time.perf_counter() - read_started_at)
+        streams.release(handle)
+    duration = time.perf_counter() - started_at
+    streams.stop()
+    links.stop()
+    return {
+        "files": len(files),
+        "seconds": duration,
+        "mb_fetched_per_file": server.bytes_served / len(files) / 1024 / 1024,
+        **percentiles(latencies),
+    }
+
+def scenarioStrmProxyPlay(server: FakeTorboxServer, args):
+    # a player starting each file twice through the stream proxy, the second start is served from the shared cache
+    import httpx
+    from functions.linkFunctions import LinkManager
+    from functions.streamFunctions import StreamManager
+    from functions.proxyFunctions import StreamProxy, startStreamProxy
+    files = getBenchmarkFiles(server.library, min(PROBE_FILES, args.files))
+    records = {(file.type, file.item_id, file.file_id): file for file in files}
+    links = LinkManager(max_links=PROBE_FILES * 2)
+    streams = StreamManager(links)
+    proxy_server = startStreamProxy("127.0.0.1", 0, StreamProxy(streams, lookup=lambda *key: records.get(key), token=""))
+    base_url = f"http://127.0.0.1:{proxy_server.server_address[1]}"
+    cold_latencies = []
+    warm_latencies = []
+    started_at = time.perf_counter()
+    with httpx.Client(timeout=60) as client:
+        for file in files:
+            url = f"{base_url}/stream/{file.type}/{file.item_id}/{file.file_id}/{file.file_name}"
+            for latencies in (cold_latencies, warm_latencies):
+                request_started_at = time.perf_counter()
+                response = client.get(url, headers={"Range": f"bytes=0-{PLAY_START_BYTES - 1}"})
+                latencies.append(time.perf_counter() - request_started_at)
+                if response.content != getContent(0, PLAY_START_BYTES):
+                    raise AssertionError("Unexpected content returned by the stream proxy.")
+    duration = time.perf_counter() - started_at
+    proxy_server.shutdown()
+    streams.stop()
+    links.stop()
+    return {
+        "files": len(files),
+        "seconds": duration,
+        **{f"cold_{key}": value for key, value in percentiles(cold_latencies).items()},
+        **{f"warm_{key}": value for key, value in percentiles(warm_latencies).items()},
+    }
+
+def getSyntheticVfsFiles(count: int, files_per_item: int):
+    from functions.recordFunctions import FileRecord
+    files = []
+    for index in range(count):
+        item_id, episode = divmod(index, files_per_item)
+        season = f"Season {episode // 10 + 1}"
+        file_name = f"Synthetic.Show.{item_id}.S{episode // 10 + 1:02}E{episode % 10 + 1:02}.1080p.WEB-DL.mkv"
+        files.append(FileRecord(
+            type="torrents",
+            item_id=item_id,
+            file_id=index,
+            file_name=file_name,
+            # raw mode mirrors the torrent's folders, which nest a few levels deep in season packs
+            path=f"Synthetic.Show.{item_id}.Complete.1080p.WEB-DL/{season}/Episodes/{file_name}",
+            created_at=1_700_000_000 + index,
+            metadata_mediatype="series",
+            metadata_rootfoldername=f"Synthetic Show {item_id} (2024)",
+            metadata_foldername=season,
+            metadata_filename=f"Synthetic Show {item_id} - S{episode // 10 + 1:02}E{episode % 10 + 1:02}.mkv",
+        ))
+    return files
+
+def scenarioVfsIndex(server, args):
+    # getattr style lookups against the VFS path index at library scale, in both mount layouts
+    import random
+    from functions.pathIndexFunctions import buildPathIndex, getVirtualPath
+    files = getSyntheticVfsFiles(args.files, args.files_per_item)
+    sample = random.Random(0).sample(files, min(VFS_LOOKUPS, len(files)))
+    result = {"files": len(files)}
+    for layout, raw_mode in (("metadata", False), ("raw", True)):
+        rss_before = currentRssMb()
+        started_at = time.perf_counter()
+        index = buildPathIndex(files, raw_mode, False)
+        result[f"{layout}_build_seconds"] = time.perf_counter() - started_at
+        result[f"{layout}_index_mb"] = currentRssMb() - rss_before
+        latencies = []
+        for file in sample:
+            path = "/" + "/".join(getVirtualPath(file, raw_mode))
+            lookup_started_at = time.perf_counter()
+            # getattr checks for a folder first, then resolves the file
+            if index.isDir(path) or index.getFile(path) is not file:
+                raise AssertionError(f"VFS lookup returned the wrong entry for {path}.")
+            latencies.append(time.perf_counter() - lookup_started_at)
+        # lookups take microseconds, so they are reported in microseconds
+        result.update({f"{layout}_lookup_{key.removesuffix('_ms')}_us": value * 1000 for key, value in percentiles(latencies).items()})
+        del index
+    return result
+
+SCENARIO_FUNCTIONS = {
+    "cold_refresh": scenarioColdRefresh,
+    "incremental_refresh": scenarioIncrementalRefresh,
+    "strm_sync": scenarioStrmSync,
+    "strm_proxy_play": scenarioStrmProxyPlay,
+    "fuse_sequential": scenarioFuseSequential,
+    "fuse_probe_storm": scenarioFuseProbeStorm,
+    "vfs_index": scenarioVfsIndex,
+}
+
+def runScenario(name: str, args):
+    if name in OFFLINE_SCENARIOS:
+        result = SCENARIO_FUNCTIONS[name](None, args)
+        result["peak_rss_mb"] = peakRssMb()
+        return result
+    server = FakeTorboxServer(
+        FakeLibrary(args.files, files_per_item=args.files_per_item),
+        api_latency=args.api_latency,
+        search_latency=args.search_latency,
+        cdn_latency=args.cdn_latency,
+        rate_limit_every=args.rate_limit_every,
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            configureEnvironment(server, work_dir, args.metadata, args.search_batch)
+            result = SCENARIO_FUNCTIONS[name](server, args)
+    finally:
+        server.stop()
+    result["api_requests"] = dict(server.requests)
+    result["listing_mb"] = server.listing_bytes / 1024 / 1024
+    result["peak_rss_mb"] = peakRssMb()
+    return result
+
+def runInSubprocess(name: str, argv: list[str]):
+    command = [sys.executable, "-m", "benchmarks.runBenchmarks", *argv, "--run-scenario", name]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def printComparison(results: dict, baseline: dict):
+    for name, result in results.items():
+        previous = baseline.get(name, {})
+        print(f"{name}:")
+        for key, value in result.items():
+            if not isinstance(value, (int, float)):
+                continue
+            line = f"  {key:>20}: {value:12.2f}"
+            if isinstance(previous.get(key), (int, float)) and previous[key]:
+                line += f"  ({(value - previous[key]) / previous[key] * 100:+.1f}% vs baseline)"
+            print(line)
+        if "error" in result:
+            print(f"  error: {result['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50_000, help="number of files in the synthetic library")
+    parser.add_argument("--files-per-item", type=int, default=10)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated list of scenarios to run")
+    parser.add_argument("--metadata", action="store_true", help="enable metadata scanning during refreshes")
+    parser.add_argument("--search-batch", action="store_true", help="send metadata searches to the stand-in's multi-query endpoint")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds of latency per API request")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="seconds of latency per metadata search")
+    parser.add_argument("--cdn-latency", type=float, default=0.0, help="seconds of latency before each CDN response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth metadata search with a 429")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="compare against a previous JSON results file")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(runScenario(args.run_scenario, args)))
+        return
+
+    forwarded = [
+        "--files", str(args.files),
+        "--files-per-item", str(args.files_per_item),
+        "--api-latency", str(args.api_latency),
+        "--search-latency", str(args.search_latency),
+        "--cdn-latency", str(args.cdn_latency),
+        "--rate-limit-every", str(args.rate_limit_every),
+    ]
+    if args.metadata:
+        forwarded.append("--metadata")
+    if args.search_batch:
+        forwarded.append("--search-batch")
+    results = {}
+    for name in args.scenarios.split(","):
+        if name not in SCENARIO_FUNCTIONS:
+            parser.error(f"Unknown scenario {name}. Valid options are: {', '.join(SCENARIOS)}")
+        results[name] = runInSubprocess(name, forwarded)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    printComparison(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,43 @@
 from library.app import RAW_MODE, ENABLE_AUDIO
-from functions.torboxFunctions import getUserDownloads, DownloadType
-from library.filesystem import MOUNT_METHOD, MOUNT_PATH
+from functions.torboxFunctions import iterUserDownloadPages, iterDownloadFiles, processDownloadFiles, getUserDownloadItem, processDownloadItems, DownloadType, ListingError, StorageError
+from library.filesystem import MOUNT_METHOD, MOUNT_PATH, STRM_MOUNT_PATH, FUSE_MOUNT_PATH, ENABLE_WARMUP, getMountMethods
 from library.app import MOUNT_REFRESH_TIME
 from library.torbox import TORBOX_API_KEY
-from functions.databaseFunctions import getAllData, clearDatabase
+from functions.databaseFunctions import clearDatabase, removeItemData, keepFileData
+from functions.generationFunctions import RefreshCheckpoint, setStagingTable, clearStagingTable, promoteStagingTable
+from functions.snapshotFunctions import getLibrarySnapshot
+from functions.profileFunctions import startRefreshProfile, finishRefreshProfile, profilePhase
 import logging
 import os
 import shutil
 import threading
+import time
 from library.app import getCurrentVersion
+from library.metrics import REFRESH_CYCLES, REFRESH_SECONDS, REFRESH_FILES, LAST_REFRESH_TIMESTAMP, REFRESH_CHECKPOINTS
 import git
 
 refresh_lock = threading.Lock()
 
+def getMountPaths(mount_method: str = MOUNT_METHOD):
+    paths = {"strm": STRM_MOUNT_PATH, "fuse": FUSE_MOUNT_PATH}
+    return [paths[method] for method in getMountMethods(mount_method)]
+
 def initializeFolders():
-    folders = [MOUNT_PATH]
-    if not RAW_MODE:
-        folders.extend([
-            os.path.join(MOUNT_PATH, "movies"),
-            os.path.join(MOUNT_PATH, "series"),
-        ])
-        if ENABLE_AUDIO:
-            folders.append(os.path.join(MOUNT_PATH, "music"))
+    folders = []
+    for mount_path in getMountPaths():
+        folders.append(mount_path)
+        if not RAW_MODE:
+            folders.extend([
+                os.path.join(mount_path, "movies"),
+                os.path.join(mount_path, "series"),
+            ])
+            if ENABLE_AUDIO:
+                folders.append(os.path.join(mount_path, "music"))
+    keep_strm = "strm" in getMountMethods(MOUNT_METHOD)
     for folder in folders:
+        if os.path.exists(folder) and keep_strm and STRM_MOUNT_PATH in (folder, os.path.dirname(folder)):
+            # the strm files of the last run stay until the first strm sync, which removes the stale ones itself
+            continue
         if os.path.exists(folder):
             logging.debug(f"Folder {folder} already exists. Deleting...")
             for item in os.listdir(folder):
@@ -35,73 +50,171 @@ def initializeFolders():
             logging.debug(f"Creating folder {folder}...")
             os.makedirs(folder, exist_ok=True)
 
-def getAllUserDownloadsFresh():
-    all_downloads = []
-    logging.info("Fetching all user downloads...")
-    for download_type in DownloadType:
-        logging.debug(f"Clearing database for {download_type.value}...")
-        success, detail = clearDatabase(download_type.value)
-        if not success:
-            logging.error(f"Error clearing {download_type.value} database: {detail}")
+def getAllUserDownloadsFresh(download_types: list[DownloadType] | None = None):
+    """
+    Refreshes every download type, or only the given ones. Returns the number of files stored.
+    """
+    file_count = 0
+    if download_types is None:
+        download_types = list(DownloadType)
+        logging.info("Fetching all user downloads...")
+    else:
+        logging.info(f"Fetching {', '.join(download_type.value for download_type in download_types)} downloads...")
+    for download_type in download_types:
+        with REFRESH_SECONDS.labels(download_type.value).time():
+            stored = refreshDownloadType(download_type)
+        if stored is None:
             continue
-        logging.debug(f"Fetching {download_type.value} downloads...")
-        downloads, success, detail = getUserDownloads(download_type)
+        REFRESH_FILES.labels(download_type.value).set(stored)
+        file_count += stored
+    return file_count
+
+def refreshDownloadType(download_type: DownloadType):
+    """
+    Refetches a single download type into a staging generation and promotes it once complete, so the previous
+    generation stays live until then. An interrupted refresh resumes from its last checkpoint.
+    Pages are processed as they arrive and stored in chunks, so memory stays bounded for large libraries.
+    Returns the number of files in the new generation, or None if the refresh failed.
+    """
+    type = download_type.value
+    checkpoint = RefreshCheckpoint(type)
+    table = setStagingTable(type)
+    stored = 0
+    try:
+        with profilePhase(type, "database"):
+            if checkpoint.load():
+                logging.info(f"Resuming {type} refresh with {len(checkpoint.getCompletedFiles())} files already processed.")
+                REFRESH_CHECKPOINTS.labels(type, "resumed").inc()
+                # files stored after the last checkpoint, or missing from the staging database, are processed again
+                kept, success, detail = keepFileData(checkpoint.getCompletedFiles(), table)
+                if success:
+                    checkpoint.retainFiles(kept)
+                    stored = len(kept)
+            else:
+                checkpoint.begin()
+                success, detail = clearDatabase(table)
         if not success:
-            logging.error(f"Error fetching {download_type.value}: {detail}")
-            continue
-        if not downloads:
-            logging.info(f"No {download_type.value} downloads found.")
-            continue
-        all_downloads.extend(downloads)
-        logging.debug(f"Fetched {len(downloads)} {download_type.value} downloads.")
-    return all_downloads
-
-def runRefreshCycle(mount_method: str | None = None, include_mount_sync: bool = False, trigger: str = "scheduled"):
+            logging.error(f"Error preparing {type} staging database: {detail}")
+            return None
+        logging.debug(f"Fetching {type} downloads...")
+        try:
+            stored += processDownloadFiles(download_type, iterDownloadFiles(download_type, iterUserDownloadPages(download_type, checkpoint), checkpoint), table, checkpoint)
+        except (ListingError, StorageError) as e:
+            # the previous generation stays live, and the checkpoint resumes after the last stored chunk
+            logging.error(f"Error refreshing {type}: {e}")
+            return None
+        if not stored:
+            logging.info(f"No {type} downloads found.")
+        with profilePhase(type, "checkpoint"):
+            checkpoint.save()
+        with profilePhase(type, "database"):
+            success, detail = promoteStagingTable(type)
+        if not success:
+            logging.error(f"Error promoting {type} staging database: {detail}")
+            return None
+        checkpoint.clear()
+    finally:
+        clearStagingTable(type)
+    return stored
+
+def refreshDownloadItem(download_type: DownloadType, item_id: int):
+    """
+    Refetches a single download item and replaces its files. Returns the number of stored files, or None if the refresh failed.
+    """
+    item, success, detail = getUserDownloadItem(download_type, item_id)
+    if not success:
+        logging.error(f"Error fetching {download_type.value} item {item_id}: {detail}")
+        return None
+    with profilePhase(download_type.value, "database"):
+        success, detail = removeItemData(item_id, download_type.value)
+    if not success:
+        logging.error(f"Error removing {download_type.value} item {item_id}: {detail}")
+        return None
+    if item is None:
+        logging.info(f"{download_type.value.capitalize()} item {item_id} no longer exists. Removed its files.")
+        return 0
+    return processDownloadItems(download_type, [item])
+
+def syncMounts(mount_method: str = MOUNT_METHOD):
+    """
+    Brings every mount of the mount method up to date with the current library snapshot.
+    """
+    mount_methods = getMountMethods(mount_method)
+    if "strm" in mount_methods:
+        from functions.stremFilesystemFunctions import runStrm
+        runStrm()
+    if "fuse" in mount_methods:
+        from functions.fuseFilesystemFunctions import requestFuseRefresh
+        requestFuseRefresh()
+    if ENABLE_WARMUP:
+        from functions.warmupFunctions import queueWarmUp
+        queueWarmUp(getLibrarySnapshot())
+
+def runRefreshCycle(
+    mount_method: str | None = None,
+    include_mount_sync: bool = False,
+    trigger: str = "scheduled",
+    download_types: list[DownloadType] | None = None,
+    item_ids: dict[DownloadType, list[int]] | None = None,
+    wait: bool = False,
+):
+    """
+    Refreshes every download type, or only the given download types and items when either is passed.
+    With wait, waits for a running refresh to finish instead of skipping.
+    """
     if mount_method is None:
         mount_method = MOUNT_METHOD
 
-    if not refresh_lock.acquire(blocking=False):
+    if not refresh_lock.acquire(blocking=wait):
         logging.info(f"Skipping {trigger} refresh because another refresh is already running.")
+        REFRESH_CYCLES.labels(trigger, "skipped").inc()
         return False, "Refresh is already running."
 
+    profile = startRefreshProfile(trigger)
+    success, detail = False, "Refresh cycle did not finish."
     try:
         logging.info(f"Starting {trigger} refresh cycle...")
-        all_downloads = getAllUserDownloadsFresh() or []
+        if download_types is None and not item_ids:
+            file_count = getAllUserDownloadsFresh()
+        else:
+            file_count = getAllUserDownloadsFresh(download_types or [])
+            for download_type, ids in (item_ids or {}).items():
+                for item_id in ids:
+                    file_count += refreshDownloadItem(download_type, item_id) or 0
+
+        with profilePhase("library", "snapshot"):
+            # published here so the mounts pick up the new snapshot without reading the databases themselves
+            snapshot = getLibrarySnapshot()
+        logging.debug(f"Published library snapshot {snapshot.version}.")
 
         if include_mount_sync:
-            if mount_method == "strm":
-                from functions.stremFilesystemFunctions import runStrm
-                runStrm()
-            elif mount_method == "fuse":
-                from functions.fuseFilesystemFunctions import requestFuseRefresh
-                requestFuseRefresh()
+            with profilePhase(mount_method, "mount_sync"):
+                syncMounts(mount_method)
 
         logging.info(f"Completed {trigger} refresh cycle.")
-        return True, f"Completed refresh cycle for {len(all_downloads)} downloads."
+        REFRESH_CYCLES.labels(trigger, "success").inc()
+        LAST_REFRESH_TIMESTAMP.set(time.time())
+        success, detail = True, f"Completed refresh cycle for {file_count} downloads."
+        return success, detail
     except Exception as e:
         logging.error(f"Error during {trigger} refresh cycle: {e}")
-        return False, f"Error during refresh cycle: {e}"
+        REFRESH_CYCLES.labels(trigger, "error").inc()
+        success, detail = False, f"Error during refresh cycle: {e}"
+        return success, detail
     finally:
+        finishRefreshProfile(profile, success, detail)
         refresh_lock.release()
 
 def getAllUserDownloads():
-    all_downloads = []
-    for download_type in DownloadType:
-        logging.debug(f"Fetching {download_type.value} downloads...")
-        downloads, success, detail = getAllData(download_type.value)
-        if not success:
-            logging.error(f"Error fetching {download_type.value}: {detail}")
-            continue
-        if not downloads:
-            continue
-        all_downloads.extend(downloads)
-        logging.debug(f"Fetched {len(downloads)} {download_type.value} downloads.")
-    return all_downloads
+    """
+    Returns every stored file from the current library snapshot.
+    """
+    return list(getLibrarySnapshot().files)
 
 def bootUp():
     logging.debug("Booting up...")
     logging.info("Mount method: %s", MOUNT_METHOD)
-    logging.info("Mount path: %s", MOUNT_PATH)
+    logging.info("Mount path: %s", ", ".join(getMountPaths()))
     logging.info("TorBox API Key: %s", TORBOX_API_KEY)
     logging.info("Mount refresh time: %s %s", MOUNT_REFRESH_TIME, "hours")
     logging.info("Audio support enabled: %s", ENABLE_AUDIO)
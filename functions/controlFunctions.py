@@ -0,0 +1,265 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from library.app import CONTROL_API_TOKEN
+from functions.torboxFunctions import DownloadType
+from functions.profileFunctions import getRefreshProgress
+from collections import deque
+from typing import Callable
+from urllib.parse import urlsplit, parse_qs
+import itertools
+import threading
+import logging
+import hmac
+import json
+import time
+
+MAX_FINISHED_REQUESTS = 100
+MAX_REQUEST_BODY = 64 * 1024
+
+_request_ids = itertools.count(1)
+
+class RefreshRequest:
+    """
+    A queued refresh of everything, one download type or one item. Requests that are queued together share one run.
+    """
+    def __init__(self, download_type: DownloadType | None = None, item_id: int | None = None, trigger: str = "manual"):
+        self.id = next(_request_ids)
+        self.download_type = download_type
+        self.item_id = item_id
+        self.trigger = trigger
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result: tuple[bool, str] | None = None
+        self.done = threading.Event()
+
+    def wait(self, timeout: float | None = None):
+        if not self.done.wait(timeout):
+            return False, "Refresh request is still running."
+        return self.result
+
+    def finish(self, result: tuple[bool, str]):
+        self.result = result
+        self.state = "succeeded" if result[0] else "failed"
+        self.finished_at = time.time()
+        self.done.set()
+
+    def asDict(self):
+        return {
+            "id": self.id,
+            "type": self.download_type.value if self.download_type else None,
+            "item_id": self.item_id,
+            "trigger": self.trigger,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "success": self.result[0] if self.result else None,
+            "detail": self.result[1] if self.result else None,
+        }
+
+def mergeRefreshRequests(requests: list[RefreshRequest]):
+    """
+    Merges queued requests into one refresh scope. Returns the download types to refresh fully, or None for
+    everything, and the item ids to refresh per download type.
+    """
+    if any(request.download_type is None for request in requests):
+        return None, {}
+    download_types = [download_type for download_type in DownloadType if any(
+        request.download_type == download_type and request.item_id is None for request in requests
+    )]
+    item_ids: dict[DownloadType, list[int]] = {}
+    for request in requests:
+        if request.item_id is None or request.download_type in download_types:
+            continue
+        ids = item_ids.setdefault(request.download_type, [])
+        if request.item_id not in ids:
+            ids.append(request.item_id)
+    return download_types, item_ids
+
+class RefreshQueue:
+    """
+    Runs refresh requests one at a time on a worker thread. Requests that arrive while a refresh is running
+    are merged and run together once it finishes, instead of being dropped.
+    """
+    def __init__(self, runner: Callable[[list[DownloadType] | None, dict[DownloadType, list[int]], str], tuple[bool, str]]):
+        self.runner = runner
+        self.pending: list[RefreshRequest] = []
+        self.running: list[RefreshRequest] = []
+        self.finished: deque[RefreshRequest] = deque(maxlen=MAX_FINISHED_REQUESTS)
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def request(self, download_type: DownloadType | None = None, item_id: int | None = None, trigger: str = "manual"):
+        request = RefreshRequest(download_type, item_id, trigger)
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify_all()
+        logging.info(f"Queued {trigger} refresh request {request.id} for {describeScope(download_type, item_id)}.")
+        return request
+
+    def requestTypes(self, download_types: list[DownloadType] | None, trigger: str = "manual"):
+        """
+        Queues a refresh of everything, or one request per download type. The requests are queued together,
+        so they share one run. Returns the requests.
+        """
+        if download_types is None:
+            return [self.request(trigger=trigger)]
+        requests = [RefreshRequest(download_type, None, trigger) for download_type in download_types]
+        with self.condition:
+            self.pending.extend(requests)
+            self.condition.notify_all()
+        logging.info(f"Queued {trigger} refresh requests {', '.join(str(request.id) for request in requests)} for {', '.join(download_type.value for download_type in download_types)}.")
+        return requests
+
+    def getRequest(self, request_id: int):
+        with self.condition:
+            for request in itertools.chain(self.running, self.pending, self.finished):
+                if request.id == request_id:
+                    return request
+        return None
+
+    def status(self):
+        with self.condition:
+            status = {
+                "running": [request.asDict() for request in self.running],
+                "pending": [request.asDict() for request in self.pending],
+                "finished": [request.asDict() for request in reversed(self.finished)],
+            }
+        status["progress"] = getRefreshProgress()
+        return status
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                self.running, self.pending = self.pending, []
+                requests = self.running
+            started_at = time.time()
+            for request in requests:
+                request.state = "running"
+                request.started_at = started_at
+
+            download_types, item_ids = mergeRefreshRequests(requests)
+            try:
+                result = self.runner(download_types, item_ids, requests[0].trigger)
+            except Exception as e:
+                logging.error(f"Error running refresh requests: {e}")
+                result = (False, f"Error running refresh: {e}")
+
+            with self.condition:
+                for request in requests:
+                    request.finish(result)
+                    self.finished.append(request)
+                self.running = []
+
+def describeScope(download_type: DownloadType | None, item_id: int | None):
+    if download_type is None:
+        return "all downloads"
+    if item_id is None:
+        return f"all {download_type.value}"
+    return f"{download_type.value} item {item_id}"
+
+def parseRefreshRequest(data: dict):
+    """
+    Validates a refresh request body. Returns the download type and item id, or raises ValueError.
+    """
+    download_type = data.get("type")
+    item_id = data.get("item_id")
+    if download_type is not None:
+        try:
+            download_type = DownloadType(download_type)
+        except ValueError:
+            raise ValueError(f"Invalid type {download_type}. Valid options are: {', '.join(e.value for e in DownloadType)}")
+    if item_id is not None:
+        if download_type is None:
+            raise ValueError("item_id requires a type.")
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid item_id {item_id}.")
+    return download_type, item_id
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    queue: RefreshQueue = None
+
+    def sendJson(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def isAuthorized(self):
+        if not CONTROL_API_TOKEN:
+            return True
+        return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {CONTROL_API_TOKEN}")
+
+    def do_GET(self):
+        if not self.isAuthorized():
+            return self.sendJson(401, {"success": False, "detail": "Unauthorized."})
+        parts = [part for part in urlsplit(self.path).path.split("/") if part]
+        if parts == ["status"]:
+            return self.sendJson(200, {"success": True, "data": self.queue.status()})
+        if len(parts) == 2 and parts[0] == "refresh" and parts[1].isdigit():
+            request = self.queue.getRequest(int(parts[1]))
+            if request is None:
+                return self.sendJson(404, {"success": False, "detail": "Refresh request not found."})
+            return self.sendJson(200, {"success": True, "data": request.asDict()})
+        self.sendJson(404, {"success": False, "detail": "Not found."})
+
+    def do_POST(self):
+        if not self.isAuthorized():
+            return self.sendJson(401, {"success": False, "detail": "Unauthorized."})
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/refresh":
+            return self.sendJson(404, {"success": False, "detail": "Not found."})
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BODY:
+            return self.sendJson(413, {"success": False, "detail": "Request body is too large."})
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            if not isinstance(data, dict):
+                raise ValueError("Request body must be a JSON object.")
+            download_type, item_id = parseRefreshRequest({**query, **data})
+        except ValueError as e:
+            return self.sendJson(400, {"success": False, "detail": str(e)})
+
+        request = self.queue.request(download_type, item_id, trigger="api")
+        if str(data.get("wait", query.get("wait", ""))).lower() == "true":
+            request.wait()
+            return self.sendJson(200 if request.result[0] else 500, {"success": request.result[0], "data": request.asDict()})
+        self.sendJson(202, {"success": True, "data": request.asDict()})
+
+    def log_message(self, format, *args):
+        logging.debug(f"Control API request: {format % args}")
+
+def startControlServer(queue: RefreshQueue, host: str, port: int):
+    """
+    Serves the control API on a background thread. Returns the server, or None if it could not be started.
+    """
+    handler = type("BoundControlRequestHandler", (ControlRequestHandler,), {"queue": queue})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.error(f"Unable to start control API on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving control API on http://{host}:{port}")
+    return server
@@ -1,10 +1,27 @@
-from tinydb import TinyDB
+from tinydb import TinyDB, Query
+import itertools
 import threading
 import logging
+import os
 
 db_connections = {}
 db_locks = {}
+db_versions = {}
 global_lock = threading.Lock()
+version_counter = itertools.count(1)
+
+def getDatabasePath(name: str = "db"):
+    return f"{name}.json"
+
+def getDatabaseStamp(name: str = "db"):
+    """
+    Returns the modification time and size of a database file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(getDatabasePath(name))
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
 
 def getDatabase(name: str = "db"):
     """
@@ -16,7 +33,7 @@ def getDatabase(name: str = "db"):
     with global_lock:
         if name not in db_connections:
             try:
-                db_connections[name] = TinyDB(f"{name}.json")
+                db_connections[name] = TinyDB(getDatabasePath(name))
                 db_locks[name] = threading.Lock()
             except Exception as e:
                 logging.error(f"Error connecting to the database: {e}")
@@ -33,6 +50,19 @@ def getDatabaseLock(name: str = "db"):
     getDatabase(name)
     return db_locks.get(name)
 
+def markDatabaseChanged(name: str):
+    """
+    Gives a database a new version. Versions are never reused, so a changed version always means changed data.
+    """
+    db_versions[name] = next(version_counter)
+
+def getDatabaseVersion(name: str):
+    """
+    Returns the version of a database, which changes on every write. Readers can keep data they built from
+    a database for as long as its version stays the same.
+    """
+    return db_versions.get(name, 0)
+
 def clearDatabase(type: str):
     """
     Clears the entire database with thread safety.
@@ -45,7 +75,10 @@ def clearDatabase(type: str):
     
     with db_lock:
         try:
+            # promoteDatabase may have replaced the connection while this was waiting for the lock
+            db = getDatabase(type)
             db.truncate()
+            markDatabaseChanged(type)
             return True, "Database cleared successfully."
         except Exception as e:
             return False, f"Error clearing the database: {e}"
@@ -62,11 +95,121 @@ def insertData(data: dict, type: str):
     
     with db_lock:
         try:
+            db = getDatabase(type)
             db.insert(data)
+            markDatabaseChanged(type)
+            return True, "Data inserted successfully."
+        except Exception as e:
+            return False, f"Error inserting data. {e}"
+    
+def insertMultipleData(data: list[dict], type: str):
+    """
+    Inserts several rows into the database with one write and thread safety.
+    """
+    db = getDatabase(type)
+    db_lock = getDatabaseLock(type)
+    
+    if db is None or db_lock is None:
+        return False, "Database connection failed."
+    
+    with db_lock:
+        try:
+            db = getDatabase(type)
+            db.insert_multiple(data)
+            markDatabaseChanged(type)
             return True, "Data inserted successfully."
         except Exception as e:
             return False, f"Error inserting data. {e}"
     
+def updateFileData(data: dict, item_id: int, file_id: int, type: str):
+    """
+    Updates the stored fields of a single file with thread safety.
+    """
+    db = getDatabase(type)
+    db_lock = getDatabaseLock(type)
+    
+    if db is None or db_lock is None:
+        return False, "Database connection failed."
+    
+    query = Query()
+    with db_lock:
+        try:
+            db = getDatabase(type)
+            updated = db.update(data, (query.item_id == item_id) & (query.file_id == file_id))
+            if not updated:
+                return False, "File not found."
+            markDatabaseChanged(type)
+            return True, "Data updated successfully."
+        except Exception as e:
+            return False, f"Error updating data. {e}"
+
+def removeItemData(item_id: int, type: str):
+    """
+    Removes every file of a download item from the database with thread safety.
+    """
+    db = getDatabase(type)
+    db_lock = getDatabaseLock(type)
+    
+    if db is None or db_lock is None:
+        return False, "Database connection failed."
+    
+    with db_lock:
+        try:
+            db = getDatabase(type)
+            removed = db.remove(Query().item_id == item_id)
+            if removed:
+                markDatabaseChanged(type)
+            return True, f"Removed {len(removed)} files."
+        except Exception as e:
+            return False, f"Error removing data. {e}"
+
+def keepFileData(keys: set[tuple[int, int]], type: str):
+    """
+    Removes every file whose (item_id, file_id) is not in keys with thread safety. Returns the keys of the remaining files.
+    """
+    db = getDatabase(type)
+    db_lock = getDatabaseLock(type)
+    
+    if db is None or db_lock is None:
+        return None, False, "Database connection failed."
+    
+    with db_lock:
+        try:
+            db = getDatabase(type)
+            kept = set()
+            doc_ids = []
+            for doc in db.all():
+                key = (doc.get("item_id"), doc.get("file_id"))
+                if key in keys:
+                    kept.add(key)
+                else:
+                    doc_ids.append(doc.doc_id)
+            if doc_ids:
+                db.remove(doc_ids=doc_ids)
+                markDatabaseChanged(type)
+            return kept, True, f"Removed {len(doc_ids)} files."
+        except Exception as e:
+            return None, False, f"Error removing data. {e}"
+
+def getFileData(item_id: int, file_id: int, type: str):
+    """
+    Retrieves a single file from the database with thread safety. Returns None with success if it does not exist.
+    """
+    db = getDatabase(type)
+    db_lock = getDatabaseLock(type)
+    
+    if db is None or db_lock is None:
+        return None, False, "Database connection failed."
+    
+    query = Query()
+    with db_lock:
+        try:
+            db = getDatabase(type)
+            data = db.get((query.item_id == item_id) & (query.file_id == file_id))
+            return data, True, "Data retrieved successfully."
+        except Exception as e:
+            return None, False, f"Error retrieving data. {e}"
+
 def getAllData(type: str):
     """
     Retrieves all data from the database with thread safety.
@@ -79,11 +222,45 @@ def getAllData(type: str):
     
     with db_lock:
         try:
+            db = getDatabase(type)
             data = db.all()
             return data, True, "Data retrieved successfully."
         except Exception as e:
             return None, False, f"Error retrieving data. {e}"
 
+def promoteDatabase(source: str, name: str):
+    """
+    Atomically replaces a database with another one, for example a finished staging copy.
+    Readers see either the old or the new data, never a partially written database.
+    """
+    global db_connections, db_locks
+
+    target_db = getDatabase(name)
+    source_db = getDatabase(source)
+    target_lock = getDatabaseLock(name)
+    source_lock = getDatabaseLock(source)
+
+    if target_db is None or source_db is None or target_lock is None or source_lock is None:
+        return False, "Database connection failed."
+
+    with target_lock, source_lock:
+        try:
+            source_db.close()
+            target_db.close()
+            os.replace(getDatabasePath(source), getDatabasePath(name))
+        except Exception as e:
+            with global_lock:
+                db_connections[name] = TinyDB(getDatabasePath(name))
+                db_connections[source] = TinyDB(getDatabasePath(source))
+            return False, f"Error promoting database: {e}"
+        with global_lock:
+            db_connections[name] = TinyDB(getDatabasePath(name))
+            del db_connections[source]
+            del db_locks[source]
+            markDatabaseChanged(name)
+            markDatabaseChanged(source)
+    return True, "Database promoted successfully."
+
 def closeDatabase(name: str = "db"):
     """
     Closes a database connection and removes it from the cache.
@@ -96,6 +273,7 @@ def closeDatabase(name: str = "db"):
                 db_connections[name].close()
                 del db_connections[name]
                 del db_locks[name]
+                markDatabaseChanged(name)
                 return True, "Database closed successfully."
             except Exception as e:
                 return False, f"Error closing database: {e}"
@@ -116,6 +294,8 @@ def closeAllDatabases():
             except Exception as e:
                 logging.error(f"Error closing database {name}: {e}")
         
+        for name in db_connections:
+            markDatabaseChanged(name)
         db_connections.clear()
         db_locks.clear()
         return True, f"Closed {closed_count} database connections."
\ No newline at end of file
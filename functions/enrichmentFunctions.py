@@ -0,0 +1,146 @@
+from library.app import METADATA_SEARCH_BATCH_SIZE
+from library.filesystem import MOUNT_METHOD, getMountMethods
+from library.metrics import METADATA_ENRICHMENT_PENDING, METADATA_ENRICHMENTS
+from functions.torboxFunctions import searchMetadata
+from functions.generationFunctions import updateFileDataAllGenerations
+from functions.recordFunctions import FileRecord
+from typing import Callable
+import threading
+import logging
+import queue
+import time
+
+ENRICHMENT_PUBLISH_SECONDS = 5 # longest time a resolved rename waits before it is published
+
+def publishMetadataUpdates(renames: list[tuple[FileRecord, FileRecord]]):
+    """
+    Makes enriched files visible in the mount.
+    """
+    mount_methods = getMountMethods(MOUNT_METHOD)
+    if "strm" in mount_methods:
+        from functions.stremFilesystemFunctions import renameStrmFiles
+        renameStrmFiles(renames)
+    if "fuse" in mount_methods:
+        from functions.fuseFilesystemFunctions import requestFuseRefresh
+        requestFuseRefresh()
+
+class MetadataEnrichmentQueue:
+    """
+    Resolves deferred metadata lookups in the background, updates the stored files and publishes the resulting
+    renames in batches. There is a worker per search batch slot, and the search batcher limits the request rate.
+    """
+    def __init__(
+        self,
+        resolve: Callable[..., tuple[dict, bool | None, str]] = searchMetadata,
+        publish: Callable[[list[tuple[FileRecord, FileRecord]]], None] = publishMetadataUpdates,
+        update: Callable[[dict, int, int, str], tuple[bool, str]] = updateFileDataAllGenerations,
+        workers: int = METADATA_SEARCH_BATCH_SIZE,
+        publish_interval: float = ENRICHMENT_PUBLISH_SECONDS,
+    ):
+        self.resolve = resolve
+        self.publish = publish
+        self.update = update
+        self.workers = workers
+        self.publish_interval = publish_interval
+        self.jobs: queue.Queue = queue.Queue()
+        self.pending: set = set()
+        self.renames: list[tuple[FileRecord, FileRecord]] = []
+        self.last_published_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.threads: list[threading.Thread] = []
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return self
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._run, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def enqueue(self, record: FileRecord, search_kwargs: dict):
+        key = (record.type, record.item_id, record.file_id)
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            METADATA_ENRICHMENT_PENDING.set(len(self.pending))
+        self.jobs.put((key, record, search_kwargs))
+        self.start()
+        return True
+
+    def enrich(self, record: FileRecord, search_kwargs: dict):
+        metadata, success, _ = self.resolve(**search_kwargs)
+        if not success:
+            METADATA_ENRICHMENTS.labels("failed").inc()
+            return None
+        enriched = FileRecord.fromDict({**record.toDict(), **metadata})
+        if enriched == record:
+            METADATA_ENRICHMENTS.labels("unchanged").inc()
+            return None
+        updated, detail = self.update(metadata, record.item_id, record.file_id, record.type)
+        if not updated:
+            # the file was removed or replaced by a refresh in the meantime
+            logging.debug(f"Skipping metadata update for {record.file_name}: {detail}")
+            METADATA_ENRICHMENTS.labels("stale").inc()
+            return None
+        METADATA_ENRICHMENTS.labels("enriched").inc()
+        return record, enriched
+
+    def _run(self):
+        while True:
+            try:
+                key, record, search_kwargs = self.jobs.get(timeout=self.publish_interval)
+            except queue.Empty:
+                self.flush()
+                continue
+            try:
+                rename = self.enrich(record, search_kwargs)
+                if rename is not None:
+                    with self.lock:
+                        self.renames.append(rename)
+            except Exception as e:
+                logging.error(f"Error enriching metadata for {record.file_name}: {e}")
+                METADATA_ENRICHMENTS.labels("failed").inc()
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                    METADATA_ENRICHMENT_PENDING.set(len(self.pending))
+                self.jobs.task_done()
+            if self.jobs.empty() or time.monotonic() - self.last_published_at >= self.publish_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Publishes the renames resolved since the last flush.
+        """
+        with self.publish_lock:
+            with self.lock:
+                renames, self.renames = self.renames, []
+                self.last_published_at = time.monotonic()
+            if not renames:
+                return
+            try:
+                self.publish(renames)
+                logging.info(f"Published metadata for {len(renames)} files.")
+            except Exception as e:
+                logging.error(f"Error publishing metadata updates: {e}")
+
+    def join(self):
+        self.jobs.join()
+        self.flush()
+
+_enrichment_queue: MetadataEnrichmentQueue | None = None
+_enrichment_queue_lock = threading.Lock()
+
+def getEnrichmentQueue():
+    global _enrichment_queue
+    with _enrichment_queue_lock:
+        if _enrichment_queue is None:
+            _enrichment_queue = MetadataEnrichmentQueue()
+        return _enrichment_queue
+
+def enqueueMetadataEnrichment(record: FileRecord, search_kwargs: dict):
+    return getEnrichmentQueue().enqueue(record, search_kwargs)
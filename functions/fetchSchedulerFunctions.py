@@ -0,0 +1,126 @@
+from library.filesystem import FETCH_CONCURRENCY, FETCH_MAX_CONNECTIONS, FETCH_BANDWIDTH_LIMIT
+from library.metrics import FETCH_WAIT_SECONDS, FETCH_ACTIVE
+from contextlib import contextmanager
+import itertools
+import threading
+import time
+
+# highest priority first
+FETCH_CLASSES = ("playback", "seek", "prefetch", "probe", "warmup")
+
+class FetchRequest:
+    """
+    A fetch waiting for, or holding, a slot of the scheduler.
+    """
+    __slots__ = ("priority", "size", "sequence", "queued_at", "admitted")
+
+    def __init__(self, priority: int, size: int, sequence: int):
+        self.priority = priority
+        self.size = size
+        self.sequence = sequence
+        self.queued_at = time.monotonic()
+        self.admitted = False
+
+    @property
+    def fetch_class(self):
+        return FETCH_CLASSES[self.priority]
+
+class FetchScheduler:
+    """
+    Admits CDN fetches by priority class. Each class has its own concurrency limit, and all classes share a
+    connection limit and a bandwidth limit, which always go to the highest priority fetch that is waiting,
+    so scanner probes and prefetches never hold up playback.
+    """
+    def __init__(self, concurrency: dict[str, int] = FETCH_CONCURRENCY, max_connections: int = FETCH_MAX_CONNECTIONS, bandwidth_limit: float = FETCH_BANDWIDTH_LIMIT):
+        self.limits = [concurrency[fetch_class] for fetch_class in FETCH_CLASSES]
+        self.max_connections = max_connections
+        # the limit is in MB per second, fetches are paced by a token bucket holding one second of bandwidth
+        self.rate = bandwidth_limit * 1024 * 1024
+        self.tokens = self.rate
+        self.refilled_at = time.monotonic()
+        self.active = [0] * len(FETCH_CLASSES)
+        self.waiting: list[FetchRequest] = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def enqueue(self, fetch_class: str, size: int):
+        """
+        Queues a fetch of size bytes. The fetch has to wait for its turn with acquire before it starts.
+        """
+        with self.condition:
+            request = FetchRequest(FETCH_CLASSES.index(fetch_class), size, next(self.sequence))
+            self.waiting.append(request)
+            return request
+
+    def promote(self, request: FetchRequest, fetch_class: str):
+        """
+        Raises the priority of a queued fetch, when a more urgent read ends up waiting for it.
+        """
+        priority = FETCH_CLASSES.index(fetch_class)
+        with self.condition:
+            if request.admitted or priority >= request.priority:
+                return
+            request.priority = priority
+            self.condition.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def _next(self):
+        # the first waiting fetch of the highest priority class that has a free slot
+        candidates = [request for request in self.waiting if self.active[request.priority] < self.limits[request.priority]]
+        return min(candidates, key=lambda request: (request.priority, request.sequence), default=None)
+
+    def acquire(self, request: FetchRequest):
+        """
+        Blocks until the fetch may start.
+        """
+        with self.condition:
+            try:
+                while True:
+                    timeout = None
+                    if self._next() is request and (not self.max_connections or sum(self.active) < self.max_connections):
+                        if not self.rate:
+                            break
+                        self._refill()
+                        # a fetch may overdraw the bucket, the fetches after it wait until the debt is paid off
+                        if self.tokens >= 0:
+                            self.tokens -= request.size
+                            break
+                        timeout = -self.tokens / self.rate
+                    self.condition.wait(timeout)
+            except BaseException:
+                self.waiting.remove(request)
+                self.condition.notify_all()
+                raise
+            self.waiting.remove(request)
+            request.admitted = True
+            self.active[request.priority] += 1
+            # admitting this fetch makes the next one the first in line, which may be able to start too
+            self.condition.notify_all()
+        FETCH_WAIT_SECONDS.labels(request.fetch_class).observe(time.monotonic() - request.queued_at)
+        FETCH_ACTIVE.labels(request.fetch_class).inc()
+
+    def release(self, request: FetchRequest):
+        """
+        Frees the slot of a started fetch, or drops a fetch that never started.
+        """
+        with self.condition:
+            if request.admitted:
+                request.admitted = False
+                self.active[request.priority] -= 1
+                FETCH_ACTIVE.labels(request.fetch_class).dec()
+            elif request in self.waiting:
+                self.waiting.remove(request)
+            self.condition.notify_all()
+
+    @contextmanager
+    def fetch(self, fetch_class: str, size: int):
+        request = self.enqueue(fetch_class, size)
+        try:
+            self.acquire(request)
+            yield request
+        finally:
+            self.release(request)
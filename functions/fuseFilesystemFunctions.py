@@ -1,13 +1,16 @@
 from library.app import RAW_MODE, ENABLE_AUDIO
 import os
-from library.filesystem import MOUNT_PATH
+from library.filesystem import FUSE_MOUNT_PATH, FUSE_ATTR_TIMEOUT, FUSE_ENTRY_TIMEOUT, FUSE_KERNEL_CACHE
 import stat
 import errno
-from functions.torboxFunctions import getDownloadLink, downloadFile
+from functions.streamFunctions import getStreamManager
 import time
 import sys
 import logging
-from functions.appFunctions import getAllUserDownloads
+from functions.snapshotFunctions import getLibrarySnapshot
+from functions.recordFunctions import getStableInode
+from functions.pathIndexFunctions import buildPathIndex
+from library.metrics import FUSE_READ_SECONDS, FUSE_READ_BYTES
 import threading
 from sys import platform
 
@@ -23,140 +26,35 @@ if not hasattr(fuse, '__version__'):
 
 fuse.fuse_python_api = (0, 2)
 
-LINK_AGE = 3 * 60 * 60 # 3 hours
+MOUNTED_AT = int(time.time()) # fallback timestamp for entries without a creation time
 FUSE_SERVER = None
+FILES_RELOAD_FALLBACK_SECONDS = 3600
 
 class VirtualFileSystem:
     def __init__(self, files_list):
         self.files = files_list
-        self.structure = self._build_structure()
-        self.file_map = self._build_file_map()
-
-    def _build_structure(self):
-        if RAW_MODE:
-            structure = { '/': set() }
-            for f in self.files:
-                original_path = f.get("path")
-                if original_path:
-                    # Split the path into parts
-                    parts = original_path.split('/')
-                    current_path = '/'
-                    for part in parts[:-1]:  # Skip the filename
-                        if part not in structure.get(current_path, set()):
-                            structure.setdefault(current_path, set()).add(part)
-                            current_path = f"{current_path}{part}/"
-                            structure.setdefault(current_path, set())
-            # Ensure consistent ordering
-            sorted_structure = {}
-            for key in structure:
-                sorted_structure[key] = sorted([item for item in structure[key] if item is not None])
-            return sorted_structure
-        else:
-            structure = {
-                '/': ['movies', 'series'],
-                '/movies': set(),
-                '/series': set()
-            }
-
-            if ENABLE_AUDIO:
-                structure['/'].append('music')
-                structure['/music'] = set()
-        
-        
-        for f in self.files:
-            media_type = f.get('metadata_mediatype')
-            root_folder = f.get('metadata_rootfoldername')
-
-            if not root_folder:
-                continue
-            
-            if media_type == 'movie':
-                path = f'/movies/{root_folder}'
-                structure['/movies'].add(root_folder)
-                
-                if path not in structure:
-                    structure[path] = set()
-                structure[path].add(f.get('metadata_filename'))
-                
-            elif media_type == 'music':
-                if '/music' not in structure:
-                    if 'music' not in structure['/']:
-                        structure['/'].append('music')
-                    structure['/music'] = set()
-
-                path = f'/music/{root_folder}'
-                structure['/music'].add(root_folder)
-
-                if path not in structure:
-                    structure[path] = set()
-                structure[path].add(f.get('metadata_filename'))
-
-            else:
-                metadata_foldername = f.get('metadata_foldername')
-                if not metadata_foldername:
-                    continue
-
-                path = f'/series/{root_folder}'
-                structure['/series'].add(root_folder)
-                
-                if path not in structure:
-                    structure[path] = set()
-                structure[path].add(metadata_foldername)
-                
-                season_path = f'{path}/{metadata_foldername}'
-                if season_path not in structure:
-                    structure[season_path] = set()
-                structure[season_path].add(f.get('metadata_filename'))
-        
-        # consistent ordering
-        sorted_structure = {}
-        for key in structure:
-            sorted_structure[key] = sorted([item for item in structure[key] if item is not None])
-
-        return sorted_structure
-
-    def _build_file_map(self):
-        file_map = {}
-        for f in self.files:
-            if RAW_MODE:
-                original_path = f.get("path")
-                if original_path:
-                    path = f'/{original_path}'
-                    file_map[path] = f
-            else:
-                media_type = f.get('metadata_mediatype')
-                root_folder = f.get("metadata_rootfoldername")
-
-                if not root_folder:
-                    continue
-
-                if media_type == 'movie':
-                    path = f'/movies/{root_folder}/{f.get("metadata_filename")}'
-                    file_map[path] = f
-                elif media_type == 'music':
-                    path = f'/music/{root_folder}/{f.get("metadata_filename")}'
-                    file_map[path] = f
-                else:  # series and anime
-                    metadata_foldername = f.get("metadata_foldername")
-                    if not metadata_foldername:
-                        continue
-                    path = f'/series/{root_folder}/{metadata_foldername}/{f.get("metadata_filename")}'
-                    file_map[path] = f
-
-        return file_map
-
+        self.index = buildPathIndex(self.files, RAW_MODE, ENABLE_AUDIO, MOUNTED_AT)
 
     def is_dir(self, path):
-        return path in self.structure
+        return self.index.isDir(path)
         
     def is_file(self, path):
-        return path in self.file_map
+        return self.index.isFile(path)
         
     def get_file(self, path):
-        return self.file_map.get(path)
+        return self.index.getFile(path)
         
     def list_dir(self, path):
-        return self.structure.get(path, [])
+        return self.index.listDir(path)
+
+    def get_dir_mtime(self, path):
+        return self.index.getDirMtime(path)
+
+    def get_inode(self, path):
+        if self.is_dir(path):
+            return 1 if path == '/' else getStableInode(f"dir:{path}")
+        file_info = self.get_file(path)
+        return file_info.inode if file_info else 0
     
 class FuseStat(fuse.Stat):
     def __init__(self):
@@ -176,25 +74,23 @@ class TorBoxMediaCenterFuse(Fuse):
         super(TorBoxMediaCenterFuse, self).__init__(*args, **kwargs)
 
         self.files = []
+        self.snapshot_version = None
         self.vfs = VirtualFileSystem(self.files)
-        self.file_handles = {}
-        self.next_handle = 1
-        self.cached_links = {}
+        self.streams = getStreamManager()
+        self.links = self.streams.links
         self.refresh_event = threading.Event()
 
-        self.cache = {}
-        self.block_size = 1024 * 1024 * 64  # 64MB Blocks
-        self.max_blocks = 64 # Max 64 blocks in cache (4GB)
-
         threading.Thread(target=self.getFiles, daemon=True).start()
 
     def refreshFiles(self):
-        files = getAllUserDownloads()
-        if files is None:
+        snapshot = getLibrarySnapshot()
+        if snapshot.version == self.snapshot_version:
+            logging.debug(f"Library snapshot {snapshot.version} is unchanged. Keeping the VFS.")
             return
-        self.files = files
+        self.files = list(snapshot.files)
         self.vfs = VirtualFileSystem(self.files)
-        logging.debug(f"Updated {len(self.files)} files in VFS")
+        self.snapshot_version = snapshot.version
+        logging.debug(f"Updated {len(self.files)} files in VFS from library snapshot {snapshot.version}")
 
     def requestRefresh(self):
         self.refresh_event.set()
@@ -202,110 +98,93 @@ class TorBoxMediaCenterFuse(Fuse):
     def getFiles(self):
         while True:
             self.refreshFiles()
-            self.refresh_event.wait(timeout=300)
+            # refresh cycles request a reload, the timeout only guards against a missed request
+            self.refresh_event.wait(timeout=FILES_RELOAD_FALLBACK_SECONDS)
             self.refresh_event.clear()
         
     def getattr(self, path):
         st = FuseStat()
-        now = int(time.time())
-        st.st_atime = now
-        st.st_mtime = now
-        st.st_ctime = now
-        
         st.st_uid = os.getuid()
         st.st_gid = os.getgid()
-        
-        if self.vfs.is_dir(path):
+
+        vfs = self.vfs
+        if vfs.is_dir(path):
             st.st_mode = stat.S_IFDIR | 0o755
             st.st_nlink = 2
-            return st
-        elif self.vfs.is_file(path):
-            file_info = self.vfs.get_file(path)
+            st.st_ino = vfs.get_inode(path)
+            mtime = vfs.get_dir_mtime(path)
+        elif vfs.is_file(path):
+            file_info = vfs.get_file(path)
             if not file_info:
                 return -errno.ENOENT
             st.st_mode = stat.S_IFREG | 0o444
             st.st_nlink = 1
-            st.st_size = file_info.get('file_size', 0)
-            return st
-            
-        # Not found
-        return -errno.ENOENT
+            st.st_size = file_info.file_size or 0
+            st.st_ino = file_info.inode
+            mtime = file_info.created_at or MOUNTED_AT
+        else:
+            # Not found
+            return -errno.ENOENT
+
+        st.st_atime = mtime
+        st.st_mtime = mtime
+        st.st_ctime = mtime
+        return st
     
     def readdir(self, path, _):
-        if not self.vfs.is_dir(path):
+        vfs = self.vfs
+        if not vfs.is_dir(path):
             return -errno.ENOENT
-            
-        yield fuse.Direntry('.')
-        yield fuse.Direntry('..')
-        
-        for item in self.vfs.list_dir(path):
-            yield fuse.Direntry(item)
+
+        # with use_ino the kernel takes the inodes from here too, they have to match what getattr reports
+        yield fuse.Direntry('.', ino=vfs.get_inode(path))
+        yield fuse.Direntry('..', ino=vfs.get_inode(os.path.dirname(path)))
+
+        for item in vfs.list_dir(path):
+            yield fuse.Direntry(item, ino=vfs.get_inode(os.path.join(path, item)))
     
-    def open(self, _, flags):
+    def open(self, path, flags):
         accmode = os.O_RDONLY | os.O_WRONLY | os.O_RDWR
         if (flags & accmode) != os.O_RDONLY:
             return -errno.EACCES
+
+        file = self.vfs.get_file(path)
+        if not file:
+            return -errno.ENOENT
+        # the handle resolves the CDN link while the player is still setting up, so the first read doesn't wait on the API
+        return self.streams.open(file)
     
-    def read(self, path, size, offset):
+    def read(self, path, size, offset, fh=None):
         logging.debug(f"READ Path: {path}")
         logging.debug(f"READ Size: {size}")
         logging.debug(f"READ Offset: {offset}")
-        file = self.vfs.get_file(path)
 
-        if not file:
-            return -errno.ENOENT
-        
-        current_time = time.time()
-        if path not in self.cached_links:
-            self.cached_links[path] = {
-                'link': getDownloadLink(file.get('download_link')),
-                'timestamp': current_time
-            }
-        elif current_time - self.cached_links[path]['timestamp'] > LINK_AGE:
-            download_link = getDownloadLink(file.get('download_link'))
-            self.cached_links[path] = {
-                'link': download_link,
-                'timestamp': current_time
-            }
-        download_link = self.cached_links[path]['link']
-        
-        start_block = offset // self.block_size
-        end_block = (offset + size - 1) // self.block_size
-        
-        buffer = bytearray()
-        
-        for block_index in range(start_block, end_block + 1):
-            block_offset = block_index * self.block_size
-            block_end = min((block_index + 1) * self.block_size - 1, file.get('file_size') - 1)
-            current_block_size = block_end - block_offset + 1
-            
-            # check for block
-            if (path, block_index) not in self.cache:
-                logging.debug(f"Cache miss for block {block_index}, fetching...")
-                # get block
-                block_data = downloadFile(download_link, current_block_size, block_offset)
-                if not block_data:
-                    return -errno.EIO
-                # save block to cache
-                self.cache[(path, block_index)] = block_data
-                # lru cache
-                if len(self.cache) > self.max_blocks * len(self.cached_links):
-                    keys_to_remove = list(self.cache.keys())[:len(self.cache) - self.max_blocks]
-                    for key in keys_to_remove:
-                        del self.cache[key]
-            # get block from cache
-            block_data = self.cache[(path, block_index)]
-            
-            start_offset_in_block = max(0, offset - block_offset)
-            end_offset_in_block = min(len(block_data), offset + size - block_offset)
-            
-            buffer.extend(block_data[start_offset_in_block:end_offset_in_block])
-        
-        return bytes(buffer)
+        handle = fh
+        if handle is None:
+            file = self.vfs.get_file(path)
+            if not file:
+                return -errno.ENOENT
+            handle = self.streams.open(file)
+
+        started_at = time.perf_counter()
+        try:
+            data = self.streams.read(handle, size, offset)
+        except Exception as e:
+            logging.error(f"Error reading {path} at offset {offset}: {e}")
+            return -errno.EIO
+        finally:
+            if fh is None:
+                self.streams.release(handle)
+            FUSE_READ_SECONDS.observe(time.perf_counter() - started_at)
+
+        if data is None:
+            return -errno.EIO
+        FUSE_READ_BYTES.inc(len(data))
+        return data
     
-    def release(self, _, fh):
-        if fh in self.file_handles:
-            del self.file_handles[fh]
+    def release(self, _, __, fh=None):
+        if fh is not None:
+            self.streams.release(fh)
         return 0
     
 def runFuse():
@@ -320,7 +199,7 @@ def runFuse():
     server.parser.add_option(
         mountopt="root",
         metavar="PATH",
-        default=MOUNT_PATH,
+        default=FUSE_MOUNT_PATH,
         help="Mount point for the filesystem",
     )
     if platform != "darwin":
@@ -330,12 +209,26 @@ def runFuse():
     server.fuse_args.add(
         "allow_other"
     )
+    # stable inodes and timestamps let the kernel answer repeated scans from its own caches
+    server.fuse_args.add(
+        "use_ino"
+    )
+    server.fuse_args.add(
+        f"attr_timeout={FUSE_ATTR_TIMEOUT:g}"
+    )
+    server.fuse_args.add(
+        f"entry_timeout={FUSE_ENTRY_TIMEOUT:g}"
+    )
+    if FUSE_KERNEL_CACHE:
+        server.fuse_args.add(
+            "kernel_cache"
+        )
     server.fuse_args.add(
         "-f"
     )
     server.parse(values=server, errex=1)
     try:
-        server.fuse_args.mountpoint = MOUNT_PATH # type: ignore[assignment]
+        server.fuse_args.mountpoint = FUSE_MOUNT_PATH # type: ignore[assignment]
     except OSError as e:
         logging.error(f"Error changing directory: {e}")
         sys.exit(1)
@@ -356,7 +249,7 @@ def requestFuseRefresh():
 
 def unmountFuse():
     try:
-        os.system("fusermount -u " + MOUNT_PATH)
+        os.system("fusermount -u " + FUSE_MOUNT_PATH)
     except OSError as e:
         logging.error(f"Error unmounting: {e}")
         sys.exit(1)
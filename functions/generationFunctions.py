@@ -0,0 +1,210 @@
+from library.metrics import REFRESH_CHECKPOINTS
+from functions.databaseFunctions import updateFileData, promoteDatabase
+from typing import Callable
+import threading
+import logging
+import shutil
+import json
+import time
+import uuid
+import os
+
+STAGING_SUFFIX = "_staging"
+CHECKPOINT_DIR = "refresh_checkpoints"
+CHECKPOINT_FILES = 250 # processed files between checkpoints
+CHECKPOINT_SECONDS = 10 # longest time processed files wait before they are checkpointed
+CHECKPOINT_MAX_AGE_SECONDS = 60 * 60 * 6 # older checkpoints are discarded, their listing is too stale to resume
+
+def getStagingName(type: str):
+    return f"{type}{STAGING_SUFFIX}"
+
+def writeJsonAtomic(path: str, data):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+class RefreshCheckpoint:
+    """
+    Persisted progress of a staged refresh of one download type: the listing pages fetched so far and the files
+    already stored in the staging generation. Files that were published with a deferred metadata lookup are
+    processed again on resume, which resolves them from the metadata cache if their lookup finished.
+    """
+    def __init__(self, type: str, directory: str = CHECKPOINT_DIR, clock: Callable[[], float] = time.time):
+        self.type = type
+        self.directory = os.path.join(directory, type)
+        self.clock = clock
+        self.generation = None
+        self.started_at = None
+        self.next_offset = 0
+        self.listing_complete = False
+        self.processed: set[tuple[int, int]] = set()
+        self.deferred: set[tuple[int, int]] = set()
+        self.unsaved: list[tuple[int, int, bool]] = []
+        self.saved_at = clock()
+        self.lock = threading.Lock()
+
+    def getPath(self, *parts: str):
+        return os.path.join(self.directory, *parts)
+
+    def load(self):
+        """
+        Loads the checkpoint of an interrupted refresh. Returns False if there is none that can be resumed.
+        """
+        try:
+            with open(self.getPath("state.json")) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if state.get("type") != self.type or self.clock() - state.get("started_at", 0) > CHECKPOINT_MAX_AGE_SECONDS:
+            return False
+        self.generation = state.get("generation")
+        self.started_at = state.get("started_at")
+        self.next_offset = state.get("next_offset", 0)
+        self.listing_complete = state.get("listing_complete", False)
+
+        try:
+            with open(self.getPath("processed.jsonl")) as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                item_id, file_id, deferred = json.loads(line)
+            except ValueError:
+                # the last line can be cut short by a crash
+                continue
+            self.processed.add((item_id, file_id))
+            if deferred:
+                self.deferred.add((item_id, file_id))
+            else:
+                self.deferred.discard((item_id, file_id))
+        return True
+
+    def begin(self):
+        """
+        Starts a new generation, discarding any previous checkpoint.
+        """
+        self.clear()
+        os.makedirs(self.getPath("pages"), exist_ok=True)
+        self.generation = uuid.uuid4().hex
+        self.started_at = self.clock()
+        self.next_offset = 0
+        self.listing_complete = False
+        self.processed.clear()
+        self.deferred.clear()
+        self.saveState()
+
+    def saveState(self):
+        writeJsonAtomic(self.getPath("state.json"), {
+            "type": self.type,
+            "generation": self.generation,
+            "started_at": self.started_at,
+            "next_offset": self.next_offset,
+            "listing_complete": self.listing_complete,
+        })
+
+    def savePage(self, offset: int, next_offset: int, items: list[dict], complete: bool):
+        writeJsonAtomic(self.getPath("pages", f"{offset:010d}.json"), items)
+        self.next_offset = next_offset
+        self.listing_complete = complete
+        self.saveState()
+        REFRESH_CHECKPOINTS.labels(self.type, "page").inc()
+
+    def iterPages(self):
+        """
+        Yields the pages fetched so far, one at a time.
+        """
+        for page in sorted(os.listdir(self.getPath("pages"))):
+            if not page.endswith(".json"):
+                continue
+            with open(self.getPath("pages", page)) as file:
+                yield json.load(file)
+
+    def isProcessed(self, item_id: int, file_id: int):
+        return (item_id, file_id) in self.processed and (item_id, file_id) not in self.deferred
+
+    def getCompletedFiles(self):
+        return self.processed - self.deferred
+
+    def retainFiles(self, keys: set[tuple[int, int]]):
+        """
+        Limits the processed files to the ones the staging database still has. Files that were skipped
+        without being stored are cheap to process again.
+        """
+        self.processed &= keys
+        self.deferred.clear()
+
+    def markProcessed(self, item_id: int, file_id: int, deferred: bool = False):
+        with self.lock:
+            self.unsaved.append((item_id, file_id, deferred))
+            due = len(self.unsaved) >= CHECKPOINT_FILES or self.clock() - self.saved_at >= CHECKPOINT_SECONDS
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Appends the files processed since the last checkpoint.
+        """
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, []
+            self.saved_at = self.clock()
+            if not unsaved:
+                return
+            with open(self.getPath("processed.jsonl"), "a") as file:
+                file.write("".join(f"{json.dumps(entry)}\n" for entry in unsaved))
+                file.flush()
+                os.fsync(file.fileno())
+            for item_id, file_id, deferred in unsaved:
+                self.processed.add((item_id, file_id))
+                if deferred:
+                    self.deferred.add((item_id, file_id))
+                else:
+                    self.deferred.discard((item_id, file_id))
+        REFRESH_CHECKPOINTS.labels(self.type, "files").inc()
+        logging.debug(f"Checkpointed {len(unsaved)} {self.type} files.")
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+_staging_tables: dict[str, str] = {}
+_staging_lock = threading.Lock()
+
+def setStagingTable(type: str):
+    """
+    Marks a refresh of type as writing to its staging generation, so metadata updates reach both generations.
+    """
+    with _staging_lock:
+        _staging_tables[type] = getStagingName(type)
+    return _staging_tables[type]
+
+def clearStagingTable(type: str):
+    with _staging_lock:
+        _staging_tables.pop(type, None)
+
+def promoteStagingTable(type: str):
+    """
+    Makes the staging generation of type live, replacing the previous generation in one step.
+    """
+    with _staging_lock:
+        table = _staging_tables.pop(type, None) or getStagingName(type)
+        success, detail = promoteDatabase(table, type)
+    if success:
+        REFRESH_CHECKPOINTS.labels(type, "promoted").inc()
+    return success, detail
+
+def updateFileDataAllGenerations(data: dict, item_id: int, file_id: int, type: str):
+    """
+    Updates a file in the live generation and, while a refresh is running, in the staging generation.
+    """
+    staged = False
+    with _staging_lock:
+        table = _staging_tables.get(type)
+        if table is not None:
+            staged, _ = updateFileData(data, item_id, file_id, table)
+    updated, detail = updateFileData(data, item_id, file_id, type)
+    if staged and not updated:
+        return True, "Data updated in the staging generation."
+    return updated, detail
@@ -0,0 +1,198 @@
+from functions.databaseFunctions import getDatabase, getDatabaseLock
+from functions.mediaFunctions import cleanYear
+from collections import defaultdict
+from tinydb import Query
+import threading
+import logging
+import time
+import re
+
+IDENTITY_INDEX_DB_NAME = "metadata_identity_index"
+IDENTITY_INDEX_SCHEMA_VERSION = 1
+IDENTITY_MIN_SIMILARITY = 0.8 # trigram dice coefficient needed for an approximate match
+IDENTITY_STOPWORDS = {"the", "a", "an", "and", "of"}
+IDENTITY_MAX_CANDIDATES = 200
+SEQUEL_TOKENS = {"ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x"}
+
+def getIdentityTokens(title: str | None):
+    """
+    Splits a title into comparable tokens. Runs of single letters are joined so "S.H.I.E.L.D" matches "SHIELD",
+    a lone "s" is joined to the previous word so "Marvel's" matches "Marvels", and stopwords are dropped.
+    """
+    if not title:
+        return []
+    words = re.sub(r"[^a-z0-9]+", " ", str(title).lower().replace("'", "")).split()
+    tokens = []
+    letters = ""
+    for word in words:
+        if len(word) == 1 and word.isalpha():
+            letters += word
+            continue
+        if letters:
+            tokens.append(letters)
+            letters = ""
+        tokens.append(word)
+    if letters:
+        tokens.append(letters)
+    return [token for token in tokens if token not in IDENTITY_STOPWORDS]
+
+def getIdentityKey(title: str | None):
+    """
+    Compact form used for similarity. Spacing differences like "Spider-Man" and "Spiderman" disappear.
+    """
+    return "".join(getIdentityTokens(title))
+
+def getSequelTokens(title: str | None):
+    """
+    Numbers and roman numerals, which must match exactly so sequels and parts are never confused.
+    """
+    return frozenset(token for token in getIdentityTokens(title) if token.isdigit() or token in SEQUEL_TOKENS)
+
+def getTrigrams(value: str):
+    padded = f"  {value} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+def getSimilarity(first: set, second: set):
+    if not first or not second:
+        return 0.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+class IdentityEntry:
+    __slots__ = ("id", "metadata", "media_type", "year", "aliases", "trigrams", "sequel_tokens")
+
+    def __init__(self, id: str, metadata: dict, aliases: list[str]):
+        self.id = id
+        self.metadata = metadata
+        self.media_type = metadata.get("metadata_mediatype")
+        self.year = cleanYear(metadata.get("metadata_years"))
+        self.aliases = list(dict.fromkeys(alias for alias in aliases if alias))
+        self.trigrams = {alias: getTrigrams(alias) for alias in self.aliases}
+        self.sequel_tokens = getSequelTokens(metadata.get("metadata_title"))
+
+class IdentityIndex:
+    """
+    Local index of resolved titles, so releases named differently from ones already resolved skip the search API.
+    Backed by a TinyDB table, with an alias map and a trigram inverted index kept in memory.
+    """
+    def __init__(self, db=None, db_lock=None, min_similarity: float = IDENTITY_MIN_SIMILARITY):
+        self.db = db
+        self.db_lock = db_lock
+        self.min_similarity = min_similarity
+        self.entries: dict[str, IdentityEntry] = {}
+        self.aliases: dict[str, set[str]] = defaultdict(set)
+        self.trigram_index: dict[str, set[str]] = defaultdict(set)
+        self.lock = threading.RLock()
+        if db is not None:
+            self.load()
+
+    def load(self):
+        with self.db_lock:
+            records = self.db.all()
+        for record in records:
+            if record.get("schema_version") != IDENTITY_INDEX_SCHEMA_VERSION:
+                continue
+            self.indexEntry(IdentityEntry(record["id"], record["metadata"], record.get("aliases", [])))
+        logging.debug(f"Loaded {len(self.entries)} metadata identities.")
+
+    def indexEntry(self, entry: IdentityEntry):
+        with self.lock:
+            self.entries[entry.id] = entry
+            for alias, trigrams in entry.trigrams.items():
+                self.aliases[alias].add(entry.id)
+                for trigram in trigrams:
+                    self.trigram_index[trigram].add(entry.id)
+
+    def add(self, metadata: dict, titles: list[str | None]):
+        """
+        Records a resolved identity under its own title and the release titles that resolved to it.
+        """
+        title_key = getIdentityKey(metadata.get("metadata_title"))
+        if not title_key:
+            return None
+        entry_id = f"{metadata.get('metadata_mediatype')}:{title_key}:{cleanYear(metadata.get('metadata_years')) or ''}"
+        aliases = [title_key, *(getIdentityKey(title) for title in titles)]
+        with self.lock:
+            existing = self.entries.get(entry_id)
+            if existing is not None:
+                if set(aliases) <= set(existing.aliases):
+                    return existing
+                aliases = existing.aliases + aliases
+            entry = IdentityEntry(entry_id, metadata, aliases)
+            self.indexEntry(entry)
+        if self.db is not None:
+            with self.db_lock:
+                self.db.upsert({
+                    "id": entry.id,
+                    "schema_version": IDENTITY_INDEX_SCHEMA_VERSION,
+                    "metadata": entry.metadata,
+                    "aliases": entry.aliases,
+                    "updated_at": int(time.time()),
+                }, Query().id == entry.id)
+        return entry
+
+    def isCompatible(self, entry: IdentityEntry, year: int | None, expects_series: bool):
+        if expects_series != (entry.media_type in ("series", "anime")):
+            return False
+        if year is not None and entry.year is not None and abs(year - entry.year) > 1:
+            return False
+        return True
+
+    def lookup(self, title: str | None, year: str | int | None = None, expects_series: bool = False):
+        """
+        Returns the metadata of the closest known identity, or None if there is no single confident match.
+        """
+        key = getIdentityKey(title)
+        if not key:
+            return None
+        year = cleanYear(year)
+        trigrams = getTrigrams(key)
+        sequel_tokens = getSequelTokens(title)
+
+        with self.lock:
+            exact = [self.entries[entry_id] for entry_id in self.aliases.get(key, ())]
+            exact = [entry for entry in exact if self.isCompatible(entry, year, expects_series)]
+            if exact:
+                return self.pickUnique([(1.0, entry) for entry in exact], year)
+
+            candidate_counts: dict[str, int] = defaultdict(int)
+            for trigram in trigrams:
+                for entry_id in self.trigram_index.get(trigram, ()):
+                    candidate_counts[entry_id] += 1
+            candidates = sorted(candidate_counts, key=candidate_counts.get, reverse=True)[:IDENTITY_MAX_CANDIDATES]
+
+            matches = []
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if not self.isCompatible(entry, year, expects_series) or entry.sequel_tokens != sequel_tokens:
+                    continue
+                similarity = max(getSimilarity(trigrams, alias_trigrams) for alias_trigrams in entry.trigrams.values())
+                if similarity >= self.min_similarity:
+                    matches.append((similarity, entry))
+        return self.pickUnique(matches, year)
+
+    def pickUnique(self, matches: list[tuple[float, IdentityEntry]], year: int | None):
+        if not matches:
+            return None
+        best_similarity = max(similarity for similarity, _ in matches)
+        best = [entry for similarity, entry in matches if similarity == best_similarity]
+        if year is not None:
+            same_year = [entry for entry in best if entry.year == year]
+            best = same_year or best
+        # two different shows or movies are equally close, for example remakes without a year
+        if len(best) != 1:
+            return None
+        return dict(best[0].metadata)
+
+_identity_index: IdentityIndex | None = None
+_identity_index_lock = threading.Lock()
+
+def getIdentityIndex():
+    """
+    Returns the identity index for the current metadata database, loading it on first use.
+    """
+    global _identity_index
+    db = getDatabase(IDENTITY_INDEX_DB_NAME)
+    with _identity_index_lock:
+        if _identity_index is None or _identity_index.db is not db:
+            _identity_index = IdentityIndex(db, getDatabaseLock(IDENTITY_INDEX_DB_NAME))
+        return _identity_index
@@ -0,0 +1,182 @@
+from functions.torboxFunctions import getDownloadLink, downloadFile
+from functions.recordFunctions import FileRecord
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import threading
+import logging
+import httpx
+import time
+
+LINK_AGE = 3 * 60 * 60 # 3 hours
+LINK_REFRESH_MARGIN = 15 * 60 # refresh links 15 minutes before they expire
+LINK_HOT_SECONDS = 30 * 60 # only links used in the last 30 minutes are refreshed in the background
+LINK_REFRESH_INTERVAL = 60 # seconds between background refresh passes
+MAX_CACHED_LINKS = 512
+LINK_RESOLVE_WORKERS = 4
+EXPIRED_LINK_STATUS_CODES = (httpx.codes.FORBIDDEN, httpx.codes.GONE)
+
+def getLinkKey(file: FileRecord):
+    return (file.type, file.item_id, file.file_id)
+
+class CachedLink:
+    __slots__ = ("link", "resolved_at", "last_used")
+
+    def __init__(self, link: str, resolved_at: float):
+        self.link = link
+        self.resolved_at = resolved_at
+        self.last_used = resolved_at
+
+class LinkManager:
+    """
+    Resolves and caches CDN links for files.
+
+    Links are resolved when a file is opened, refreshed in the background before they expire while
+    the file is still being used, and evicted least recently used first once the cache is full.
+    """
+    def __init__(self, max_links: int = MAX_CACHED_LINKS, link_age: float = LINK_AGE, refresh_margin: float = LINK_REFRESH_MARGIN, resolver=getDownloadLink):
+        self.max_links = max_links
+        self.link_age = link_age
+        self.refresh_margin = refresh_margin
+        self.resolver = resolver
+        self.links: OrderedDict[tuple, CachedLink] = OrderedDict()
+        self.pending: dict[tuple, threading.Event] = {}
+        self.pinned: dict[tuple, int] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=LINK_RESOLVE_WORKERS, thread_name_prefix="link-resolver")
+        self.stop_event = threading.Event()
+        self.refresh_thread = None
+
+    def start(self):
+        if self.refresh_thread is None:
+            self.refresh_thread = threading.Thread(target=self._refreshLoop, daemon=True)
+            self.refresh_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _resolve(self, file: FileRecord):
+        key = getLinkKey(file)
+        while True:
+            with self.lock:
+                event = self.pending.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self.pending[key] = event
+                    break
+            # another thread is already resolving this link, reuse its result unless it failed
+            event.wait()
+            link = self._getCached(key, time.time())
+            if link is not None:
+                return link
+
+        try:
+            link = self.resolver(file.download_link, use_cache=False)
+            now = time.time()
+            with self.lock:
+                cached = self.links.get(key)
+                entry = CachedLink(link, now)
+                if cached is not None:
+                    entry.last_used = cached.last_used
+                self.links[key] = entry
+                self.links.move_to_end(key)
+                self._evict()
+            return link
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+            event.set()
+
+    def _evict(self):
+        # pinned links belong to open file handles and are never evicted
+        evictable = (cached_key for cached_key in list(self.links) if cached_key not in self.pinned)
+        while len(self.links) > self.max_links:
+            evicted_key = next(evictable, None)
+            if evicted_key is None:
+                break
+            del self.links[evicted_key]
+            logging.debug(f"Evicted cold link for {evicted_key}")
+
+    def _getCached(self, key: tuple, now: float):
+        with self.lock:
+            cached = self.links.get(key)
+            if cached is None or now - cached.resolved_at > self.link_age:
+                return None
+            cached.last_used = now
+            self.links.move_to_end(key)
+            return cached.link
+
+    def prefetch(self, file: FileRecord):
+        """
+        Starts resolving the link for a file in the background, for example when it is opened.
+        """
+        if self._getCached(getLinkKey(file), time.time()) is not None:
+            return
+        try:
+            self.executor.submit(self._resolve, file)
+        except RuntimeError:
+            pass
+
+    def getLink(self, file: FileRecord):
+        link = self._getCached(getLinkKey(file), time.time())
+        if link is not None:
+            return link
+        return self._resolve(file)
+
+    def pin(self, file: FileRecord):
+        """
+        Keeps the link of an open file cached and refreshed until it is unpinned.
+        """
+        key = getLinkKey(file)
+        with self.lock:
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin(self, file: FileRecord):
+        key = getLinkKey(file)
+        with self.lock:
+            count = self.pinned.get(key, 0) - 1
+            if count > 0:
+                self.pinned[key] = count
+            else:
+                self.pinned.pop(key, None)
+            self._evict()
+
+    def invalidate(self, file: FileRecord):
+        with self.lock:
+            self.links.pop(getLinkKey(file), None)
+
+    def download(self, file: FileRecord, size: int, offset: int = 0):
+        """
+        Downloads a range of a file, re-resolving the link once if the CDN reports it as expired.
+        """
+        link = self.getLink(file)
+        try:
+            return downloadFile(link, size, offset)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in EXPIRED_LINK_STATUS_CODES:
+                raise
+            logging.info(f"CDN link for {file.file_name} returned {e.response.status_code}. Resolving a new link...")
+            self.invalidate(file)
+            return downloadFile(self._resolve(file), size, offset)
+
+    def _refreshLoop(self):
+        while not self.stop_event.wait(timeout=LINK_REFRESH_INTERVAL):
+            self.refreshExpiring()
+
+    def refreshExpiring(self):
+        """
+        Re-resolves hot links that are about to expire so reads never wait on the API.
+        """
+        now = time.time()
+        with self.lock:
+            expiring = [
+                key for key, cached in self.links.items()
+                if now - cached.resolved_at > self.link_age - self.refresh_margin
+                and (key in self.pinned or now - cached.last_used < LINK_HOT_SECONDS)
+            ]
+        for type, item_id, file_id in expiring:
+            try:
+                self._resolve(FileRecord(type=type, item_id=item_id, file_id=file_id))
+            except Exception as e:
+                logging.warning(f"Error refreshing link for {type} {item_id}/{file_id}: {e}")
+        return len(expiring)
@@ -0,0 +1,75 @@
+from functions.generationFunctions import writeJsonAtomic
+import logging
+import json
+import os
+
+LISTING_CACHE_DIR = "listing_cache"
+
+class ListingPageCache:
+    """
+    Keeps listing pages with their ETag and Last-Modified validators, so pages the API reports as unchanged
+    are read from disk instead of downloaded again. Pages without validators are not kept.
+    """
+    def __init__(self, directory: str = LISTING_CACHE_DIR):
+        self.directory = directory
+
+    def getPath(self, type: str, offset: int, suffix: str):
+        return os.path.join(self.directory, type, f"{offset:010d}.{suffix}")
+
+    def getValidators(self, type: str, offset: int, limit: int):
+        try:
+            with open(self.getPath(type, offset, "meta.json")) as file:
+                validators = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if validators.get("limit") != limit or not os.path.exists(self.getPath(type, offset, "json")):
+            return None
+        return validators
+
+    def getHeaders(self, type: str, offset: int, limit: int):
+        """
+        Returns the conditional request headers for a page, or no headers if it is not cached.
+        """
+        validators = self.getValidators(type, offset, limit)
+        if validators is None:
+            return {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def load(self, type: str, offset: int):
+        try:
+            with open(self.getPath(type, offset, "json"), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def store(self, type: str, offset: int, limit: int, headers, content: bytes):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            self.discard(type, offset)
+            return
+        try:
+            os.makedirs(os.path.join(self.directory, type), exist_ok=True)
+            # the content is written first, so validators never point at an older page
+            temporary_path = f"{self.getPath(type, offset, 'json')}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(content)
+            os.replace(temporary_path, self.getPath(type, offset, "json"))
+            writeJsonAtomic(self.getPath(type, offset, "meta.json"), {"etag": etag, "last_modified": last_modified, "limit": limit})
+        except OSError as e:
+            logging.warning(f"Unable to cache {type} listing page at offset {offset}: {e}")
+            self.discard(type, offset)
+
+    def discard(self, type: str, offset: int):
+        for suffix in ("meta.json", "json"):
+            try:
+                os.remove(self.getPath(type, offset, suffix))
+            except FileNotFoundError:
+                pass
+
+listing_cache = ListingPageCache()
@@ -0,0 +1,147 @@
+from functions.recordFunctions import FileRecord
+from array import array
+from typing import Iterable
+import sys
+
+ROOT = 0
+CATEGORY_FOLDERS = ("movies", "series")
+
+def getVirtualPath(file: FileRecord, raw_mode: bool):
+    """
+    Returns the folder names and file name a file is mounted at, or None if it is not mounted.
+    """
+    if raw_mode:
+        if not file.path:
+            return None
+        parts = [part for part in file.path.split("/") if part]
+        if parts and parts[-1] == file.file_name:
+            # shares the record's string instead of keeping a copy per file
+            parts[-1] = file.file_name
+        return parts or None
+    root_folder = file.metadata_rootfoldername
+    if not root_folder or not file.metadata_filename:
+        return None
+    if file.metadata_mediatype == "movie":
+        return ["movies", root_folder, file.metadata_filename]
+    if file.metadata_mediatype == "music":
+        return ["music", root_folder, file.metadata_filename]
+    # series and anime
+    if not file.metadata_foldername:
+        return None
+    return ["series", root_folder, file.metadata_foldername, file.metadata_filename]
+
+class PathIndex:
+    """
+    Directory tree of a mount. Directories are numbered, and each has one table from entry names to entries,
+    where files are stored as the bitwise complement of their position in files. Lookups walk one table per
+    path component, and folder names are interned so each is stored once however often it repeats.
+    """
+    def __init__(self, default_mtime: int = 0):
+        self.children: list[dict[str, int]] = [{}]
+        self.parents = array("I", [ROOT])
+        self.mtimes = array("q", [0])
+        self.files: list[FileRecord] = []
+        self.default_mtime = default_mtime
+
+    def addDir(self, parent: int, name: str):
+        entries = self.children[parent]
+        entry = entries.get(name)
+        if entry is not None and entry >= 0:
+            return entry
+        directory = len(self.children)
+        self.children.append({})
+        self.parents.append(parent)
+        self.mtimes.append(0)
+        # a folder replaces a file with the same name, like it did when folders were checked first
+        entries[sys.intern(name)] = directory
+        return directory
+
+    def addFile(self, parts: list[str], file: FileRecord, mtime: int):
+        """
+        Adds a file and its folders. Returns False if a folder already has the file's name.
+        """
+        directory = ROOT
+        for name in parts[:-1]:
+            directory = self.addDir(directory, name)
+        name = parts[-1]
+        entries = self.children[directory]
+        entry = entries.get(name)
+        if entry is not None and entry >= 0:
+            return False
+        if entry is None:
+            # file names are rarely repeated, so unlike folder names they are not interned
+            entries[name] = ~len(self.files)
+            self.files.append(file)
+        else:
+            # the last file with a path wins
+            self.files[~entry] = file
+        # a directory is as new as the newest file below it, so scanners only revisit changed folders
+        while True:
+            if self.mtimes[directory] < mtime:
+                self.mtimes[directory] = mtime
+            if directory == ROOT:
+                break
+            directory = self.parents[directory]
+        return True
+
+    def finish(self):
+        """
+        Sorts every directory's entries by name, so listings come out in a consistent order.
+        """
+        for directory, entries in enumerate(self.children):
+            names = list(entries)
+            if names != sorted(names):
+                self.children[directory] = {name: entries[name] for name in sorted(names)}
+        return self
+
+    def resolve(self, path: str):
+        entry = ROOT
+        for name in path.split("/"):
+            if not name:
+                continue
+            if entry < 0:
+                return None
+            entry = self.children[entry].get(name)
+            if entry is None:
+                return None
+        return entry
+
+    def isDir(self, path: str):
+        entry = self.resolve(path)
+        return entry is not None and entry >= 0
+
+    def isFile(self, path: str):
+        entry = self.resolve(path)
+        return entry is not None and entry < 0
+
+    def getFile(self, path: str):
+        entry = self.resolve(path)
+        if entry is None or entry >= 0:
+            return None
+        return self.files[~entry]
+
+    def listDir(self, path: str):
+        entry = self.resolve(path)
+        if entry is None or entry < 0:
+            return []
+        return list(self.children[entry])
+
+    def getDirMtime(self, path: str):
+        entry = self.resolve(path)
+        if entry is None or entry < 0:
+            return self.default_mtime
+        return self.mtimes[entry] or self.default_mtime
+
+def buildPathIndex(files: Iterable[FileRecord], raw_mode: bool, enable_audio: bool, default_mtime: int = 0):
+    """
+    Builds the directory tree of the mount for files.
+    """
+    index = PathIndex(default_mtime)
+    if not raw_mode:
+        for name in CATEGORY_FOLDERS + (("music",) if enable_audio else ()):
+            index.addDir(ROOT, name)
+    for file in files:
+        parts = getVirtualPath(file, raw_mode)
+        if parts:
+            index.addFile(parts, file, file.created_at or default_mtime)
+    return index.finish()
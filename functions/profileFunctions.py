@@ -0,0 +1,225 @@
+from library.app import REFRESH_PROFILE_PATH, REFRESH_PROFILE_SLOWEST_FILES, REFRESH_PROFILER, REFRESH_PROFILER_PATH
+from library.metrics import HTTP_REQUESTS, HTTP_RETRIES, HTTP_CACHE_LOOKUPS, LISTING_PAGES, METADATA_LOOKUPS
+from contextlib import contextmanager
+from collections import Counter
+import threading
+import logging
+import heapq
+import json
+import time
+import sys
+import os
+
+SAMPLING_INTERVAL = 0.01 # seconds between stack samples
+PROFILED_METRICS = {
+    "http_requests": HTTP_REQUESTS,
+    "http_retries": HTTP_RETRIES,
+    "http_cache_lookups": HTTP_CACHE_LOOKUPS,
+    "listing_pages": LISTING_PAGES,
+    "metadata_lookups": METADATA_LOOKUPS,
+}
+
+_active_profile: "RefreshProfile | None" = None
+
+class StackSampler:
+    """
+    Samples the stacks of every thread, so work done by the refresh worker threads is included.
+    Writes collapsed stacks that flame graph tools can read.
+    """
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self, path: str):
+        self.stop_event.set()
+        self.thread.join()
+        with open(path, "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+class RefreshProfile:
+    """
+    Collects where the time of one refresh cycle went, per download type and phase.
+    """
+    def __init__(self, trigger: str, slowest_files: int = REFRESH_PROFILE_SLOWEST_FILES):
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.started_counter = time.perf_counter()
+        self.slowest_files_limit = slowest_files
+        self.phases: dict[str, dict[str, float]] = {}
+        self.counts: dict[str, Counter] = {}
+        self.slowest_files: list[tuple[float, str, str]] = []
+        self.metrics_before = {name: metric.snapshot() for name, metric in PROFILED_METRICS.items()}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.sampler = None
+
+    def startProfiler(self, profiler: str = REFRESH_PROFILER):
+        if profiler == "cprofile":
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profiler == "sampling":
+            self.sampler = StackSampler()
+            self.sampler.start()
+        elif profiler:
+            logging.warning(f"Unknown refresh profiler {profiler}. Valid options are: cprofile, sampling")
+
+    def stopProfiler(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            path = REFRESH_PROFILER_PATH or "refresh-profile.prof"
+            self.profiler.dump_stats(path)
+            logging.info(f"Wrote cProfile output to {path}")
+        if self.sampler is not None:
+            path = REFRESH_PROFILER_PATH or "refresh-profile.folded"
+            self.sampler.stop(path)
+            logging.info(f"Wrote sampled stacks to {path}")
+
+    def addPhase(self, download_type: str, phase: str, seconds: float):
+        with self.lock:
+            phases = self.phases.setdefault(download_type, {})
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def count(self, download_type: str, name: str, amount: int = 1):
+        with self.lock:
+            self.counts.setdefault(download_type, Counter())[name] += amount
+
+    def addFileTiming(self, download_type: str, file_name: str, seconds: float):
+        entry = (seconds, download_type, file_name)
+        with self.lock:
+            # also serves as refresh progress for the control API
+            self.counts.setdefault(download_type, Counter())["processed"] += 1
+            if self.slowest_files_limit <= 0:
+                return
+            if len(self.slowest_files) < self.slowest_files_limit:
+                heapq.heappush(self.slowest_files, entry)
+            elif entry > self.slowest_files[0]:
+                heapq.heapreplace(self.slowest_files, entry)
+
+    def metricDeltas(self):
+        deltas = {}
+        for name, metric in PROFILED_METRICS.items():
+            before = self.metrics_before[name]
+            values = {}
+            for labelvalues, value in metric.snapshot().items():
+                delta = value - before.get(labelvalues, 0)
+                if delta:
+                    values[":".join(labelvalues) or "total"] = delta
+            deltas[name] = values
+        return deltas
+
+    def report(self, success: bool, detail: str):
+        metrics = self.metricDeltas()
+        http_cache = metrics["http_cache_lookups"]
+        metadata = metrics["metadata_lookups"]
+        with self.lock:
+            return {
+                "trigger": self.trigger,
+                "success": success,
+                "detail": detail,
+                "started_at": self.started_at,
+                "seconds": time.perf_counter() - self.started_counter,
+                "types": {
+                    download_type: {
+                        "phases": {phase: round(seconds, 4) for phase, seconds in self.phases.get(download_type, {}).items()},
+                        "counts": dict(self.counts.get(download_type, {})),
+                    }
+                    for download_type in sorted(set(self.phases) | set(self.counts))
+                },
+                "cache_hit_ratios": {
+                    "http_response_cache": getRatio(http_cache.get("hit", 0), http_cache.get("miss", 0)),
+                    "metadata": getRatio(metadata.get("cache", 0) + metadata.get("identity", 0), metadata.get("api", 0)),
+                },
+                "metrics": metrics,
+                "slowest_files": [
+                    {"type": download_type, "file_name": file_name, "seconds": round(seconds, 4)}
+                    for seconds, download_type, file_name in sorted(self.slowest_files, reverse=True)
+                ],
+            }
+
+def getRatio(hits: float, misses: float):
+    if hits + misses == 0:
+        return None
+    return round(hits / (hits + misses), 4)
+
+def startRefreshProfile(trigger: str):
+    global _active_profile
+    profile = RefreshProfile(trigger)
+    profile.startProfiler()
+    _active_profile = profile
+    return profile
+
+def finishRefreshProfile(profile: RefreshProfile, success: bool, detail: str):
+    """
+    Stops profiling and publishes the report as a log record and, if configured, a JSON file.
+    """
+    global _active_profile
+    if _active_profile is profile:
+        _active_profile = None
+    profile.stopProfiler()
+    report = profile.report(success, detail)
+    logging.info(f"Refresh profile: {json.dumps(report, default=str)}")
+    if REFRESH_PROFILE_PATH:
+        try:
+            with open(REFRESH_PROFILE_PATH, "w") as output:
+                json.dump(report, output, indent=2, default=str)
+        except OSError as e:
+            logging.error(f"Unable to write refresh profile to {REFRESH_PROFILE_PATH}: {e}")
+    return report
+
+def getActiveProfile():
+    return _active_profile
+
+def getRefreshProgress():
+    """
+    Returns the elapsed time and per type counts of the running refresh, or None if no refresh is running.
+    """
+    profile = _active_profile
+    if profile is None:
+        return None
+    with profile.lock:
+        return {
+            "trigger": profile.trigger,
+            "seconds": round(time.perf_counter() - profile.started_counter, 3),
+            "types": {download_type: dict(counts) for download_type, counts in profile.counts.items()},
+        }
+
+@contextmanager
+def profilePhase(download_type: str, phase: str):
+    profile = _active_profile
+    if profile is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.addPhase(download_type, phase, time.perf_counter() - started_at)
+
+def profileCount(download_type: str, name: str, amount: int = 1):
+    profile = _active_profile
+    if profile is not None:
+        profile.count(download_type, name, amount)
+
+def profileFileTiming(download_type: str, file_name: str, seconds: float):
+    profile = _active_profile
+    if profile is not None:
+        profile.addFileTiming(download_type, file_name, seconds)
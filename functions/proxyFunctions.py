@@ -0,0 +1,179 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from library.filesystem import STREAM_PROXY_URL, STREAM_PROXY_TOKEN
+from library.metrics import STREAM_PROXY_REQUESTS, STREAM_PROXY_BYTES
+from functions.torboxFunctions import DownloadType
+from functions.snapshotFunctions import getFileRecord
+from functions.streamFunctions import StreamManager, FileHandle, getStreamManager
+from functions.recordFunctions import FileRecord
+from typing import Callable
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+import threading
+import logging
+import hmac
+import re
+
+PROXY_READ_SIZE = 1024 * 1024 # bytes read from the stream layer per write to the player
+RANGE_PATTERN = re.compile(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*")
+
+def getStreamUrl(file: FileRecord, base_url: str = STREAM_PROXY_URL, token: str = STREAM_PROXY_TOKEN):
+    """
+    Returns the proxy URL of a file. The trailing file name is ignored by the proxy, it lets players tell the container from the URL.
+    """
+    url = f"{base_url}/stream/{file.type}/{file.item_id}/{file.file_id}/{quote(file.file_name or '')}"
+    if token:
+        url += f"?token={quote(token)}"
+    return url
+
+def parseRange(header: str | None, file_size: int):
+    """
+    Parses a Range header into an inclusive (start, end) pair. Returns None to send the whole file, which is also
+    how multiple or malformed ranges are answered. Raises ValueError if the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.fullmatch(header)
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        suffix = int(end)
+        if suffix == 0 or file_size == 0:
+            raise ValueError(f"Unsatisfiable range {header}")
+        return max(0, file_size - suffix), file_size - 1
+    start = int(start)
+    end = int(end) if end else file_size - 1
+    if start >= file_size:
+        raise ValueError(f"Unsatisfiable range {header}")
+    if end < start:
+        return None
+    return start, min(end, file_size - 1)
+
+class StreamProxy:
+    """
+    Serves files over HTTP with range support through a StreamManager, so every player shares its block cache,
+    link cache and prefetching. Files are looked up in the library snapshot, which followers have too.
+    """
+    def __init__(
+        self,
+        streams: StreamManager,
+        lookup: Callable[[str, int, int], FileRecord | None] = getFileRecord,
+        token: str = STREAM_PROXY_TOKEN,
+    ):
+        self.streams = streams
+        self.lookup = lookup
+        self.token = token
+
+    def getFile(self, type: str, item_id: int, file_id: int):
+        return self.lookup(type, item_id, file_id)
+
+    def isAuthorized(self, query: str):
+        if not self.token:
+            return True
+        token = parse_qs(query).get("token", [""])[0]
+        return hmac.compare_digest(token, self.token)
+
+    def read(self, handle: FileHandle, size: int, offset: int):
+        try:
+            return self.streams.read(handle, size, offset)
+        except Exception as e:
+            logging.error(f"Error reading {handle.file.file_name} at offset {offset}: {e}")
+            return None
+
+class StreamProxyRequestHandler(BaseHTTPRequestHandler):
+    proxy: StreamProxy = None
+    # players send many range requests, keeping the connection open saves a handshake for each
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.serveFile(send_body=True)
+
+    def do_HEAD(self):
+        self.serveFile(send_body=False)
+
+    def sendStatus(self, status: int, headers: dict | None = None):
+        STREAM_PROXY_REQUESTS.labels(status).inc()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def sendFileHeaders(self, file: FileRecord, status: int, start: int, end: int, length: int):
+        STREAM_PROXY_REQUESTS.labels(status).inc()
+        self.send_response(status)
+        self.send_header("Content-Type", file.file_mimetype or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{file.file_size or 0}")
+        self.end_headers()
+
+    def serveFile(self, send_body: bool):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        if len(parts) < 4 or parts[0] != "stream" or parts[1] not in [e.value for e in DownloadType] or not parts[2].isdigit() or not parts[3].isdigit():
+            return self.sendStatus(404)
+        if not self.proxy.isAuthorized(url.query):
+            return self.sendStatus(401)
+        file = self.proxy.getFile(parts[1], int(parts[2]), int(parts[3]))
+        if file is None:
+            return self.sendStatus(404)
+
+        file_size = file.file_size or 0
+        try:
+            byte_range = parseRange(self.headers.get("Range"), file_size)
+        except ValueError:
+            return self.sendStatus(416, {"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+        start, end = byte_range or (0, file_size - 1)
+        length = max(0, end - start + 1)
+
+        status = 206 if byte_range else 200
+        if not send_body or not length:
+            # HEAD requests only need the size and type, which the record already has
+            return self.sendFileHeaders(file, status, start, end, length)
+
+        handle = self.proxy.streams.open(file)
+        try:
+            # the first chunk is read before the headers are sent, so a failed fetch can still be reported
+            data = self.proxy.read(handle, min(PROXY_READ_SIZE, length), start)
+            if not data:
+                return self.sendStatus(502)
+            self.sendFileHeaders(file, status, start, end, length)
+
+            offset = start
+            while data:
+                self.wfile.write(data)
+                STREAM_PROXY_BYTES.inc(len(data))
+                offset += len(data)
+                if offset > end:
+                    return
+                data = self.proxy.read(handle, min(PROXY_READ_SIZE, end - offset + 1), offset)
+            # the response is cut short, closing the connection tells the player to retry
+            self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError):
+            # players drop the connection when they seek or stop
+            self.close_connection = True
+        finally:
+            self.proxy.streams.release(handle)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Stream proxy request: {format % args}")
+
+def startStreamProxy(host: str, port: int, proxy: StreamProxy | None = None):
+    """
+    Serves the stream proxy on a background thread. Returns the server, or None if it could not be started.
+    """
+    if proxy is None:
+        proxy = StreamProxy(getStreamManager())
+    handler = type("BoundStreamProxyRequestHandler", (StreamProxyRequestHandler,), {"proxy": proxy})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.error(f"Unable to start stream proxy on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving stream proxy on http://{host}:{port}")
+    return server
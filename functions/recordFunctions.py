@@ -0,0 +1,156 @@
+from datetime import datetime, timezone
+from itertools import repeat
+from typing import Iterable
+import hashlib
+import sys
+
+FILE_RECORD_FIELDS = (
+    "item_id",
+    "type",
+    "folder_name",
+    "folder_hash",
+    "file_id",
+    "file_name",
+    "file_size",
+    "file_mimetype",
+    "path",
+    "extension",
+    "created_at",
+    "metadata_title",
+    "metadata_link",
+    "metadata_mediatype",
+    "metadata_image",
+    "metadata_backdrop",
+    "metadata_years",
+    "metadata_season",
+    "metadata_episode",
+    "metadata_filename",
+    "metadata_rootfoldername",
+    "metadata_foldername",
+)
+
+FILE_RECORD_KEYS = frozenset(FILE_RECORD_FIELDS) | {"download_link"}
+
+# these values repeat across every file of a download or library, so they are interned
+INTERNED_FIELDS = frozenset((
+    "type",
+    "folder_name",
+    "folder_hash",
+    "file_mimetype",
+    "extension",
+    "metadata_title",
+    "metadata_mediatype",
+    "metadata_rootfoldername",
+    "metadata_foldername",
+))
+
+INODE_MASK = (1 << 63) - 1
+RESERVED_INODES = 2 # 0 is invalid and 1 is the root directory
+
+def internValue(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+def getStableInode(key: str):
+    """
+    Derives an inode number from a stable key so it survives VFS rebuilds and restarts.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    inode = int.from_bytes(digest, "big") & INODE_MASK
+    if inode < RESERVED_INODES:
+        inode += RESERVED_INODES
+    return inode
+
+def parseTimestamp(value: str | int | float | None):
+    """
+    Converts an API timestamp (ISO 8601 string or epoch) into epoch seconds.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+class FileRecord:
+    """
+    Compact representation of a single mountable file.
+
+    Records replace the per-file dicts that used to be passed between the refresh pipeline,
+    the database and the mounts. Repeated strings are interned and the download link is built
+    from the ids on demand so the API key is never stored per file.
+    """
+    __slots__ = FILE_RECORD_FIELDS
+
+    def __init__(self, **kwargs):
+        for field in FILE_RECORD_FIELDS:
+            value = kwargs.get(field)
+            if field in INTERNED_FIELDS:
+                value = internValue(value)
+            object.__setattr__(self, field, value)
+
+    @classmethod
+    def fromDict(cls, data: dict):
+        """
+        Builds a record from a processed file dict or a database row. Unknown keys are ignored.
+        """
+        return cls(**{field: data.get(field) for field in FILE_RECORD_FIELDS})
+
+    @classmethod
+    def fromValues(cls, values: Iterable):
+        """
+        Builds a record from its values in FILE_RECORD_FIELDS order, without interning them.
+        """
+        record = cls.__new__(cls)
+        for field, value in zip(FILE_RECORD_FIELDS, values):
+            setattr(record, field, value)
+        return record
+
+    @classmethod
+    def fromColumns(cls, columns: dict[str, Iterable], count: int):
+        """
+        Builds count records from one iterable of values per field, for callers that already share repeated
+        values. Missing fields are None.
+        """
+        return list(map(cls.fromValues, zip(*(columns.get(field) or repeat(None, count) for field in FILE_RECORD_FIELDS))))
+
+    def toDict(self):
+        return {field: getattr(self, field) for field in FILE_RECORD_FIELDS}
+
+    @property
+    def download_link(self):
+        from functions.torboxFunctions import getRequestDownloadUrl
+        return getRequestDownloadUrl(self.type, self.item_id, self.file_id)
+
+    @property
+    def inode(self):
+        return getStableInode(f"file:{self.type}:{self.item_id}:{self.file_id}")
+
+    def get(self, key: str, default=None):
+        if key in FILE_RECORD_KEYS:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key: str):
+        if key in FILE_RECORD_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str):
+        return key in FILE_RECORD_KEYS
+
+    def __eq__(self, other):
+        if not isinstance(other, FileRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in FILE_RECORD_FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"FileRecord(type={self.type!r}, item_id={self.item_id!r}, file_id={self.file_id!r}, file_name={self.file_name!r})"
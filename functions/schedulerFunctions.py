@@ -0,0 +1,115 @@
+from library.app import MOUNT_REFRESH_TIME, REFRESH_PROBE_MIN_SECONDS, REFRESH_PROBE_MAX_SECONDS
+from library.metrics import REFRESH_PROBES, REFRESH_PROBE_INTERVAL
+from functions.torboxFunctions import DownloadType, getDownloadsFingerprint
+from typing import Callable
+import threading
+import logging
+import time
+
+PROBE_BACKOFF_FACTOR = 2.0
+
+def probeAllDownloadTypes():
+    """
+    Runs the change probe for every download type. Returns the fingerprints, or None if any probe failed.
+    """
+    fingerprints = {}
+    for download_type in DownloadType:
+        fingerprint, success, detail = getDownloadsFingerprint(download_type)
+        if not success:
+            logging.warning(f"Change probe failed: {detail}")
+            return None
+        fingerprints[download_type.value] = fingerprint
+    return fingerprints
+
+class AdaptiveRefreshScheduler:
+    """
+    Decides when to run a full refresh. A cheap change probe runs on an interval that speeds up while the library
+    is changing and backs off while it is idle, and a full refresh only runs when the probe sees a change.
+    A full refresh still runs at least every full_refresh_seconds to catch changes the probe cannot see.
+    """
+    def __init__(
+        self,
+        refresh: Callable[[str, list[DownloadType] | None], tuple[bool, str]],
+        probe: Callable[[], dict | None] = probeAllDownloadTypes,
+        min_interval: float = REFRESH_PROBE_MIN_SECONDS,
+        max_interval: float = REFRESH_PROBE_MAX_SECONDS,
+        full_refresh_seconds: float = MOUNT_REFRESH_TIME * 3600,
+        backoff_factor: float = PROBE_BACKOFF_FACTOR,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.refresh = refresh
+        self.probe = probe
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, min(max_interval, full_refresh_seconds))
+        self.full_refresh_seconds = full_refresh_seconds
+        self.backoff_factor = backoff_factor
+        self.clock = clock
+        self.interval = min_interval
+        self.fingerprints = None
+        self.last_full_refresh = None
+        self.lock = threading.Lock()
+
+    def runRefresh(self, trigger: str, fingerprints: dict | None, download_types: list[DownloadType] | None = None):
+        """
+        Refreshes the given download types, or everything.
+        """
+        success, detail = self.refresh(trigger, download_types)
+        if success:
+            # the fingerprints were taken before the refresh, so a change that lands during it is picked up next probe
+            if fingerprints is not None:
+                self.fingerprints = fingerprints
+            if download_types is None:
+                self.last_full_refresh = self.clock()
+        return success, detail
+
+    def refreshNow(self, trigger: str):
+        """
+        Runs a full refresh right away, for startup and manual refreshes, and resets the probe interval.
+        """
+        with self.lock:
+            fingerprints = self.probe()
+            self.interval = self.min_interval
+            REFRESH_PROBE_INTERVAL.set(self.interval)
+            return self.runRefresh(trigger, fingerprints)
+
+    def startRefresh(self, trigger: str):
+        """
+        Runs refreshNow on a background thread and returns the thread. The mounts keep serving the persisted
+        snapshot while it runs, instead of waiting for the network.
+        """
+        thread = threading.Thread(target=self.refreshNow, args=(trigger,), daemon=True, name=f"{trigger}-refresh")
+        thread.start()
+        return thread
+
+    def tick(self):
+        """
+        Runs one probe, and a full refresh if needed. Returns the number of seconds until the next tick.
+        """
+        with self.lock:
+            fingerprints = self.probe()
+            due = self.last_full_refresh is None or self.clock() - self.last_full_refresh >= self.full_refresh_seconds
+
+            if fingerprints is None:
+                REFRESH_PROBES.labels("error").inc()
+                if due:
+                    self.runRefresh("scheduled", None)
+                self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+            elif fingerprints != self.fingerprints:
+                REFRESH_PROBES.labels("changed").inc()
+                changed = sorted(
+                    download_type for download_type, fingerprint in fingerprints.items()
+                    if self.fingerprints is None or self.fingerprints.get(download_type) != fingerprint
+                )
+                logging.info(f"Change probe detected changes in {', '.join(changed)}.")
+                # only the changed download types are refreshed, unless a full refresh is due anyway
+                self.runRefresh("change", fingerprints, None if due else [DownloadType(download_type) for download_type in changed])
+                self.interval = self.min_interval
+            else:
+                REFRESH_PROBES.labels("unchanged").inc()
+                if due:
+                    self.runRefresh("scheduled", fingerprints)
+                self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+
+            REFRESH_PROBE_INTERVAL.set(self.interval)
+            logging.debug(f"Next change probe in {self.interval:.0f} seconds.")
+            return self.interval
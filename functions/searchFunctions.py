@@ -0,0 +1,151 @@
+from library.app import METADATA_SEARCH_RATE, METADATA_SEARCH_BATCH_PATH, METADATA_SEARCH_BATCH_SIZE, METADATA_SEARCH_BATCH_WINDOW, METADATA_SEARCH_CONCURRENCY
+from library.metrics import METADATA_SEARCH_BATCHES, METADATA_SEARCH_DEDUPED
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import threading
+import logging
+import httpx
+import time
+import re
+
+BATCH_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+def getSearchKey(full_title: str):
+    """
+    Queries that only differ in case, punctuation or spacing return the same results, so they are sent once.
+    """
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", full_title.lower()).split())
+
+class BatchSearchResponse:
+    """
+    Presents one query's results from a batch response like a single search response.
+    """
+    status_code = 200
+
+    def __init__(self, data: list):
+        self.data = data
+        self.text = ""
+        self.headers = {}
+
+    def json(self):
+        return {"success": True, "data": self.data}
+
+class MetadataSearchBatcher:
+    """
+    Collects metadata searches for a short window and sends them together. Queries with the same search key
+    share one request. With a batch path, each batch is one multi-query request, otherwise the queries are sent as
+    concurrent single requests. Outgoing requests are limited to rate per second.
+    """
+    def __init__(
+        self,
+        request: Callable[..., httpx.Response],
+        client: httpx.Client,
+        batch_path: str = METADATA_SEARCH_BATCH_PATH,
+        batch_size: int = METADATA_SEARCH_BATCH_SIZE,
+        window: float = METADATA_SEARCH_BATCH_WINDOW,
+        concurrency: int = METADATA_SEARCH_CONCURRENCY,
+        rate: float = METADATA_SEARCH_RATE,
+    ):
+        self.request = request
+        self.client = client
+        self.batch_path = batch_path
+        self.batch_size = batch_size
+        self.window = window
+        self.min_spacing = 1 / rate
+        self.next_request_at = 0.0
+        self.pending: list[tuple[str, str, dict]] = []
+        self.inflight: dict[str, Future] = {}
+        self.condition = threading.Condition()
+        self.rate_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="metadata-search")
+        self.thread = None
+
+    def search(self, full_title: str, params: dict | None = None, key: str | None = None):
+        """
+        Returns the search response for a query, waiting for its batch to be sent. Queries are deduplicated by key,
+        which defaults to the normalized query.
+        """
+        key = key or getSearchKey(full_title)
+        with self.condition:
+            future = self.inflight.get(key)
+            if future is not None:
+                METADATA_SEARCH_DEDUPED.inc()
+            else:
+                future = Future()
+                self.inflight[key] = future
+                self.pending.append((key, full_title, params or {}))
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+                self.condition.notify_all()
+        return future.result()
+
+    def waitForRateLimit(self):
+        with self.rate_lock:
+            now = time.monotonic()
+            delay = self.next_request_at - now
+            self.next_request_at = max(now, self.next_request_at) + self.min_spacing
+        if delay > 0:
+            time.sleep(delay)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # without a batch path there is nothing to gain from waiting, identical queries are still shared
+                deadline = time.monotonic() + (self.window if self.batch_path else 0)
+                while len(self.pending) < self.batch_size and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            if self.batch_path and len(batch) > 1:
+                self.executor.submit(self._sendBatch, batch)
+            else:
+                for query in batch:
+                    self.executor.submit(self._sendSingle, query)
+
+    def _finish(self, key: str, result=None, error: Exception | None = None):
+        with self.condition:
+            future = self.inflight.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _sendSingle(self, query: tuple[str, str, dict]):
+        key, full_title, params = query
+        self.waitForRateLimit()
+        METADATA_SEARCH_BATCHES.labels("single").inc()
+        try:
+            response = self.request(self.client, "GET", f"/meta/search/{full_title}", params=params)
+        except Exception as e:
+            return self._finish(key, error=e)
+        self._finish(key, response)
+
+    def _sendBatch(self, batch: list[tuple[str, str, dict]]):
+        self.waitForRateLimit()
+        METADATA_SEARCH_BATCHES.labels("batch").inc()
+        try:
+            response = self.request(
+                self.client,
+                "POST",
+                self.batch_path,
+                json={"queries": [{"query": full_title, **params} for _, full_title, params in batch]},
+            )
+            results = response.json().get("data")
+            if response.status_code != 200 or not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError(f"Unexpected batch search response with status {response.status_code}")
+        except Exception as e:
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
+            if status_code in BATCH_UNSUPPORTED_STATUS_CODES:
+                logging.warning(f"Metadata search API does not support batch searches at {self.batch_path}. Falling back to single searches.")
+                self.batch_path = ""
+            else:
+                logging.warning(f"Batch metadata search failed: {e}. Retrying the queries one by one.")
+            for query in batch:
+                self.executor.submit(self._sendSingle, query)
+            return
+        for (key, _, _), data in zip(batch, results):
+            self._finish(key, BatchSearchResponse(data or []))
@@ -0,0 +1,90 @@
+from library.app import SHARED_LIBRARY_PATH
+from library.metrics import SHARED_LIBRARY_UPDATES
+from functions.generationFunctions import writeJsonAtomic
+from functions.snapshotFunctions import LibrarySnapshot, decodeSnapshot, encodeSnapshot, getLibrarySnapshot, installLibrarySnapshot
+import datetime
+import logging
+import socket
+import json
+import time
+import uuid
+import os
+
+SHARED_SNAPSHOT_NAME = "library_snapshot.bin"
+SHARED_MANIFEST_NAME = "manifest.json"
+
+def publishSharedLibrary(data: bytes, snapshot: LibrarySnapshot, directory: str = SHARED_LIBRARY_PATH):
+    """
+    Publishes an encoded snapshot for follower nodes. The snapshot is replaced before the manifest, so a
+    follower that sees a new manifest always finds its snapshot, or a newer one.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SHARED_SNAPSHOT_NAME)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+        writeJsonAtomic(os.path.join(directory, SHARED_MANIFEST_NAME), {
+            "id": uuid.uuid4().hex,
+            "files": len(snapshot),
+            "published_at": time.time(),
+            "leader": socket.gethostname(),
+        })
+    except OSError as e:
+        logging.error(f"Unable to publish the library to {directory}: {e}")
+        SHARED_LIBRARY_UPDATES.labels("publish_failed").inc()
+        return False
+    SHARED_LIBRARY_UPDATES.labels("published").inc()
+    logging.info(f"Published {len(snapshot)} files to the shared library at {directory}.")
+    return True
+
+def publishMissingSharedLibrary(directory: str = SHARED_LIBRARY_PATH):
+    """
+    Publishes the current library if the shared library path has none, like on the first start of a leader,
+    or after a start from the persisted snapshot when the last publish failed. Returns True if it was published.
+    """
+    if os.path.exists(os.path.join(directory, SHARED_MANIFEST_NAME)):
+        return False
+    snapshot = getLibrarySnapshot()
+    return publishSharedLibrary(encodeSnapshot(snapshot), snapshot, directory)
+
+class SharedLibraryFollower:
+    """
+    Loads the library a leader node publishes to the shared library path and makes it the local snapshot.
+    """
+    def __init__(self, directory: str = SHARED_LIBRARY_PATH):
+        self.directory = directory
+        self.manifest_id = None
+
+    def poll(self):
+        """
+        Loads the shared library if the leader published a new one. Returns True if the local snapshot changed.
+        """
+        try:
+            with open(os.path.join(self.directory, SHARED_MANIFEST_NAME)) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            logging.debug(f"No shared library has been published to {self.directory} yet.")
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to read the shared library manifest: {e}")
+            return False
+        if manifest.get("id") == self.manifest_id:
+            return False
+
+        try:
+            with open(os.path.join(self.directory, SHARED_SNAPSHOT_NAME), "rb") as file:
+                type_files, _ = decodeSnapshot(file.read())
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Unable to load the shared library: {e}")
+            SHARED_LIBRARY_UPDATES.labels("load_failed").inc()
+            return False
+        snapshot = installLibrarySnapshot(type_files)
+        self.manifest_id = manifest.get("id")
+        SHARED_LIBRARY_UPDATES.labels("loaded").inc()
+        published_at = datetime.datetime.fromtimestamp(manifest.get("published_at", 0)).strftime("%Y-%m-%d %H:%M:%S")
+        logging.info(f"Loaded {len(snapshot)} files from the shared library, published by {manifest.get('leader')} at {published_at}.")
+        return True
@@ -0,0 +1,298 @@
+from library.app import NODE_ROLE, SHARED_LIBRARY_PATH
+from library.metrics import LIBRARY_SNAPSHOT_VERSION, LIBRARY_SNAPSHOT_LOOKUPS
+from functions.torboxFunctions import DownloadType
+from functions.databaseFunctions import getAllData, getDatabaseVersion, getDatabaseStamp
+from functions.recordFunctions import FileRecord, FILE_RECORD_FIELDS
+from library.http import parseJson
+from array import array
+import threading
+import logging
+import struct
+import gc
+import json
+import time
+import zlib
+import sys
+import os
+
+try:
+    import zstandard
+except ImportError: # optional, snapshots are compressed with zlib without it
+    zstandard = None
+
+SNAPSHOT_PATH = "library_snapshot.bin"
+SNAPSHOT_MAGIC = b"TBMCLIB1"
+CODEC_ZLIB = b"z"
+CODEC_ZSTD = b"s"
+
+class LibrarySnapshot:
+    """
+    Immutable view of every stored file. The version changes whenever any download type changes, so
+    consumers can keep what they built from a snapshot until they see a new version.
+    """
+    __slots__ = ("version", "files", "type_files", "type_versions", "type_stamps")
+
+    def __init__(
+        self,
+        version: int,
+        type_files: dict[str, tuple[FileRecord, ...]],
+        type_versions: dict[str, int | None],
+        type_stamps: dict[str, list | None] | None = None,
+    ):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "type_files", type_files)
+        object.__setattr__(self, "type_versions", type_versions)
+        # the database file each type was read from, a persisted snapshot is only trusted while these match
+        object.__setattr__(self, "type_stamps", type_stamps or {})
+        object.__setattr__(self, "files", tuple(file for files in type_files.values() for file in files))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LibrarySnapshot is immutable.")
+
+    def __len__(self):
+        return len(self.files)
+
+def getValueKey(value):
+    try:
+        hash(value)
+    except TypeError:
+        return type(value), json.dumps(value, sort_keys=True)
+    # 1, 1.0 and True are equal dict keys, but have to stay distinct values
+    return type(value), value
+
+def encodeSnapshot(snapshot: LibrarySnapshot):
+    """
+    Serializes a snapshot in a columnar layout: a table of the distinct values, shared by every field,
+    followed by one array of value indexes per field.
+    """
+    values = []
+    positions = {}
+    columns = [array("I") for _ in FILE_RECORD_FIELDS]
+    types = {}
+    for type, files in snapshot.type_files.items():
+        types[type] = {"count": len(files), "stamp": snapshot.type_stamps.get(type)}
+        for column, field in zip(columns, FILE_RECORD_FIELDS):
+            for file in files:
+                value = getattr(file, field)
+                key = getValueKey(value)
+                position = positions.get(key)
+                if position is None:
+                    position = positions[key] = len(values)
+                    values.append(value)
+                column.append(position)
+    if sys.byteorder == "big":
+        for column in columns:
+            column.byteswap()
+    header = json.dumps({"fields": FILE_RECORD_FIELDS, "types": types, "values": values}).encode()
+    body = b"".join([struct.pack("<I", len(header)), header, *(column.tobytes() for column in columns)])
+    if zstandard is not None:
+        return SNAPSHOT_MAGIC + CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(body)
+    return SNAPSHOT_MAGIC + CODEC_ZLIB + zlib.compress(body, 1)
+
+def decodeSnapshot(data: bytes):
+    """
+    Returns the files and database stamps per type of an encoded snapshot.
+    Raises ValueError if the data is not a snapshot this version can read.
+    """
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a library snapshot.")
+    codec = data[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 1]
+    payload = data[len(SNAPSHOT_MAGIC) + 1:]
+    try:
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise ValueError("Library snapshot needs zstandard to be read.")
+            body = zstandard.ZstdDecompressor().decompress(payload)
+        elif codec == CODEC_ZLIB:
+            body = zlib.decompress(payload)
+        else:
+            raise ValueError(f"Unknown library snapshot codec {codec!r}.")
+        header_size = struct.unpack_from("<I", body)[0]
+        header = parseJson(body[4:4 + header_size])
+    except (zlib.error, struct.error) as e:
+        raise ValueError(f"Corrupt library snapshot: {e}")
+    if not all(isinstance(header.get(key), expected) for key, expected in (("fields", list), ("types", dict), ("values", list))):
+        raise ValueError("Corrupt library snapshot header.")
+
+    count = sum(entry["count"] for entry in header["types"].values())
+    values = header["values"]
+    view = memoryview(body)[4 + header_size:]
+    if len(view) != 4 * count * len(header["fields"]):
+        raise ValueError("Library snapshot is truncated.")
+    stored = {}
+    for index, field in enumerate(header["fields"]):
+        column = array("I")
+        column.frombytes(view[4 * count * index:4 * count * (index + 1)])
+        if sys.byteorder == "big":
+            column.byteswap()
+        try:
+            stored[field] = list(map(values.__getitem__, column))
+        except IndexError:
+            raise ValueError("Library snapshot references a missing value.")
+
+    # every record is kept, so the collections triggered by allocating them all at once would only cost time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # fields added since the snapshot was written are empty until the next refresh fills them
+        records = FileRecord.fromColumns(stored, count)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    type_files = {}
+    type_stamps = {}
+    offset = 0
+    for type, entry in header["types"].items():
+        type_files[type] = tuple(records[offset:offset + entry["count"]])
+        type_stamps[type] = entry["stamp"]
+        offset += entry["count"]
+    return type_files, type_stamps
+
+def loadPersistedSnapshot(path: str = SNAPSHOT_PATH):
+    """
+    Reads the snapshot persisted by a previous run. Returns None if there is none or it cannot be read.
+    """
+    started_at = time.perf_counter()
+    try:
+        with open(path, "rb") as file:
+            type_files, type_stamps = decodeSnapshot(file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Ignoring library snapshot {path}: {e}")
+        return None
+    logging.debug(f"Loaded {sum(len(files) for files in type_files.values())} files from library snapshot {path} in {time.perf_counter() - started_at:.2f}s.")
+    return type_files, type_stamps
+
+_save_lock = threading.Lock()
+_saved_version = 0
+
+def saveLibrarySnapshot(snapshot: LibrarySnapshot, path: str = SNAPSHOT_PATH, role: str = NODE_ROLE, shared_path: str = SHARED_LIBRARY_PATH):
+    """
+    Persists a snapshot for the next start, and on a leader node publishes it to the followers.
+    Older snapshots than the last one saved are skipped. A snapshot only counts as saved once it was written,
+    and published on a leader, so a failed save is retried by the next call with the same snapshot.
+    """
+    global _saved_version
+    with _save_lock:
+        if snapshot.version <= _saved_version:
+            return False
+        started_at = time.perf_counter()
+        data = encodeSnapshot(snapshot)
+        published = True
+        if role == "leader":
+            from functions.sharedLibraryFunctions import publishSharedLibrary
+            published = publishSharedLibrary(data, snapshot, shared_path)
+        temporary_path = f"{path}.tmp"
+        try:
+            with open(temporary_path, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logging.warning(f"Unable to save library snapshot {path}: {e}")
+            return False
+        if not published:
+            return False
+        _saved_version = snapshot.version
+    logging.debug(f"Saved library snapshot {snapshot.version} in {time.perf_counter() - started_at:.2f}s.")
+    return True
+
+_snapshot = LibrarySnapshot(0, {}, {})
+_snapshot_lock = threading.Lock()
+
+def loadTypeFiles(type: str):
+    downloads, success, detail = getAllData(type)
+    if not success:
+        logging.error(f"Error fetching {type}: {detail}")
+        return None
+    logging.debug(f"Loaded {len(downloads)} {type} downloads.")
+    return tuple(FileRecord.fromDict(download) for download in downloads)
+
+def getLibrarySnapshot():
+    """
+    Returns the current library snapshot. Download types whose database did not change since the last
+    snapshot are reused without reading the database, so an unchanged library costs no disk reads.
+    The first snapshot of a run is loaded from the persisted snapshot where its database files still match,
+    which is much faster than parsing the databases.
+    """
+    global _snapshot
+    if NODE_ROLE == "follower":
+        # followers never read their own databases, their snapshot is installed from the shared library
+        return _snapshot
+    with _snapshot_lock:
+        previous = _snapshot
+        # versions are read before the data, a write in between only makes the next call rebuild again
+        versions = {download_type.value: getDatabaseVersion(download_type.value) for download_type in DownloadType}
+        if versions == previous.type_versions:
+            LIBRARY_SNAPSHOT_LOOKUPS.labels("reused").inc()
+            return previous
+
+        persisted = loadPersistedSnapshot() if previous.version == 0 else None
+        type_files = {}
+        type_versions = {}
+        type_stamps = {}
+        changed = False
+        for type, version in versions.items():
+            if previous.type_versions.get(type) == version:
+                type_files[type] = previous.type_files[type]
+                type_versions[type] = version
+                type_stamps[type] = previous.type_stamps.get(type)
+                continue
+            # like the versions, the stamp is taken before reading so a concurrent write makes it stale
+            stamp = getDatabaseStamp(type)
+            if stamp is None:
+                # nothing was stored for this type yet, opening the database would only create an empty file
+                files = ()
+            elif persisted is not None and type in persisted[0] and persisted[1][type] == stamp:
+                files = persisted[0][type]
+            else:
+                files = loadTypeFiles(type)
+                changed = True
+            if files is None:
+                # a failed read is retried by the next call, the previous files stay visible until then
+                type_files[type] = previous.type_files.get(type, ())
+                type_versions[type] = None
+                type_stamps[type] = None
+                continue
+            type_files[type] = files
+            type_versions[type] = version
+            type_stamps[type] = stamp
+
+        _snapshot = LibrarySnapshot(previous.version + 1, type_files, type_versions, type_stamps)
+        LIBRARY_SNAPSHOT_LOOKUPS.labels("rebuilt" if changed else "persisted").inc()
+        LIBRARY_SNAPSHOT_VERSION.set(_snapshot.version)
+        logging.debug(f"Built library snapshot {_snapshot.version} with {len(_snapshot)} files.")
+        if changed:
+            # the path is resolved now, the working directory may change before the save runs
+            threading.Thread(target=saveLibrarySnapshot, args=(_snapshot, os.path.abspath(SNAPSHOT_PATH)), daemon=True).start()
+        return _snapshot
+
+def installLibrarySnapshot(type_files: dict[str, tuple[FileRecord, ...]]):
+    """
+    Replaces the current snapshot with files loaded from elsewhere, like the shared library of a leader node.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = LibrarySnapshot(_snapshot.version + 1, type_files, {})
+        LIBRARY_SNAPSHOT_VERSION.set(_snapshot.version)
+        return _snapshot
+
+_file_index: tuple[int, dict[tuple, FileRecord]] = (0, {})
+_file_index_lock = threading.Lock()
+
+def getFileRecord(type: str, item_id: int, file_id: int):
+    """
+    Returns the file with the ids from the current library snapshot, or None. The index is only rebuilt when
+    the snapshot changes, and works on followers too, since it never reads the databases itself.
+    """
+    global _file_index
+    snapshot = getLibrarySnapshot()
+    with _file_index_lock:
+        version, index = _file_index
+        if version != snapshot.version:
+            index = {(file.type, file.item_id, file.file_id): file for file in snapshot.files}
+            _file_index = (snapshot.version, index)
+    return index.get((type, item_id, file_id))
@@ -0,0 +1,399 @@
+from functions.linkFunctions import LinkManager, getLinkKey
+from functions.recordFunctions import FileRecord
+from functions.fetchSchedulerFunctions import FetchScheduler, FetchRequest
+from library.metrics import STREAM_CACHE_LOOKUPS, STREAM_BYTES_FETCHED, STREAM_OPEN_HANDLES
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+import threading
+import logging
+import time
+
+BLOCK_SIZE = 1024 * 1024 * 64 # 64MB Blocks
+MAX_CACHED_BLOCKS = 64 # Max 64 blocks in cache (4GB)
+SEQUENTIAL_READS_FOR_PREFETCH = 2 # sequential reads in a row before the next block is fetched ahead of time
+PREFETCH_WORKERS = 4
+PROBE_CHUNK_SIZE = 1024 * 1024 # 1MB chunks for scanner probes
+PROBE_MAX_READ_SIZE = 1024 * 1024 # non sequential reads up to this size are treated as probes
+PROBE_COALESCE_GAP = 2 * 1024 * 1024 # missing ranges closer than this are fetched in one request
+MAX_CACHED_PROBE_CHUNKS = 256 # Max 256 chunks in the probe cache (256MB)
+
+def coalesceRanges(ranges: list[tuple[int, int]], max_gap: int):
+    """
+    Merges inclusive byte ranges that overlap or are separated by at most max_gap bytes.
+    """
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start - merged[-1][1] - 1 <= max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class BlockCache:
+    """
+    LRU cache of file blocks. Blocks pinned by an open file handle are skipped when evicting.
+    """
+    def __init__(self, max_blocks: int = MAX_CACHED_BLOCKS):
+        self.max_blocks = max_blocks
+        self.blocks: OrderedDict[tuple, bytes] = OrderedDict()
+        self.pins: dict[tuple, int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is not None:
+                self.blocks.move_to_end(key)
+            return data
+
+    def put(self, key: tuple, data: bytes):
+        with self.lock:
+            self.blocks.pop(key, None)
+            self._evict(self.max_blocks - 1)
+            self.blocks[key] = data
+
+    def pin(self, key: tuple):
+        with self.lock:
+            self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key: tuple):
+        with self.lock:
+            count = self.pins.get(key, 0) - 1
+            if count > 0:
+                self.pins[key] = count
+            else:
+                self.pins.pop(key, None)
+            self._evict()
+
+    def _evict(self, limit: int | None = None):
+        if limit is None:
+            limit = self.max_blocks
+        if len(self.blocks) <= limit:
+            return
+        for key in list(self.blocks):
+            if len(self.blocks) <= limit:
+                break
+            if key not in self.pins:
+                del self.blocks[key]
+
+    def __contains__(self, key: tuple):
+        return key in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+class StreamStats:
+    __slots__ = ("opened_at", "reads", "bytes_read", "bytes_fetched", "fetch_seconds", "cache_hits", "cache_misses", "prefetches", "probe_reads")
+
+    def __init__(self):
+        self.opened_at = time.time()
+        self.reads = 0
+        self.bytes_read = 0
+        self.bytes_fetched = 0
+        self.fetch_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.prefetches = 0
+        self.probe_reads = 0
+
+    def throughput(self):
+        """
+        Network throughput of the stream in bytes per second.
+        """
+        if self.fetch_seconds <= 0:
+            return 0.0
+        return self.bytes_fetched / self.fetch_seconds
+
+    def asDict(self):
+        data = {field: getattr(self, field) for field in self.__slots__}
+        data["throughput"] = self.throughput()
+        return data
+
+class FileHandle:
+    """
+    State of one open file: its access pattern, the blocks it keeps pinned, its in-flight prefetches and its stats.
+    """
+    def __init__(self, handle_id: int, file: FileRecord, links: LinkManager):
+        self.id = handle_id
+        self.file = file
+        self.key = getLinkKey(file)
+        self.links = links
+        self.next_offset = None
+        self.sequential_reads = 0
+        self.pinned_blocks: set[tuple] = set()
+        self.prefetches: dict[int, Future] = {}
+        self.stats = StreamStats()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @property
+    def link(self):
+        return self.links.getLink(self.file)
+
+    @property
+    def is_sequential(self):
+        return self.sequential_reads >= SEQUENTIAL_READS_FOR_PREFETCH
+
+    def recordRead(self, offset: int, size: int):
+        if self.next_offset is not None and offset == self.next_offset:
+            self.sequential_reads += 1
+        else:
+            self.sequential_reads = 0
+        self.next_offset = offset + size
+        self.stats.reads += 1
+        self.stats.bytes_read += size
+
+class StreamManager:
+    """
+    Serves byte ranges of remote files through a shared block cache, tracking state per open handle.
+    """
+    def __init__(self, links: LinkManager, block_size: int = BLOCK_SIZE, max_blocks: int = MAX_CACHED_BLOCKS, probe_chunk_size: int = PROBE_CHUNK_SIZE, probe_max_read_size: int = PROBE_MAX_READ_SIZE, scheduler: FetchScheduler | None = None):
+        self.links = links
+        self.block_size = block_size
+        self.probe_chunk_size = probe_chunk_size
+        self.probe_max_read_size = probe_max_read_size
+        self.cache = BlockCache(max_blocks)
+        self.probe_cache = BlockCache(MAX_CACHED_PROBE_CHUNKS)
+        self.handles: dict[int, FileHandle] = {}
+        self.next_handle = 1
+        self.inflight: dict[tuple, tuple[Future, FetchRequest]] = {}
+        self.scheduler = scheduler or FetchScheduler()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="block-prefetch")
+
+    def open(self, file: FileRecord):
+        with self.lock:
+            handle = FileHandle(self.next_handle, file, self.links)
+            self.handles[handle.id] = handle
+            self.next_handle += 1
+        STREAM_OPEN_HANDLES.inc()
+        self.links.pin(file)
+        self.links.prefetch(file)
+        return handle
+
+    def release(self, handle: FileHandle):
+        with handle.lock:
+            if handle.closed:
+                return
+            handle.closed = True
+            for future in handle.prefetches.values():
+                future.cancel()
+            handle.prefetches.clear()
+            pinned_blocks = list(handle.pinned_blocks)
+            handle.pinned_blocks.clear()
+        for block_key in pinned_blocks:
+            self.cache.unpin(block_key)
+        self.links.unpin(handle.file)
+        with self.lock:
+            self.handles.pop(handle.id, None)
+        STREAM_OPEN_HANDLES.dec()
+        logging.debug(f"Released {handle.file.file_name}: {handle.stats.asDict()}")
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetchBlock(self, file: FileRecord, block_index: int, stats: StreamStats, fetch_class: str = "playback"):
+        block_key = (getLinkKey(file), block_index)
+        block_offset = block_index * self.block_size
+        block_end = min((block_index + 1) * self.block_size, file.file_size) - 1
+        with self.lock:
+            inflight = self.inflight.get(block_key)
+            owner = inflight is None
+            if owner:
+                future = Future()
+                request = self.scheduler.enqueue(fetch_class, block_end - block_offset + 1)
+                self.inflight[block_key] = (future, request)
+            else:
+                future, request = inflight
+
+        if not owner:
+            # another reader or a prefetch is already fetching this block, a read waiting on a queued prefetch moves it up
+            self.scheduler.promote(request, fetch_class)
+            return future.result()
+
+        try:
+            self.scheduler.acquire(request)
+            started_at = time.perf_counter()
+            data = self.links.download(file, block_end - block_offset + 1, block_offset)
+            stats.fetch_seconds += time.perf_counter() - started_at
+            if data:
+                stats.bytes_fetched += len(data)
+                STREAM_BYTES_FETCHED.labels("prefetch" if fetch_class == "prefetch" else "block").inc(len(data))
+                self.cache.put(block_key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.scheduler.release(request)
+            with self.lock:
+                self.inflight.pop(block_key, None)
+
+    def _getBlock(self, handle: FileHandle, block_index: int):
+        block_key = (handle.key, block_index)
+        data = self.cache.get(block_key)
+        if data is not None:
+            handle.stats.cache_hits += 1
+            STREAM_CACHE_LOOKUPS.labels("block", "hit").inc()
+            return data
+        handle.stats.cache_misses += 1
+        STREAM_CACHE_LOOKUPS.labels("block", "miss").inc()
+        logging.debug(f"Cache miss for block {block_index}, fetching...")
+        # a miss while reading sequentially stalls playback, any other miss is a seek
+        return self._fetchBlock(handle.file, block_index, handle.stats, "playback" if handle.is_sequential else "seek")
+
+    def _pinBlock(self, handle: FileHandle, block_index: int):
+        # keep only the block currently being read pinned, so the stream isn't evicted by other readers
+        block_key = (handle.key, block_index)
+        with handle.lock:
+            if handle.closed or block_key in handle.pinned_blocks:
+                return
+            previous = list(handle.pinned_blocks)
+            handle.pinned_blocks = {block_key}
+        self.cache.pin(block_key)
+        for previous_key in previous:
+            self.cache.unpin(previous_key)
+
+    def _prefetchBlock(self, handle: FileHandle, block_index: int):
+        if block_index * self.block_size >= handle.file.file_size:
+            return
+        with handle.lock:
+            if handle.closed or block_index in handle.prefetches or (handle.key, block_index) in self.cache:
+                return
+            handle.stats.prefetches += 1
+            try:
+                future = self.executor.submit(self._fetchBlock, handle.file, block_index, handle.stats, "prefetch")
+            except RuntimeError:
+                return
+            handle.prefetches[block_index] = future
+        future.add_done_callback(lambda _: self._finishPrefetch(handle, block_index))
+
+    def _finishPrefetch(self, handle: FileHandle, block_index: int):
+        with handle.lock:
+            handle.prefetches.pop(block_index, None)
+
+    def isProbeRead(self, handle: FileHandle, size: int):
+        # scanners read a few small, scattered ranges; fetching whole blocks for those wastes hundreds of MB per file
+        return not handle.is_sequential and size <= self.probe_max_read_size
+
+    def _fetchProbeChunks(self, handle: FileHandle, chunk_indexes: list[int], fetch_class: str = "probe"):
+        file = handle.file
+        ranges = [
+            (index * self.probe_chunk_size, min((index + 1) * self.probe_chunk_size, file.file_size) - 1)
+            for index in chunk_indexes
+        ]
+        chunks = {}
+        for start, end in coalesceRanges(ranges, PROBE_COALESCE_GAP):
+            with self.scheduler.fetch(fetch_class, end - start + 1):
+                started_at = time.perf_counter()
+                data = self.links.download(file, end - start + 1, start)
+            handle.stats.fetch_seconds += time.perf_counter() - started_at
+            if not data:
+                return None
+            handle.stats.bytes_fetched += len(data)
+            STREAM_BYTES_FETCHED.labels(fetch_class).inc(len(data))
+            for chunk_offset in range(0, len(data), self.probe_chunk_size):
+                index = (start + chunk_offset) // self.probe_chunk_size
+                chunk = data[chunk_offset:chunk_offset + self.probe_chunk_size]
+                self.probe_cache.put((handle.key, index), chunk)
+                chunks[index] = chunk
+        return chunks
+
+    def _readProbe(self, handle: FileHandle, size: int, offset: int):
+        handle.stats.probe_reads += 1
+        start_chunk = offset // self.probe_chunk_size
+        end_chunk = (offset + size - 1) // self.probe_chunk_size
+
+        chunks = {}
+        missing = []
+        for index in range(start_chunk, end_chunk + 1):
+            chunk = self.probe_cache.get((handle.key, index))
+            if chunk is None:
+                missing.append(index)
+            else:
+                chunks[index] = chunk
+
+        if missing:
+            handle.stats.cache_misses += 1
+            STREAM_CACHE_LOOKUPS.labels("probe", "miss").inc()
+            logging.debug(f"Probe read of {size} bytes at {offset}, fetching {len(missing)} chunks...")
+            fetched = self._fetchProbeChunks(handle, missing)
+            if fetched is None:
+                return None
+            chunks.update(fetched)
+        else:
+            handle.stats.cache_hits += 1
+            STREAM_CACHE_LOOKUPS.labels("probe", "hit").inc()
+
+        buffer = bytearray()
+        for index in range(start_chunk, end_chunk + 1):
+            chunk = chunks.get(index)
+            if not chunk:
+                return None
+            chunk_offset = index * self.probe_chunk_size
+            buffer.extend(chunk[max(0, offset - chunk_offset):offset + size - chunk_offset])
+        return bytes(buffer)
+
+    def warmUp(self, file: FileRecord, head_size: int, tail_size: int):
+        """
+        Fetches the start and end of a file into the probe cache at the lowest priority, where scanners look first
+        when a file is new. Returns the number of bytes fetched, or None if the fetch failed.
+        """
+        file_size = file.file_size or 0
+        if file_size <= 0:
+            return 0
+        handle = FileHandle(0, file, self.links)
+        last_chunk = (file_size - 1) // self.probe_chunk_size
+        head_chunks = range(0, (min(head_size, file_size) + self.probe_chunk_size - 1) // self.probe_chunk_size)
+        tail_chunks = range(max(file_size - tail_size, 0) // self.probe_chunk_size, last_chunk + 1) if tail_size > 0 else range(0)
+        missing = [index for index in sorted(set(head_chunks) | set(tail_chunks)) if (handle.key, index) not in self.probe_cache]
+        if missing and self._fetchProbeChunks(handle, missing, "warmup") is None:
+            return None
+        return handle.stats.bytes_fetched
+
+    def read(self, handle: FileHandle, size: int, offset: int):
+        file = handle.file
+        file_size = file.file_size or 0
+        if offset >= file_size or size <= 0:
+            return b""
+        size = min(size, file_size - offset)
+        handle.recordRead(offset, size)
+
+        start_block = offset // self.block_size
+        end_block = (offset + size - 1) // self.block_size
+
+        if self.isProbeRead(handle, size) and any((handle.key, index) not in self.cache for index in range(start_block, end_block + 1)):
+            return self._readProbe(handle, size, offset)
+
+        buffer = bytearray()
+        for block_index in range(start_block, end_block + 1):
+            block_data = self._getBlock(handle, block_index)
+            if not block_data:
+                return None
+            self._pinBlock(handle, block_index)
+
+            block_offset = block_index * self.block_size
+            start_offset_in_block = max(0, offset - block_offset)
+            end_offset_in_block = min(len(block_data), offset + size - block_offset)
+            buffer.extend(block_data[start_offset_in_block:end_offset_in_block])
+
+        if handle.is_sequential:
+            self._prefetchBlock(handle, end_block + 1)
+
+        return bytes(buffer)
+
+_stream_manager: StreamManager | None = None
+_stream_manager_lock = threading.Lock()
+
+def getStreamManager():
+    """
+    Returns the stream manager of the process, so the FUSE mount and the stream proxy share one block cache and link cache.
+    """
+    global _stream_manager
+    with _stream_manager_lock:
+        if _stream_manager is None:
+            links = LinkManager()
+            links.start()
+            _stream_manager = StreamManager(links)
+        return _stream_manager
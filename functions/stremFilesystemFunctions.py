@@ -2,8 +2,9 @@ import os
 import glob
 import logging
 from library.app import RAW_MODE
-from library.filesystem import MOUNT_PATH
-from functions.appFunctions import getAllUserDownloads
+from library.filesystem import STRM_MOUNT_PATH, ENABLE_STREAM_PROXY
+from functions.snapshotFunctions import getLibrarySnapshot
+from functions.recordFunctions import FileRecord
 
 def getMountCategory(media_type: str | None):
     if media_type == "movie":
@@ -14,20 +15,20 @@ def getMountCategory(media_type: str | None):
         return "series"
     return None
 
-def generateFolderPath(data: dict) -> str | None:
+def generateFolderPath(data: FileRecord) -> str | None:
     """
     Takes in a user download and returns the folder path for the download.
     """
     
     if RAW_MODE:
-        original_path = data.get("path")
+        original_path = data.path
         if original_path:
             return os.path.dirname(original_path)
         return None
     else:
-        root_folder: str | None = data.get("metadata_rootfoldername", None)
-        metadata_foldername: str | None = data.get("metadata_foldername", None)
-        media_type = data.get("metadata_mediatype")
+        root_folder: str | None = data.metadata_rootfoldername
+        metadata_foldername: str | None = data.metadata_foldername
+        media_type = data.metadata_mediatype
 
         if not root_folder:
             return None
@@ -45,19 +46,19 @@ def generateFolderPath(data: dict) -> str | None:
 
         return None
 
-def generateStremFile(file_path: str, url: str, type: str, file_name: str, download=None):
+def generateStremFile(file_path: str, url: str, type: str, file_name: str, download: FileRecord | None = None):
     if RAW_MODE:
         if download is None:
             return False
-        original_path = download.get("path")
+        original_path = download.path
         if not original_path:
             return False
-        full_path = os.path.join(MOUNT_PATH, os.path.dirname(original_path))
+        full_path = os.path.join(STRM_MOUNT_PATH, os.path.dirname(original_path))
     else:
         mount_category = getMountCategory(type)
         if mount_category is None:
             return False
-        full_path = os.path.join(MOUNT_PATH, mount_category, file_path)
+        full_path = os.path.join(STRM_MOUNT_PATH, mount_category, file_path)
     try:
         os.makedirs(full_path, exist_ok=True)
         with open(f"{full_path}/{file_name}.strm", "w") as file:
@@ -74,51 +75,97 @@ def generateStremFile(file_path: str, url: str, type: str, file_name: str, downl
         logging.error(f"Error creating strm file: {e}")
         return False
 
-def runStrm():
-    all_downloads = getAllUserDownloads()
+def getStrmUrl(download: FileRecord) -> str:
+    """
+    Returns the URL written into the strm file, the stream proxy when it is enabled or else the download link.
+    """
+    if ENABLE_STREAM_PROXY:
+        from functions.proxyFunctions import getStreamUrl
+        return getStreamUrl(download)
+    return download.download_link
+
+def getStrmPath(download: FileRecord) -> str | None:
+    """
+    Returns the full path of the strm file for a download, or None if it has no place in the mount.
+    """
+    file_path = generateFolderPath(download)
+    if file_path is None:
+        return None
+    if RAW_MODE:
+        return os.path.join(STRM_MOUNT_PATH, file_path, f"{download.metadata_filename}.strm")
+    mount_category = getMountCategory(download.metadata_mediatype)
+    if mount_category is None:
+        return None
+    return os.path.join(STRM_MOUNT_PATH, mount_category, file_path, f"{download.metadata_filename}.strm")
+
+def removeStrmFile(strm_file: str):
+    try:
+        os.remove(strm_file)
+        logging.debug(f"Removed stale .strm file: {strm_file}")
+        # Remove empty directories
+        dir = os.path.dirname(strm_file)
+        while dir != STRM_MOUNT_PATH and not os.listdir(dir):
+            os.rmdir(dir)
+            dir = os.path.dirname(dir)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"Error removing .strm file: {e}")
+
+synced_snapshot_version = None
+
+def runStrm(force: bool = False):
+    """
+    Writes the strm files of the current library snapshot and removes stale ones. Skipped when the snapshot
+    did not change since the last run, unless forced.
+    """
+    global synced_snapshot_version
+    snapshot = getLibrarySnapshot()
+    if not force and snapshot.version == synced_snapshot_version:
+        logging.debug(f"Library snapshot {snapshot.version} is unchanged. Skipping strm sync.")
+        return
+    all_downloads = snapshot.files
     # Get all existing .strm files
-    existing_strm_files = set(glob.glob(os.path.join(MOUNT_PATH, "**", "*.strm"), recursive=True))
+    existing_strm_files = set(glob.glob(os.path.join(STRM_MOUNT_PATH, "**", "*.strm"), recursive=True))
 
     new_strm_files = set()
     for download in all_downloads:
-        file_path = generateFolderPath(download)
-        if file_path is None:
+        strm_path = getStrmPath(download)
+        if strm_path is None:
             continue
-        if RAW_MODE:
-            strm_path = os.path.join(MOUNT_PATH, file_path, f"{download.get('metadata_filename')}.strm")
-        else:
-            mount_category = getMountCategory(download.get("metadata_mediatype"))
-            if mount_category is None:
-                continue
-            strm_path = os.path.join(MOUNT_PATH, mount_category, file_path, f"{download.get('metadata_filename')}.strm")
         new_strm_files.add(strm_path)
-        generateStremFile(file_path, download.get("download_link"), download.get("metadata_mediatype"), download.get("metadata_filename"), download)
+        generateStremFile(generateFolderPath(download), getStrmUrl(download), download.metadata_mediatype, download.metadata_filename, download)
 
     # Remove .strm files for deleted downloads
     for strm_file in existing_strm_files:
         if strm_file not in new_strm_files:
-            try:
-                os.remove(strm_file)
-                logging.debug(f"Removed stale .strm file: {strm_file}")
-                # Remove empty directories
-                dir = os.path.dirname(strm_file)
-                while dir != MOUNT_PATH and not os.listdir(dir):
-                    os.rmdir(dir)
-                    dir = os.path.dirname(dir)
-            except Exception as e:
-                logging.error(f"Error removing .strm file: {e}")
+            removeStrmFile(strm_file)
 
+    synced_snapshot_version = snapshot.version
     logging.debug(f"Updated {len(all_downloads)} strm files.")
 
+def renameStrmFiles(renames: list[tuple[FileRecord, FileRecord]]):
+    """
+    Moves the strm files of downloads whose metadata changed, without rescanning the whole mount.
+    """
+    for old_download, new_download in renames:
+        old_path = getStrmPath(old_download)
+        new_path = getStrmPath(new_download)
+        if new_path is not None and new_path != old_path:
+            generateStremFile(generateFolderPath(new_download), getStrmUrl(new_download), new_download.metadata_mediatype, new_download.metadata_filename, new_download)
+        if old_path is not None and old_path != new_path:
+            removeStrmFile(old_path)
+    logging.debug(f"Renamed {len(renames)} strm files.")
+
 def unmountStrm():
     """
     Deletes all strm files and any subfolders in the mount path for cleaning up.
     """
     folders = [
-        MOUNT_PATH,
-        os.path.join(MOUNT_PATH, "movies"),
-        os.path.join(MOUNT_PATH, "series"),
-        os.path.join(MOUNT_PATH, "music"),
+        STRM_MOUNT_PATH,
+        os.path.join(STRM_MOUNT_PATH, "movies"),
+        os.path.join(STRM_MOUNT_PATH, "series"),
+        os.path.join(STRM_MOUNT_PATH, "music"),
     ]
     for folder in folders:
         if os.path.exists(folder):
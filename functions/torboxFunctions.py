@@ -1,15 +1,23 @@
-from library.http import api_http_client, search_api_http_client, general_http_client, requestWrapper
+from library.http import api_http_client, search_api_http_client, general_http_client, requestWrapper, parseJson, TORBOX_API_URL
 import httpx
 from enum import Enum
 import PTN
 from library.torbox import TORBOX_API_KEY
-from library.app import SCAN_METADATA, ENABLE_AUDIO
+from library.app import SCAN_METADATA, ENABLE_AUDIO, BACKGROUND_METADATA
+from library.metrics import METADATA_LOOKUPS, LISTING_PAGES, LISTING_BYTES, LISTING_PARSE_SECONDS
 from functions.mediaFunctions import constructSeriesTitle, cleanTitle, cleanYear
-from functions.databaseFunctions import insertData, getDatabase, getDatabaseLock
+from functions.databaseFunctions import insertData, insertMultipleData, getDatabase, getDatabaseLock
+from functions.recordFunctions import FileRecord, parseTimestamp
+from functions.profileFunctions import profilePhase, profileCount, profileFileTiming
+from functions.identityFunctions import getIdentityIndex
+from functions.searchFunctions import MetadataSearchBatcher
+from functions.generationFunctions import RefreshCheckpoint
+from functions.listingFunctions import listing_cache
 import os
 import logging
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import multiprocessing
 from tinydb import Query
 import hashlib
@@ -17,6 +25,7 @@ import json
 import time
 import re
 from difflib import SequenceMatcher
+from typing import Iterable
 
 class DownloadType(Enum):
     torrent = "torrents"
@@ -53,6 +62,10 @@ METADATA_FAILURE_CACHE_TTL_SECONDS = 60 * 60 * 6  # 6 hours
 METADATA_MAX_WORKERS = 2
 METADATA_IDENTITY_CACHE_PREFIX = "metadata_identity"
 METADATA_MIN_SCORE = 35.0
+CHANGE_PROBE_LIMIT = 50 # items hashed by the change probe
+LISTING_PAGE_SIZE = 1000
+REFRESH_CHUNK_SIZE = 500 # processed files stored with one write
+MAX_PENDING_FILES_PER_WORKER = 4 # files submitted ahead of the processing threads
 
 def getAcceptedMediaType(mimetype: str | None):
     if not mimetype:
@@ -66,6 +79,12 @@ def getAcceptedMediaType(mimetype: str | None):
 
     return None
 
+def getRequestDownloadUrl(type: str, item_id: int | None, file_id: int | None):
+    """
+    Builds the TorBox request download url for a file. Built on demand so the API key is not stored per file.
+    """
+    return f"{TORBOX_API_URL}/{type}/requestdl?token={TORBOX_API_KEY}&{IDType[type].value}={item_id}&file_id={file_id}&redirect=true"
+
 def getBasicMusicMetadata(item: dict, file: dict):
     file_name = file.get("short_name") or file.get("name") or str(file.get("id"))
     root_folder_name = item.get("name") or item.get("hash") or "music"
@@ -401,8 +420,11 @@ def buildMetadataFromIdentity(identity_metadata: dict, base_metadata: dict, exte
 
     return metadata
 
-def process_file(item, file, type):
-    """Process a single file and return the processed data"""
+def buildFileRecord(item, file, type, defer_metadata: bool = False):
+    """
+    Builds the record of a single file without storing it. Returns the record and, when its metadata lookup was
+    deferred, the search arguments for the background lookup. Returns None for files that are not media.
+    """
     short_name = file.get("short_name") or file.get("name") or str(file.get("id"))
     mimetype = file.get("mimetype")
     media_type = getAcceptedMediaType(mimetype)
@@ -416,37 +438,35 @@ def process_file(item, file, type):
         "item_id": item.get("id"),
         "type": type.value,
         "folder_name": item_name,
-        "DEBUG_name": item_name,
-        "DEBUG_hash": item.get("hash"),
-        "DEBUG_file_name": short_name,
         "folder_hash": item.get("hash"),
         "file_id": file.get("id"),
         "file_name": short_name,
         "file_size": file.get("size"),
         "file_mimetype": mimetype,
         "path": file.get("name"),
-        "download_link": f"https://api.torbox.app/v1/api/{type.value}/requestdl?token={TORBOX_API_KEY}&{IDType[type.value].value}={item.get('id')}&file_id={file.get('id')}&redirect=true",
         "extension": os.path.splitext(short_name)[-1],
+        "created_at": parseTimestamp(item.get("created_at")),
     }
 
     if media_type == "music":
         metadata = getBasicMusicMetadata(item, file)
         data.update(metadata)
-        logging.debug(data)
-        insertData(data, type.value)
-        return data
+        record = FileRecord.fromDict(data)
+        logging.debug(record)
+        return record, None
 
-    title_data = PTN.parse(short_name)
+    with profilePhase(type.value, "parsing"):
+        title_data = PTN.parse(short_name)
 
-    if item_name == item.get("hash"):
-        item_name = title_data.get("title", short_name)
-        data["folder_name"] = item_name
+        if item_name == item.get("hash"):
+            item_name = title_data.get("title", short_name)
+            data["folder_name"] = item_name
 
-    parsed_season, parsed_episode, is_special_request = getParsedSeasonEpisode(
-        title_data,
-        short_name,
-        file.get("name"),
-    )
+        parsed_season, parsed_episode, is_special_request = getParsedSeasonEpisode(
+            title_data,
+            short_name,
+            file.get("name"),
+        )
 
     item_identity_cache_key = getIdentityCacheKey(type, item.get("hash"), item.get("id"))
     expects_series_hint = parsed_season is not None or parsed_episode is not None
@@ -458,101 +478,283 @@ def process_file(item, file, type):
         )
 
     cache_key = getMetadataCacheKey(type, item, file) if SCAN_METADATA else None
-    metadata, _, _ = searchMetadata(
-        title_data.get("title", short_name),
-        title_data,
-        short_name,
-        f"{item_name} {short_name}",
-        item.get("hash"),
-        item_name,
-        cache_key=cache_key,
-        parsed_season=parsed_season,
-        parsed_episode=parsed_episode,
-        is_special_request=is_special_request,
-        item_identity_cache_key=item_identity_cache_key,
-        series_identity_cache_keys=series_identity_cache_keys,
-    )
+    search_kwargs = {
+        "query": title_data.get("title", short_name),
+        "title_data": title_data,
+        "file_name": short_name,
+        "full_title": f"{item_name} {short_name}",
+        "hash": item.get("hash"),
+        "item_name": item_name,
+        "cache_key": cache_key,
+        "parsed_season": parsed_season,
+        "parsed_episode": parsed_episode,
+        "is_special_request": is_special_request,
+        "item_identity_cache_key": item_identity_cache_key,
+        "series_identity_cache_keys": series_identity_cache_keys,
+    }
+    with profilePhase(type.value, "metadata"):
+        metadata, metadata_success, _ = searchMetadata(**search_kwargs, defer_api=defer_metadata)
     data.update(metadata)
-    logging.debug(data)
-    insertData(data, type.value)
-    return data
+    record = FileRecord.fromDict(data)
+    logging.debug(record)
+    return record, search_kwargs if metadata_success is None else None
 
-def getUserDownloads(type: DownloadType):
+def process_file(item, file, type, defer_metadata: bool = False):
+    """Process a single file and return the processed data"""
+    result = buildFileRecord(item, file, type, defer_metadata)
+    if result is None:
+        return None
+    record, search_kwargs = result
+    with profilePhase(type.value, "database"):
+        insertData(record.toDict(), type.value)
+    if search_kwargs is not None:
+        # published with base metadata now, renamed once the background lookup resolves
+        from functions.enrichmentFunctions import enqueueMetadataEnrichment
+        enqueueMetadataEnrichment(record, search_kwargs)
+    return record
+
+def buildFileRecordTimed(item, file, type, defer_metadata: bool = False):
+    started_at = time.perf_counter()
+    try:
+        return buildFileRecord(item, file, type, defer_metadata)
+    finally:
+        profileFileTiming(type.value, file.get("short_name") or file.get("name") or str(file.get("id")), time.perf_counter() - started_at)
+
+class ListingError(Exception):
+    pass
+
+class StorageError(Exception):
+    pass
+
+def iterUserDownloadPages(type: DownloadType, checkpoint: RefreshCheckpoint | None = None):
+    """
+    Yields the pages of a download list as they arrive. With a checkpoint, the pages an interrupted refresh
+    already fetched are yielded first, and every new page is saved before it is yielded.
+    Raises ListingError if a page cannot be fetched.
+    """
     offset = 0
-    limit = 1000
-
-    file_data = []
+    if checkpoint is not None:
+        yield from checkpoint.iterPages()
+        if checkpoint.listing_complete:
+            return
+        offset = checkpoint.next_offset
     
     while True:
         params = {
-            "limit": limit,
+            "limit": LISTING_PAGE_SIZE,
             "offset": offset,
             "bypass_cache": True,
         }
+        conditional_headers = listing_cache.getHeaders(type.value, offset, LISTING_PAGE_SIZE)
         try:
-            response = api_http_client.get(f"/{type.value}/mylist", params=params)
+            with profilePhase(type.value, "pagination"):
+                response = api_http_client.get(f"/{type.value}/mylist", params=params, headers=conditional_headers)
         except Exception as e:
-            logging.error(f"Error fetching {type.value} at offset {offset}: {e}")
-            return None, False, f"Error fetching {type.value} at offset {offset}: {e}"
-        if response.status_code != 200:
-            return None, False, f"Error fetching {type.value} at offset {offset}. {response.status_code}"
+            raise ListingError(f"Error fetching {type.value} at offset {offset}: {e}")
+        LISTING_PAGES.labels(type.value, response.status_code).inc()
+        LISTING_BYTES.labels(type.value).inc(response.num_bytes_downloaded)
+        profileCount(type.value, "listing_bytes", response.num_bytes_downloaded)
+        if response.status_code == 304 and conditional_headers:
+            content = listing_cache.load(type.value, offset)
+            if content is None:
+                raise ListingError(f"Cached {type.value} page at offset {offset} is missing.")
+            profileCount(type.value, "listing_pages_unchanged")
+        elif response.status_code == 200:
+            content = response.content
+            listing_cache.store(type.value, offset, LISTING_PAGE_SIZE, response.headers, content)
+        else:
+            raise ListingError(f"Error fetching {type.value} at offset {offset}. {response.status_code}")
+        parse_started_at = time.perf_counter()
         try:
-            data = response.json().get("data", [])
+            with profilePhase(type.value, "listing_parse"):
+                data = parseJson(content).get("data", []) or []
         except Exception as e:
-            logging.error(f"Error parsing {type.value} at offset {offset}: {e}")
-            logging.error(f"Response: {response.text}")
-            return None, False, f"Error parsing {type.value} at offset {offset}. {e}"
+            logging.error(f"Response: {content[:1000]!r}")
+            listing_cache.discard(type.value, offset)
+            raise ListingError(f"Error parsing {type.value} at offset {offset}. {e}")
+        parse_seconds = time.perf_counter() - parse_started_at
+        LISTING_PARSE_SECONDS.labels(type.value).observe(parse_seconds)
+        logging.debug(f"Listing page {type.value} at offset {offset}: status {response.status_code}, {response.num_bytes_downloaded} bytes received, {len(content)} bytes decoded, parsed in {parse_seconds * 1000:.1f} ms.")
+        if checkpoint is not None:
+            with profilePhase(type.value, "checkpoint"):
+                checkpoint.savePage(offset, offset + LISTING_PAGE_SIZE, data, complete=len(data) < LISTING_PAGE_SIZE)
         if not data:
-            break
-        file_data.extend(data)
-        offset += limit
-        if len(data) < limit:
-            break
-
-    if not file_data:
-        return None, True, f"No {type.value} found."
-    
-    logging.debug(f"Fetched {len(file_data)} {type.value} items from API.")
-
+            return
+        logging.debug(f"Fetched {len(data)} {type.value} items at offset {offset}.")
+        yield data
+        if len(data) < LISTING_PAGE_SIZE:
+            return
+        offset += LISTING_PAGE_SIZE
+
+def iterDownloadFiles(type: DownloadType, pages: Iterable[list[dict]], checkpoint: RefreshCheckpoint | None = None):
+    """
+    Yields the files of cached items one page at a time, skipping items repeated by a shifted page
+    and files the checkpoint already covers.
+    """
+    seen_items = set()
+    for page in pages:
+        profileCount(type.value, "items", len(page))
+        for item in page:
+            item_id = item.get("id")
+            if item_id is not None:
+                if item_id in seen_items:
+                    continue
+                seen_items.add(item_id)
+            if not item.get("cached", False):
+                continue
+            for file in item.get("files", []):
+                if checkpoint is not None and checkpoint.isProcessed(item_id, file.get("id")):
+                    continue
+                yield item, file
+
+def getUserDownloadItem(type: DownloadType, item_id: int):
+    """
+    Fetches a single item from the download list. Returns None with success when the item no longer exists.
+    """
+    params = {
+        "id": item_id,
+        "bypass_cache": True,
+    }
+    try:
+        with profilePhase(type.value, "pagination"):
+            response = api_http_client.get(f"/{type.value}/mylist", params=params)
+    except Exception as e:
+        logging.error(f"Error fetching {type.value} item {item_id}: {e}")
+        return None, False, f"Error fetching {type.value} item {item_id}: {e}"
+    LISTING_PAGES.labels(type.value, response.status_code).inc()
+    if response.status_code == 404:
+        return None, True, f"{type.value.capitalize()} item {item_id} not found."
+    if response.status_code != 200:
+        return None, False, f"Error fetching {type.value} item {item_id}. {response.status_code}"
+    try:
+        data = parseJson(response.content).get("data")
+    except Exception as e:
+        logging.error(f"Error parsing {type.value} item {item_id}: {e}")
+        return None, False, f"Error parsing {type.value} item {item_id}. {e}"
+    # the list endpoint returns a single object when filtering by id
+    if isinstance(data, list):
+        data = next((item for item in data if str(item.get("id")) == str(item_id)), None)
+    if not data:
+        return None, True, f"{type.value.capitalize()} item {item_id} not found."
+    return data, True, f"{type.value.capitalize()} item {item_id} fetched successfully."
+
+def processDownloadItems(type: DownloadType, file_data: list[dict], table: str | None = None):
+    """
+    Processes and stores the files of the given download items. Returns the number of stored files.
+    """
+    return processDownloadFiles(type, iterDownloadFiles(type, [file_data]), table)
+
+def processDownloadFiles(type: DownloadType, files: Iterable[tuple[dict, dict]], table: str | None = None, checkpoint: RefreshCheckpoint | None = None):
+    """
+    Processes files in parallel as they are yielded and stores them in table, the download type's own table by
+    default, one chunk at a time. Only a bounded number of files is in flight or waiting to be stored, so memory
+    does not grow with the size of the library. Returns the number of stored files.
+    """
     if SCAN_METADATA:
-        pruneExpiredMetadataCache()
-    
-    files = []
+        with profilePhase(type.value, "database"):
+            pruneExpiredMetadataCache()
+
+    table = table or type.value
     
     # Get the number of CPU cores for parallel processing
     max_workers = int(multiprocessing.cpu_count() * 2 - 1)
     if SCAN_METADATA:
         max_workers = min(max_workers, METADATA_MAX_WORKERS)
     logging.info(f"Processing files with {max_workers} parallel threads")
-    
-    # Collect all files to process
-    files_to_process = []
-    for item in file_data:
-        if not item.get("cached", False):
-            continue
-        for file in item.get("files", []):
-            files_to_process.append((item, file))
-    
-    # Process files in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_file = {
-            executor.submit(process_file, item, file, type): (item, file) 
-            for item, file in files_to_process
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_file):
+
+    stored = 0
+    chunk = []
+    in_flight = {}
+
+    def collect(futures):
+        for future in futures:
+            item, file = in_flight.pop(future)
             try:
-                data = future.result()
-                if data:
-                    files.append(data)
+                chunk.append((item.get("id"), file.get("id"), future.result()))
             except Exception as e:
-                item, file = future_to_file[future]
+                # left out of the checkpoint, so a resumed refresh tries it again
                 logging.error(f"Error processing file {file.get('short_name', 'unknown')}: {e}")
                 logging.error(traceback.format_exc())
-            
-    return files, True, f"{type.value.capitalize()} fetched successfully."
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item, file in files:
+            profileCount(type.value, "files")
+            in_flight[executor.submit(buildFileRecordTimed, item, file, type, BACKGROUND_METADATA)] = (item, file)
+            if len(in_flight) >= max_workers * MAX_PENDING_FILES_PER_WORKER:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            if len(chunk) >= REFRESH_CHUNK_SIZE:
+                stored += storeFileChunk(type, chunk, table, checkpoint)
+                chunk.clear()
+        collect(list(in_flight))
+    stored += storeFileChunk(type, chunk, table, checkpoint)
+    return stored
+
+def storeFileChunk(type: DownloadType, chunk: list[tuple[int, int, tuple[FileRecord, dict | None] | None]], table: str, checkpoint: RefreshCheckpoint | None = None):
+    """
+    Stores a chunk of processed files with one write, then queues their deferred metadata lookups and
+    checkpoints them. Returns the number of stored files.
+    Raises StorageError if the chunk cannot be stored, so the refresh is not promoted without it.
+    """
+    records = [result for _, _, result in chunk if result is not None]
+    if not chunk:
+        return 0
+    if records:
+        with profilePhase(type.value, "database"):
+            success, detail = insertMultipleData([record.toDict() for record, _ in records], table)
+        if not success:
+            raise StorageError(f"Error storing {len(records)} {type.value} files: {detail}")
+    deferred = [(record, search_kwargs) for record, search_kwargs in records if search_kwargs is not None]
+    if deferred:
+        # published with base metadata now, renamed once the background lookup resolves
+        from functions.enrichmentFunctions import enqueueMetadataEnrichment
+        for record, search_kwargs in deferred:
+            enqueueMetadataEnrichment(record, search_kwargs)
+    if checkpoint is not None:
+        with profilePhase(type.value, "checkpoint"):
+            for item_id, file_id, result in chunk:
+                checkpoint.markProcessed(item_id, file_id, deferred=result is not None and result[1] is not None)
+    return len(records)
+
+def getDownloadsFingerprint(type: DownloadType, limit: int = CHANGE_PROBE_LIMIT):
+    """
+    Cheap change probe. Hashes the most recently updated page of a download list, which changes whenever an item is
+    added, finishes caching or is updated. Removing an item that is not on that page goes unnoticed until the next
+    full refresh.
+    """
+    params = {
+        "limit": limit,
+        "offset": 0,
+        "bypass_cache": True,
+    }
+    try:
+        response = api_http_client.get(f"/{type.value}/mylist", params=params)
+    except Exception as e:
+        return None, False, f"Error probing {type.value}: {e}"
+    LISTING_PAGES.labels(type.value, response.status_code).inc()
+    if response.status_code != 200:
+        return None, False, f"Error probing {type.value}. {response.status_code}"
+    try:
+        data = parseJson(response.content).get("data", []) or []
+    except Exception as e:
+        return None, False, f"Error parsing {type.value} probe: {e}"
+
+    summary = [
+        (item.get("id"), item.get("cached", False), item.get("updated_at"), len(item.get("files") or []))
+        for item in data
+    ]
+    return hashlib.sha256(json.dumps(summary, default=str).encode()).hexdigest(), True, f"Probed {len(data)} {type.value} items."
+
+_search_batcher: MetadataSearchBatcher | None = None
+_search_batcher_lock = threading.Lock()
+
+def getSearchBatcher():
+    global _search_batcher
+    with _search_batcher_lock:
+        if _search_batcher is None:
+            # requestWrapper is looked up on every call so it can be swapped out, like in the regression tests
+            _search_batcher = MetadataSearchBatcher(lambda *args, **kwargs: requestWrapper(*args, **kwargs), search_api_http_client)
+        return _search_batcher
 
 def searchMetadata(
     query: str,
@@ -567,7 +769,12 @@ def searchMetadata(
     is_special_request: bool = False,
     item_identity_cache_key: str | None = None,
     series_identity_cache_keys: list[str] | None = None,
+    defer_api: bool = False,
 ):
+    """
+    Resolves metadata from the caches, then the search API. With defer_api, returns the base metadata with a
+    success of None instead of calling the API, so the lookup can be queued for background enrichment.
+    """
     base_metadata = {
         "metadata_title": cleanTitle(query),
         "metadata_link": None,
@@ -595,6 +802,7 @@ def searchMetadata(
         if cached_result is not None:
             cached_metadata, cached_success, cached_detail = cached_result
             logging.debug(f"Metadata cache hit for key {cache_key}")
+            METADATA_LOOKUPS.labels("cache").inc()
             return cached_metadata, cached_success, f"Metadata cache hit. {cached_detail}"
 
     extension = os.path.splitext(file_name)[-1]
@@ -610,6 +818,7 @@ def searchMetadata(
         if cached_identity is None:
             continue
 
+        METADATA_LOOKUPS.labels("identity").inc()
         metadata_from_identity = buildMetadataFromIdentity(
             cached_identity,
             base_metadata=base_metadata,
@@ -620,8 +829,33 @@ def searchMetadata(
         )
         return cacheAndReturn(metadata_from_identity, True, f"Metadata identity cache hit for key {identity_cache_key}")
 
+    # releases named differently from an already resolved title, for example "The.Office.US" and "The Office (US)"
+    expects_series_hint = parsed_season is not None or parsed_episode is not None
+    indexed_identity = getIdentityIndex().lookup(title_data.get("title") or query, title_data.get("year"), expects_series_hint)
+    if indexed_identity is not None:
+        METADATA_LOOKUPS.labels("index").inc()
+        for identity_cache_key in identity_cache_keys:
+            setCachedMetadata(identity_cache_key, indexed_identity, True, "Metadata identity resolved from the identity index.")
+        metadata_from_identity = buildMetadataFromIdentity(
+            indexed_identity,
+            base_metadata=base_metadata,
+            extension=extension,
+            parsed_season=parsed_season,
+            parsed_episode=parsed_episode,
+            is_special_request=is_special_request,
+        )
+        return cacheAndReturn(metadata_from_identity, True, f"Metadata identity index hit for {indexed_identity.get('metadata_title')}")
+
+    if defer_api:
+        return base_metadata, None, "Metadata lookup deferred."
+
+    METADATA_LOOKUPS.labels("api").inc()
+    # every episode of a show has its own query, but they resolve from the same title and year, so episodes
+    # searched at the same time share the first one's results, like they share the identity cache afterwards
+    normalized_title = normalizeTitle(title_data.get("title") or query)
+    search_key = f"{'series' if expects_series_hint else 'title'}:{normalized_title}:{cleanYear(title_data.get('year')) or ''}" if normalized_title else None
     try:
-        response = requestWrapper(search_api_http_client, "GET", f"/meta/search/{full_title}", params={"type": "file"})
+        response = getSearchBatcher().search(full_title, {"type": "file"}, key=search_key)
     except Exception as e:
         logging.error(f"Error searching metadata: {e}")
         return cacheAndReturn(base_metadata, False, f"Error searching metadata: {e}. Searching for {query}, item hash: {hash}")
@@ -677,6 +911,8 @@ def searchMetadata(
         if item_identity_cache_key is not None:
             setCachedMetadata(item_identity_cache_key, identity_metadata, True, "Item metadata identity cached.")
 
+        getIdentityIndex().add(identity_metadata, [query, title_data.get("title")])
+
         if series_identity_cache_keys and identity_metadata.get("metadata_mediatype") in ("series", "anime"):
             for identity_cache_key in set(series_identity_cache_keys):
                 setCachedMetadata(identity_cache_key, identity_metadata, True, "Series metadata identity cached.")
@@ -695,8 +931,9 @@ def searchMetadata(
         logging.error(f"Error searching metadata: {traceback.format_exc()}")
         return cacheAndReturn(base_metadata, False, f"Error searching metadata: {e}. Searching for {query}, item hash: {hash}")
 
-def getDownloadLink(url: str):
-    response = requestWrapper(general_http_client, "GET", url)
+def getDownloadLink(url: str, use_cache: bool = True):
+    # links are resolved when a file is opened or read, so they fail fast like the reads themselves
+    response = requestWrapper(general_http_client, "GET", url, use_cache=use_cache, request_class="stream")
     if response.status_code == httpx.codes.TEMPORARY_REDIRECT or response.status_code == httpx.codes.PERMANENT_REDIRECT or response.status_code == httpx.codes.FOUND:
         return response.headers.get('Location')
     return url
@@ -706,7 +943,8 @@ def downloadFile(url: str, size: int, offset: int = 0):
         "Range": f"bytes={offset}-{offset + size - 1}",
         **general_http_client.headers,
     }
-    response = requestWrapper(general_http_client, "GET", url, headers=headers)
+    # ranges are not part of the response cache key, so file data must never be cached
+    response = requestWrapper(general_http_client, "GET", url, use_cache=False, request_class="stream", headers=headers)
     if response.status_code == httpx.codes.OK:
         return response.content
     elif response.status_code == httpx.codes.PARTIAL_CONTENT:
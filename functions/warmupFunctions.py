@@ -0,0 +1,119 @@
+from library.filesystem import WARMUP_HEAD_MB, WARMUP_TAIL_MB, WARMUP_BUDGET_MB
+from library.metrics import WARMUP_FILES
+from functions.snapshotFunctions import LibrarySnapshot
+from functions.linkFunctions import getLinkKey
+from functions.recordFunctions import FileRecord
+from typing import Callable
+import threading
+import logging
+
+def getNewFiles(previous: LibrarySnapshot, snapshot: LibrarySnapshot):
+    """
+    Returns the files of snapshot that previous did not have, newest first. Renamed files are not new.
+    """
+    known = {getLinkKey(file) for file in previous.files}
+    files = [file for file in snapshot.files if getLinkKey(file) not in known]
+    files.sort(key=lambda file: file.created_at or 0, reverse=True)
+    return files
+
+class WarmUpQueue:
+    """
+    Fetches the start and end of every file added by a new library snapshot, which is what media servers probe
+    first, so their first scan of new files is served from the cache. The first snapshot only sets the baseline,
+    and each later one is compared with the last snapshot seen, so a snapshot that arrives while a warm-up is
+    running is handled once it finishes.
+    """
+    def __init__(
+        self,
+        get_streams: Callable | None = None,
+        head_size: int = WARMUP_HEAD_MB * 1024 * 1024,
+        tail_size: int = WARMUP_TAIL_MB * 1024 * 1024,
+        budget: int = WARMUP_BUDGET_MB * 1024 * 1024,
+    ):
+        if get_streams is None:
+            from functions.streamFunctions import getStreamManager
+            get_streams = getStreamManager
+        self.get_streams = get_streams
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.budget = budget
+        self.snapshot: LibrarySnapshot | None = None
+        self.pending: LibrarySnapshot | None = None
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="warmup")
+                self.thread.start()
+        return self
+
+    def submit(self, snapshot: LibrarySnapshot):
+        with self.condition:
+            self.pending = snapshot
+            self.condition.notify()
+        self.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                snapshot, self.pending = self.pending, None
+            try:
+                self.process(snapshot)
+            except Exception as e:
+                logging.error(f"Error warming up new files: {e}")
+
+    def process(self, snapshot: LibrarySnapshot):
+        """
+        Warms up the files snapshot added since the last snapshot processed. Returns the number of files warmed up.
+        """
+        previous, self.snapshot = self.snapshot, snapshot
+        if previous is None or previous.version == snapshot.version:
+            return 0
+        files = getNewFiles(previous, snapshot)
+        if not files:
+            return 0
+        return self.warmUp(files)
+
+    def warmUp(self, files: list[FileRecord]):
+        streams = self.get_streams()
+        # the warmed chunks land in the probe cache, fetching more than it holds would only evict them again
+        budget = min(self.budget, streams.probe_cache.max_blocks * streams.probe_chunk_size)
+        spent = 0
+        warmed = 0
+        for position, file in enumerate(files):
+            cost = min(self.head_size + self.tail_size, file.file_size or 0)
+            if spent + cost > budget:
+                WARMUP_FILES.labels("over_budget").inc(len(files) - position)
+                logging.debug(f"Warm-up budget used up, skipping {len(files) - position} new files.")
+                break
+            try:
+                # the download resolves the file's link too, so opening it later skips the API
+                fetched = streams.warmUp(file, self.head_size, self.tail_size)
+            except Exception as e:
+                logging.warning(f"Error warming up {file.file_name}: {e}")
+                fetched = None
+            if fetched is None:
+                WARMUP_FILES.labels("failed").inc()
+                continue
+            spent += cost
+            warmed += 1
+            WARMUP_FILES.labels("warmed").inc()
+        logging.info(f"Warmed up {warmed} of {len(files)} new files with {spent / 1024 / 1024:.1f} MB.")
+        return warmed
+
+_warmup_queue: WarmUpQueue | None = None
+_warmup_queue_lock = threading.Lock()
+
+def getWarmUpQueue():
+    global _warmup_queue
+    with _warmup_queue_lock:
+        if _warmup_queue is None:
+            _warmup_queue = WarmUpQueue()
+        return _warmup_queue
+
+def queueWarmUp(snapshot: LibrarySnapshot):
+    getWarmUpQueue().submit(snapshot)
@@ -7,6 +7,28 @@ load_dotenv()
 SCAN_METADATA = os.getenv("ENABLE_METADATA", "false").lower() == "true"
 ENABLE_AUDIO = os.getenv("ENABLE_AUDIO", "false").lower() == "true"
 RAW_MODE = os.getenv("RAW_MODE", "true").lower() == "true"
+ENABLE_METRICS = os.getenv("ENABLE_METRICS", "false").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# new files are published right away and their metadata is looked up in the background
+BACKGROUND_METADATA = os.getenv("ENABLE_BACKGROUND_METADATA", "false").lower() == "true"
+METADATA_SEARCH_RATE = float(os.getenv("METADATA_SEARCH_RATE", "2")) # search API requests per second
+assert METADATA_SEARCH_RATE > 0, "METADATA_SEARCH_RATE must be greater than 0"
+# searches are collected for a short window and sent together, as one request when a multi-query path is set
+METADATA_SEARCH_BATCH_PATH = os.getenv("METADATA_SEARCH_BATCH_PATH", "")
+METADATA_SEARCH_BATCH_SIZE = int(os.getenv("METADATA_SEARCH_BATCH_SIZE", "25"))
+METADATA_SEARCH_BATCH_WINDOW = float(os.getenv("METADATA_SEARCH_BATCH_WINDOW", "0.05"))
+METADATA_SEARCH_CONCURRENCY = int(os.getenv("METADATA_SEARCH_CONCURRENCY", "4"))
+assert METADATA_SEARCH_BATCH_SIZE > 0, "METADATA_SEARCH_BATCH_SIZE must be greater than 0"
+assert METADATA_SEARCH_CONCURRENCY > 0, "METADATA_SEARCH_CONCURRENCY must be greater than 0"
+ENABLE_CONTROL_API = os.getenv("ENABLE_CONTROL_API", "false").lower() == "true"
+CONTROL_API_HOST = os.getenv("CONTROL_API_HOST", "127.0.0.1")
+CONTROL_API_PORT = int(os.getenv("CONTROL_API_PORT", "9465"))
+CONTROL_API_TOKEN = os.getenv("CONTROL_API_TOKEN", "")
+REFRESH_PROFILE_PATH = os.getenv("REFRESH_PROFILE_PATH", "")
+REFRESH_PROFILE_SLOWEST_FILES = int(os.getenv("REFRESH_PROFILE_SLOWEST_FILES", "10"))
+REFRESH_PROFILER = os.getenv("REFRESH_PROFILER", "").lower() # cprofile or sampling
+REFRESH_PROFILER_PATH = os.getenv("REFRESH_PROFILER_PATH", "")
 
 class MountRefreshTimes(Enum):
     # times are shown in hours
@@ -37,5 +59,19 @@ if MOUNT_REFRESH_TIME == "instant" and SCAN_METADATA:
 else:
     MOUNT_REFRESH_TIME = MountRefreshTimes[MOUNT_REFRESH_TIME].value
 
+# the change probe runs between these intervals, a full refresh still runs at least every MOUNT_REFRESH_TIME
+REFRESH_PROBE_MIN_SECONDS = int(os.getenv("REFRESH_PROBE_MIN_SECONDS", "60"))
+REFRESH_PROBE_MAX_SECONDS = int(os.getenv("REFRESH_PROBE_MAX_SECONDS", "900"))
+assert REFRESH_PROBE_MIN_SECONDS > 0, "REFRESH_PROBE_MIN_SECONDS must be greater than 0"
+assert REFRESH_PROBE_MAX_SECONDS >= REFRESH_PROBE_MIN_SECONDS, "REFRESH_PROBE_MAX_SECONDS must be at least REFRESH_PROBE_MIN_SECONDS"
+
+# leader nodes refresh and publish the library to SHARED_LIBRARY_PATH, follower nodes only load it from there and serve it
+NODE_ROLE = os.getenv("NODE_ROLE", "standalone").lower()
+assert NODE_ROLE in ("standalone", "leader", "follower"), f"Invalid node role: {NODE_ROLE}. Valid options are: standalone, leader, follower"
+SHARED_LIBRARY_PATH = os.getenv("SHARED_LIBRARY_PATH", "")
+assert NODE_ROLE == "standalone" or SHARED_LIBRARY_PATH, "SHARED_LIBRARY_PATH is required for leader and follower nodes"
+SHARED_LIBRARY_POLL_SECONDS = int(os.getenv("SHARED_LIBRARY_POLL_SECONDS", "30"))
+assert SHARED_LIBRARY_POLL_SECONDS > 0, "SHARED_LIBRARY_POLL_SECONDS must be greater than 0"
+
 def getCurrentVersion():
     return "v2.0.0"
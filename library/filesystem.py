@@ -7,9 +7,61 @@ load_dotenv()
 class MountMethods(Enum):
     strm = "strm"
     fuse = "fuse"
+    both = "both" # one refresh pipeline feeding a STRM tree and a FUSE mount
 
 MOUNT_METHOD = os.getenv("MOUNT_METHOD", MountMethods.strm.value)
 assert MOUNT_METHOD in [method.value for method in MountMethods], "MOUNT_METHOD is not set correctly in .env file"
 
 MOUNT_PATH = os.getenv("MOUNT_PATH", "./torbox")
-assert MOUNT_PATH, "MOUNT_PATH is not set in .env file"
\ No newline at end of file
+assert MOUNT_PATH, "MOUNT_PATH is not set in .env file"
+
+def getMountMethods(mount_method: str):
+    """
+    Returns the mounts a mount method serves.
+    """
+    if mount_method == MountMethods.both.value:
+        return [MountMethods.strm.value, MountMethods.fuse.value]
+    return [mount_method]
+
+# with both mounts, each gets its own folder inside MOUNT_PATH unless set separately
+STRM_MOUNT_PATH = os.getenv("STRM_MOUNT_PATH", os.path.join(MOUNT_PATH, "strm") if MOUNT_METHOD == MountMethods.both.value else MOUNT_PATH)
+FUSE_MOUNT_PATH = os.getenv("FUSE_MOUNT_PATH", os.path.join(MOUNT_PATH, "fuse") if MOUNT_METHOD == MountMethods.both.value else MOUNT_PATH)
+assert MOUNT_METHOD != MountMethods.both.value or os.path.abspath(STRM_MOUNT_PATH) != os.path.abspath(FUSE_MOUNT_PATH), "STRM_MOUNT_PATH and FUSE_MOUNT_PATH must be different folders"
+
+# kernel attribute caching for the FUSE mount, timeouts are in seconds
+FUSE_ATTR_TIMEOUT = float(os.getenv("FUSE_ATTR_TIMEOUT", "300"))
+FUSE_ENTRY_TIMEOUT = float(os.getenv("FUSE_ENTRY_TIMEOUT", "300"))
+FUSE_KERNEL_CACHE = os.getenv("FUSE_KERNEL_CACHE", "true").lower() == "true"
+assert FUSE_ATTR_TIMEOUT >= 0, "FUSE_ATTR_TIMEOUT must be 0 or greater"
+assert FUSE_ENTRY_TIMEOUT >= 0, "FUSE_ENTRY_TIMEOUT must be 0 or greater"
+
+# local HTTP proxy that STRM files point at, so playback goes through the shared block cache
+ENABLE_STREAM_PROXY = os.getenv("ENABLE_STREAM_PROXY", "false").lower() == "true"
+STREAM_PROXY_HOST = os.getenv("STREAM_PROXY_HOST", "127.0.0.1")
+STREAM_PROXY_PORT = int(os.getenv("STREAM_PROXY_PORT", "9466"))
+STREAM_PROXY_URL = os.getenv("STREAM_PROXY_URL", f"http://{'127.0.0.1' if STREAM_PROXY_HOST in ('0.0.0.0', '::') else STREAM_PROXY_HOST}:{STREAM_PROXY_PORT}").rstrip("/")
+STREAM_PROXY_TOKEN = os.getenv("STREAM_PROXY_TOKEN", "")
+assert STREAM_PROXY_URL.startswith(("http://", "https://")), "STREAM_PROXY_URL must start with http:// or https://"
+
+# CDN fetches of reads are scheduled by class: playback, seeks, prefetches, scanner probes and warm-ups, in that priority
+FETCH_CONCURRENCY = {
+    "playback": int(os.getenv("FETCH_CONCURRENCY_PLAYBACK", "4")),
+    "seek": int(os.getenv("FETCH_CONCURRENCY_SEEK", "2")),
+    "prefetch": int(os.getenv("FETCH_CONCURRENCY_PREFETCH", "2")),
+    "probe": int(os.getenv("FETCH_CONCURRENCY_PROBE", "2")),
+    "warmup": int(os.getenv("FETCH_CONCURRENCY_WARMUP", "1")),
+}
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "6")) # 0 for no limit across classes
+FETCH_BANDWIDTH_LIMIT = float(os.getenv("FETCH_BANDWIDTH_LIMIT", "0")) # MB per second across classes, 0 for no limit
+assert all(limit >= 1 for limit in FETCH_CONCURRENCY.values()), "FETCH_CONCURRENCY_* must be 1 or greater"
+assert FETCH_MAX_CONNECTIONS >= 0, "FETCH_MAX_CONNECTIONS must be 0 or greater"
+assert FETCH_BANDWIDTH_LIMIT >= 0, "FETCH_BANDWIDTH_LIMIT must be 0 or greater"
+
+# the start and end of new files are fetched ahead of the media server's first probes
+ENABLE_WARMUP = os.getenv("ENABLE_WARMUP", "false").lower() == "true"
+WARMUP_HEAD_MB = int(os.getenv("WARMUP_HEAD_MB", "2"))
+WARMUP_TAIL_MB = int(os.getenv("WARMUP_TAIL_MB", "1"))
+WARMUP_BUDGET_MB = int(os.getenv("WARMUP_BUDGET_MB", "128")) # most data fetched for one set of new files
+assert WARMUP_HEAD_MB >= 0 and WARMUP_TAIL_MB >= 0, "WARMUP_HEAD_MB and WARMUP_TAIL_MB must be 0 or greater"
+assert WARMUP_BUDGET_MB >= 0, "WARMUP_BUDGET_MB must be 0 or greater"
+assert not ENABLE_WARMUP or MountMethods.fuse.value in getMountMethods(MOUNT_METHOD) or ENABLE_STREAM_PROXY, "ENABLE_WARMUP needs the fuse or both mount method, or ENABLE_STREAM_PROXY"
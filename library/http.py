@@ -1,17 +1,75 @@
 import httpx
 from library.torbox import TORBOX_API_KEY
 from library.app import getCurrentVersion
+from library.metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_RETRIES, HTTP_BACKOFF_SECONDS, HTTP_CACHE_LOOKUPS, HTTP_DEADLINES_EXCEEDED
+import importlib.util
+import random
 import time
 import logging
 import hashlib
 import json
+import os
 
-TORBOX_API_URL = "https://api.torbox.app/v1/api"
-TORBOX_SEARCH_API_URL = "https://search-api.torbox.app"
+try:
+    import orjson
+except ImportError: # optional, the standard library parser is used without it
+    orjson = None
+
+# overridable so the benchmarks and tests can point at a local stand-in
+TORBOX_API_URL = os.getenv("TORBOX_API_URL", "https://api.torbox.app/v1/api")
+TORBOX_SEARCH_API_URL = os.getenv("TORBOX_SEARCH_API_URL", "https://search-api.torbox.app")
 USER_AGENT = f"TorBox-Media-Center/{getCurrentVersion()} TorBox/1.0"
 CACHE_TTL = 300 # cache time-to-live in seconds
 _cache: dict[str, tuple[float, httpx.Response]] = {}
 
+class RetryPolicy:
+    """
+    How often and for how long requestWrapper retries a class of requests. The deadline covers every attempt
+    and every backoff, so a request never takes much longer than it, whatever fails.
+    """
+    __slots__ = ("attempts", "deadline", "base_delay", "max_delay")
+
+    def __init__(self, attempts: int, deadline: float, base_delay: float, max_delay: float):
+        self.attempts = attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def getDelay(self, attempt: int):
+        """
+        Exponential backoff with jitter, so clients that failed together don't all retry at the same moment.
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+RETRY_POLICIES = {
+    # reads of an open file, the player and the kernel give up on a read long before a refresh would
+    "stream": RetryPolicy(attempts=3, deadline=10, base_delay=0.25, max_delay=2),
+    # refreshes and metadata lookups run in the background and can wait out a rate limit
+    "background": RetryPolicy(attempts=5, deadline=120, base_delay=1.5, max_delay=30),
+}
+
+def getAcceptEncoding():
+    """
+    Advertises the compressions httpx can decode here. Brotli and zstd need their optional packages.
+    """
+    encodings = []
+    if importlib.util.find_spec("zstandard"):
+        encodings.append("zstd")
+    if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+        encodings.append("br")
+    return ", ".join([*encodings, "gzip", "deflate"])
+
+ACCEPT_ENCODING = getAcceptEncoding()
+
+def parseJson(content: bytes | str):
+    """
+    Decodes JSON with orjson when it is installed, which is several times faster on large listings.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
 def makeCacheKey(method: str, url: str, base_url: str, **kwargs) -> str:
     key_data = {
         "method": method,
@@ -24,6 +82,8 @@ def makeCacheKey(method: str, url: str, base_url: str, **kwargs) -> str:
     key_str = json.dumps(key_data, sort_keys=True, default=str)
     return hashlib.sha256(key_str.encode()).hexdigest()
 
+# listings are fetched with the client directly, so its connections are retried by the transport. The other
+# clients are only used through requestWrapper, where transport retries would multiply its own.
 transport = httpx.HTTPTransport(
     retries=10
 )
@@ -33,6 +93,7 @@ api_http_client = httpx.Client(
     headers={
         "Authorization": f"Bearer {TORBOX_API_KEY}",
         "User-Agent": USER_AGENT,
+        "Accept-Encoding": ACCEPT_ENCODING,
     },
     timeout=httpx.Timeout(60),
     follow_redirects=True,
@@ -47,7 +108,6 @@ search_api_http_client = httpx.Client(
     },
     timeout=httpx.Timeout(60),
     follow_redirects=True,
-    transport=transport,
 )
 
 general_http_client = httpx.Client(
@@ -57,16 +117,19 @@ general_http_client = httpx.Client(
     },
     timeout=httpx.Timeout(60),
     follow_redirects=False,
-    transport=transport,
 )
 
 
-def requestWrapper(client: httpx.Client, method: str, url: str, use_cache: bool = True, **kwargs) -> httpx.Response:
-    max_retries = 5
-    backoff_factor = 1.5
+def requestWrapper(client: httpx.Client, method: str, url: str, use_cache: bool = True, request_class: str = "background", **kwargs) -> httpx.Response:
+    """
+    Sends a request, retrying rate limits and connection errors within the retry policy of its request class.
+    """
+    policy = RETRY_POLICIES[request_class]
+    deadline = time.monotonic() + policy.deadline
     
     cacheable = use_cache and method.upper() == "GET" # only caching GET requests
     cache_key = None
+    client_name = client.base_url.host or "general"
     
     if cacheable:
         cache_key = makeCacheKey(method, url, str(client.base_url), **kwargs)
@@ -74,14 +137,29 @@ def requestWrapper(client: httpx.Client, method: str, url: str, use_cache: bool
             cached_time, cached_response = _cache[cache_key]
             if time.time() - cached_time < CACHE_TTL:
                 logging.debug(f"Cache hit for {url}")
+                HTTP_CACHE_LOOKUPS.labels("hit").inc()
                 return cached_response
             else:
                 del _cache[cache_key]
+        HTTP_CACHE_LOOKUPS.labels("miss").inc()
     
-    for attempt in range(max_retries):
+    request_timeout = httpx.Timeout(kwargs.pop("timeout", client.timeout))
+    for attempt in range(policy.attempts):
+        # no connect or read of an attempt may wait past the deadline, slower responses keep the client's own timeouts
+        remaining = max(deadline - time.monotonic(), 0.1)
+        timeout = httpx.Timeout(**{
+            name: remaining if value is None else min(value, remaining)
+            for name, value in (("connect", request_timeout.connect), ("read", request_timeout.read), ("write", request_timeout.write), ("pool", request_timeout.pool))
+        })
         try:
-            response = client.request(method, url, **kwargs)
-            response.raise_for_status()
+            started_at = time.perf_counter()
+            try:
+                response = client.request(method, url, timeout=timeout, **kwargs)
+            finally:
+                HTTP_REQUEST_SECONDS.labels(client_name).observe(time.perf_counter() - started_at)
+            HTTP_REQUESTS.labels(client_name, response.status_code).inc()
+            if not response.is_redirect: # redirects are returned as is when the client doesn't follow them
+                response.raise_for_status()
             
             if cacheable and cache_key:
                 _cache[cache_key] = (time.time(), response)
@@ -90,23 +168,32 @@ def requestWrapper(client: httpx.Client, method: str, url: str, use_cache: bool
             return response
         except httpx.HTTPStatusError as e:
             bad_response_codes = [429]
-            if e.response.status_code in bad_response_codes:
-                wait_time = backoff_factor * (2 ** attempt)
-                retry_after_header = e.response.headers.get("Retry-After")
-                if retry_after_header is not None:
-                    try:
-                        retry_after_seconds = float(retry_after_header)
-                        if retry_after_seconds > wait_time:
-                            wait_time = retry_after_seconds
-                    except ValueError:
-                        pass
-                logging.warning(f"Received {e.response.status_code} for {url}. Retrying in {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
-            else:
+            if e.response.status_code not in bad_response_codes:
                 logging.error(f"HTTP error for {url}: {e}")
                 raise
+            wait_time = policy.getDelay(attempt)
+            retry_after_header = e.response.headers.get("Retry-After")
+            if retry_after_header is not None:
+                try:
+                    wait_time = max(wait_time, float(retry_after_header))
+                except ValueError:
+                    pass
+            reason = "rate_limited"
+            message = f"Received {e.response.status_code} for {url}"
         except httpx.RequestError as e:
-            wait_time = backoff_factor * (2 ** attempt)
-            logging.warning(f"Request error on {url}: {e}. Retrying in {wait_time:.2f} seconds...")
-            time.sleep(wait_time)
-    raise httpx.RequestError(f"Failed to complete request to {url} after {max_retries} attempts.")
+            HTTP_REQUESTS.labels(client_name, "error").inc()
+            wait_time = policy.getDelay(attempt)
+            reason = "request_error"
+            message = f"Request error on {url}: {e}"
+        if attempt == policy.attempts - 1:
+            break
+        if time.monotonic() + wait_time >= deadline:
+            # waiting would use up the deadline, failing now lets the caller fall back sooner
+            HTTP_DEADLINES_EXCEEDED.labels(request_class).inc()
+            logging.warning(f"{message}. Giving up, a retry in {wait_time:.2f} seconds would pass the {policy.deadline}s deadline of {request_class} requests.")
+            raise httpx.RequestError(f"Failed to complete request to {url} within {policy.deadline} seconds.")
+        logging.warning(f"{message}. Retrying in {wait_time:.2f} seconds...")
+        HTTP_RETRIES.labels(client_name, request_class, reason).inc()
+        HTTP_BACKOFF_SECONDS.labels(client_name, request_class).inc(wait_time)
+        time.sleep(wait_time)
+    raise httpx.RequestError(f"Failed to complete request to {url} after {policy.attempts} attempts.")
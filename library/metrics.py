@@ -0,0 +1,294 @@
+from library.app import ENABLE_METRICS
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+import threading
+import logging
+import time
+
+METRICS_PREFIX = "torbox_media_center"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+_registry: list["Metric"] = []
+_registry_lock = threading.Lock()
+
+def formatLabels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...], extra: str = ""):
+    pairs = [f'{name}="{escapeLabelValue(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+def escapeLabelValue(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def formatValue(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class CounterValue:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value: float):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at)
+
+class DisabledValue:
+    """
+    Stands in for every value of a disabled metric, so recording costs nothing when metrics are off.
+    """
+    __slots__ = ()
+    value = 0
+    count = 0
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def time(self):
+        return nullcontext()
+
+DISABLED_VALUE = DisabledValue()
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), enabled: bool = ENABLE_METRICS, registry: list["Metric"] | None = None):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.enabled = enabled
+        self.children: dict[tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+        if enabled:
+            with _registry_lock:
+                (_registry if registry is None else registry).append(self)
+
+    @abstractmethod
+    def newChild(self):
+        """
+        Returns the value holder for one set of label values.
+        """
+
+    def labels(self, *labelvalues):
+        if not self.enabled:
+            return DISABLED_VALUE
+        key = tuple(str(value) for value in labelvalues)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self.lock:
+                child = self.children.setdefault(key, self.newChild())
+        return child
+
+    def snapshot(self):
+        """
+        Returns the current value of every child, keyed by label values. Histograms report their count.
+        """
+        with self.lock:
+            children = list(self.children.items())
+        return {labelvalues: getattr(child, "value", getattr(child, "count", 0)) for labelvalues, child in children}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            children = sorted(self.children.items())
+        for labelvalues, child in children:
+            lines.extend(self.renderChild(labelvalues, child))
+        return lines
+
+    def renderChild(self, labelvalues: tuple[str, ...], child):
+        return [f"{self.name}{formatLabels(self.labelnames, labelvalues)} {formatValue(child.value)}"]
+
+class Counter(Metric):
+    type = "counter"
+
+    def newChild(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def newChild(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS, enabled: bool = ENABLE_METRICS, registry: list[Metric] | None = None):
+        super().__init__(name, documentation, labelnames, enabled, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def newChild(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def renderChild(self, labelvalues: tuple[str, ...], child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.count
+            value_sum = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = formatLabels(self.labelnames, labelvalues, f'le="{formatValue(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = formatLabels(self.labelnames, labelvalues, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {total}")
+        labels = formatLabels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {formatValue(value_sum)}")
+        lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+def renderMetrics(registry: list[Metric] | None = None):
+    """
+    Renders every metric of registry, by default every registered metric, in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = list(_registry if registry is None else registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = renderMetrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics request: {format % args}")
+
+def startMetricsServer(host: str, port: int):
+    """
+    Serves /metrics on a background thread. Returns the server, or None if it could not be started.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        logging.error(f"Unable to start metrics server on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+# HTTP
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests sent, by client host and status code.", ("client", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_seconds", "HTTP request latency, by client host.", ("client",))
+HTTP_RETRIES = Counter("http_retries_total", "HTTP request retries, by client host, request class and reason.", ("client", "class", "reason"))
+HTTP_BACKOFF_SECONDS = Counter("http_backoff_seconds_total", "Time spent sleeping before HTTP retries, by client host and request class.", ("client", "class"))
+HTTP_DEADLINES_EXCEEDED = Counter("http_deadlines_exceeded_total", "Requests given up before their retries ran out because of their deadline, by request class.", ("class",))
+HTTP_CACHE_LOOKUPS = Counter("http_cache_lookups_total", "Response cache lookups, by result.", ("result",))
+
+# refresh
+REFRESH_CYCLES = Counter("refresh_cycles_total", "Refresh cycles, by trigger and result.", ("trigger", "result"))
+REFRESH_SECONDS = Histogram("refresh_seconds", "Refresh duration per download type.", ("type",))
+REFRESH_FILES = Gauge("refresh_files", "Files found by the last refresh, per download type.", ("type",))
+LAST_REFRESH_TIMESTAMP = Gauge("last_refresh_timestamp_seconds", "Unix time the last successful refresh finished.")
+LISTING_PAGES = Counter("listing_pages_total", "Listing pages fetched, by download type and status code.", ("type", "status"))
+LISTING_BYTES = Counter("listing_bytes_total", "Listing bytes received over the network, before decompression, per download type.", ("type",))
+LISTING_PARSE_SECONDS = Histogram("listing_parse_seconds", "Time spent decoding one listing page, per download type.", ("type",))
+LIBRARY_SNAPSHOT_VERSION = Gauge("library_snapshot_version", "Version of the current in-memory library snapshot.")
+LIBRARY_SNAPSHOT_LOOKUPS = Counter("library_snapshot_lookups_total", "Library snapshot lookups, by whether the snapshot was reused, rebuilt from the databases or loaded from disk.", ("result",))
+SHARED_LIBRARY_UPDATES = Counter("shared_library_updates_total", "Library snapshots exchanged through the shared library path, by event.", ("event",))
+REFRESH_CHECKPOINTS = Counter("refresh_checkpoints_total", "Staged refresh checkpoints, by download type and event.", ("type", "event"))
+REFRESH_PROBES = Counter("refresh_probes_total", "Change probes, by result.", ("result",))
+REFRESH_PROBE_INTERVAL = Gauge("refresh_probe_interval_seconds", "Seconds until the next change probe.")
+METADATA_LOOKUPS = Counter("metadata_lookups_total", "Metadata lookups, by where they were resolved.", ("source",))
+METADATA_ENRICHMENT_PENDING = Gauge("metadata_enrichment_pending", "Files waiting for a background metadata lookup.")
+METADATA_SEARCH_BATCHES = Counter("metadata_search_requests_total", "Search API requests sent by the batcher, by mode.", ("mode",))
+METADATA_SEARCH_DEDUPED = Counter("metadata_search_deduped_total", "Searches that shared an identical in-flight query.")
+METADATA_ENRICHMENTS = Counter("metadata_enrichments_total", "Background metadata lookups, by result.", ("result",))
+
+# streaming
+STREAM_CACHE_LOOKUPS = Counter("stream_cache_lookups_total", "Block and probe cache lookups, by cache and result.", ("cache", "result"))
+STREAM_BYTES_FETCHED = Counter("stream_bytes_fetched_total", "Bytes downloaded from the CDN, by fetch mode.", ("mode",))
+STREAM_OPEN_HANDLES = Gauge("stream_open_handles", "Currently open file handles.")
+FETCH_WAIT_SECONDS = Histogram("fetch_wait_seconds", "Time CDN fetches waited for the scheduler, by fetch class.", ("class",))
+FETCH_ACTIVE = Gauge("fetch_active", "CDN fetches in progress, by fetch class.", ("class",))
+WARMUP_FILES = Counter("warmup_files_total", "New files considered for warm-up, by result.", ("result",))
+FUSE_READ_SECONDS = Histogram("fuse_read_seconds", "FUSE read latency.", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+STREAM_PROXY_REQUESTS = Counter("stream_proxy_requests_total", "Stream proxy requests, by status code.", ("status",))
+STREAM_PROXY_BYTES = Counter("stream_proxy_bytes_total", "Bytes sent by the stream proxy.")
+FUSE_READ_BYTES = Counter("fuse_read_bytes_total", "Bytes returned by FUSE reads.")
@@ -1,7 +1,12 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
-from functions.appFunctions import bootUp, getMountMethod, getMountRefreshTime, runRefreshCycle
+from functions.appFunctions import bootUp, getMountMethod, runRefreshCycle, syncMounts
 from functions.databaseFunctions import closeAllDatabases
+from library.app import ENABLE_METRICS, METRICS_HOST, METRICS_PORT, ENABLE_CONTROL_API, CONTROL_API_HOST, CONTROL_API_PORT, NODE_ROLE, SHARED_LIBRARY_POLL_SECONDS
+from library.filesystem import ENABLE_STREAM_PROXY, STREAM_PROXY_HOST, STREAM_PROXY_PORT, getMountMethods
+from library.metrics import startMetricsServer
+from functions.schedulerFunctions import AdaptiveRefreshScheduler
+from functions.controlFunctions import RefreshQueue, startControlServer
 import atexit
 import logging
 import os
@@ -32,28 +37,107 @@ def removePidFile():
     except OSError as e:
         logging.warning(f"Unable to remove PID file: {e}")
 
-def runManualRefresh(mount_method: str):
-    logging.info("Received manual refresh signal.")
-    success, detail = runRefreshCycle(
+def runQueuedRefresh(download_types, item_ids, trigger: str, mount_method: str):
+    return runRefreshCycle(
         mount_method=mount_method,
         include_mount_sync=True,
-        trigger="manual",
+        trigger=trigger,
+        download_types=download_types,
+        item_ids=item_ids,
+        wait=True,
     )
+
+def waitForRefresh(requests):
+    # requests queued together share one run and one result
+    return [request.wait() for request in requests][-1]
+
+def runChangeProbe(scheduler, refresh_scheduler: AdaptiveRefreshScheduler):
+    interval = refresh_scheduler.tick()
+    scheduler.reschedule_job("refresh_change_probe", trigger="interval", seconds=interval)
+
+def runManualRefresh(refresh_scheduler: AdaptiveRefreshScheduler):
+    logging.info("Received manual refresh signal.")
+    success, detail = refresh_scheduler.refreshNow("manual")
     if success:
         logging.info("Manual refresh request completed.")
     else:
         logging.warning(f"Manual refresh request was not completed: {detail}")
 
-def handleManualRefreshSignal(_, __, mount_method: str):
-    threading.Thread(target=runManualRefresh, args=(mount_method,), daemon=True).start()
+def handleManualRefreshSignal(_, __, refresh_scheduler: AdaptiveRefreshScheduler):
+    threading.Thread(target=runManualRefresh, args=(refresh_scheduler,), daemon=True).start()
+
+def runFollowerPoll(follower, mount_method: str):
+    if follower.poll():
+        syncMounts(mount_method)
+
+def startRefreshing(scheduler, mount_method: str):
+    """
+    Runs the startup refresh and schedules the change probe, for nodes that refresh the library themselves.
+    """
+    # every refresh goes through the queue, so requests that arrive during a refresh are merged instead of dropped
+    refresh_queue = RefreshQueue(
+        runner=lambda download_types, item_ids, trigger: runQueuedRefresh(download_types, item_ids, trigger, mount_method),
+    ).start()
+    refresh_scheduler = AdaptiveRefreshScheduler(
+        refresh=lambda trigger, download_types: waitForRefresh(refresh_queue.requestTypes(download_types, trigger)),
+    )
+
+    if ENABLE_CONTROL_API:
+        startControlServer(refresh_queue, CONTROL_API_HOST, CONTROL_API_PORT)
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: handleManualRefreshSignal(signum, frame, refresh_scheduler))
+    else:
+        logging.warning("Manual refresh signal is not supported on this platform.")
+
+    if "strm" in getMountMethods(mount_method):
+        # the last promoted generation stays available while the startup refresh runs
+        from functions.stremFilesystemFunctions import runStrm
+        runStrm()
+
+    if NODE_ROLE == "leader":
+        # followers get the library this node already has, instead of waiting for the startup refresh to change it
+        from functions.sharedLibraryFunctions import publishMissingSharedLibrary
+        publishMissingSharedLibrary()
+
+    # the mounts are served from the persisted snapshot until the startup refresh syncs them
+    refresh_scheduler.startRefresh("startup")
+
+    # refreshes now sync the mount themselves, so there is no separate mount sync interval
+    scheduler.add_job(
+        runChangeProbe,
+        "interval",
+        seconds=refresh_scheduler.interval,
+        args=(scheduler, refresh_scheduler),
+        id="refresh_change_probe",
+    )
+
+def startFollowing(scheduler, mount_method: str):
+    """
+    Loads the library the leader node published and keeps polling for new ones, instead of refreshing.
+    """
+    from functions.sharedLibraryFunctions import SharedLibraryFollower
+    if ENABLE_CONTROL_API:
+        logging.warning("The control API is not started on follower nodes. Send refresh requests to the leader node instead.")
+    follower = SharedLibraryFollower()
+    runFollowerPoll(follower, mount_method)
+    scheduler.add_job(
+        runFollowerPoll,
+        "interval",
+        seconds=SHARED_LIBRARY_POLL_SECONDS,
+        args=(follower, mount_method),
+        id="shared_library_poll",
+    )
 
 if __name__ == "__main__":
     bootUp()
     mount_method = getMountMethod()
+    mount_methods = getMountMethods(mount_method)
 
-    if mount_method == "strm":
+    if mount_methods == ["strm"]:
         scheduler = BlockingScheduler()
-    elif mount_method == "fuse":
+    elif "fuse" in mount_methods:
+        # the FUSE loop runs on the main thread, every other mount is synced from the scheduler's threads
         if platform == "win32":
             logging.error("The FUSE mount method is not supported on Windows. Please use the STRM mount method or run this application on a Linux system.")
             exit(1)
@@ -65,50 +149,35 @@ if __name__ == "__main__":
     writePidFile()
     atexit.register(removePidFile)
 
-    if hasattr(signal, "SIGUSR1"):
-        signal.signal(signal.SIGUSR1, lambda signum, frame: handleManualRefreshSignal(signum, frame, mount_method))
-    else:
-        logging.warning("Manual refresh signal is not supported on this platform.")
+    if ENABLE_METRICS:
+        startMetricsServer(METRICS_HOST, METRICS_PORT)
 
-    runRefreshCycle(
-        mount_method=mount_method,
-        include_mount_sync=False,
-        trigger="startup",
-    )
+    if ENABLE_STREAM_PROXY:
+        if "strm" in mount_methods:
+            from functions.proxyFunctions import startStreamProxy
+            startStreamProxy(STREAM_PROXY_HOST, STREAM_PROXY_PORT)
+        else:
+            logging.warning("The stream proxy is only used with the STRM mount method.")
 
-    scheduler.add_job(
-        runRefreshCycle,
-        "interval",
-        hours=getMountRefreshTime(),
-        kwargs={
-            "mount_method": mount_method,
-            "include_mount_sync": False,
-            "trigger": "scheduled",
-        },
-        id="get_all_user_downloads_fresh",
-    )
+    logging.info("Node role: %s", NODE_ROLE)
+    if NODE_ROLE == "follower":
+        startFollowing(scheduler, mount_method)
+    else:
+        startRefreshing(scheduler, mount_method)
 
     try:
         logging.info("Starting scheduler and mounting...")
-        if mount_method == "strm":
-            from functions.stremFilesystemFunctions import runStrm
-            runStrm()
-            scheduler.add_job(
-                runStrm,
-                "interval",
-                minutes=5,
-                id="run_strm",
-            )
-            scheduler.start()
-        elif mount_method == "fuse":
+        if "fuse" in mount_methods:
             from functions.fuseFilesystemFunctions import runFuse
             scheduler.start()
             runFuse()
+        else:
+            scheduler.start()
     except (KeyboardInterrupt, SystemExit):
-        if mount_method == "fuse":
+        if "fuse" in mount_methods:
             from functions.fuseFilesystemFunctions import unmountFuse
             unmountFuse()
-        elif mount_method == "strm":
+        if "strm" in mount_methods:
             from functions.stremFilesystemFunctions import unmountStrm
             unmountStrm()
         closeAllDatabases()
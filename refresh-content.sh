@@ -5,6 +5,30 @@ set -euo pipefail
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PID_FILE="${SCRIPT_DIR}/.torbox-media-center.pid"
 CONTAINER_NAME="${TORBOX_CONTAINER_NAME:-torbox-media-center}"
+CONTROL_API_URL="${TORBOX_CONTROL_API_URL:-http://127.0.0.1:9465}"
+
+# targeted refreshes go through the control API: ./refresh-content.sh <torrents|usenet|webdl> [item_id]
+if [[ $# -gt 0 ]]; then
+    if [[ $# -gt 2 || ! "$1" =~ ^(torrents|usenet|webdl)$ ]] || [[ $# -gt 1 && ! "$2" =~ ^[0-9]+$ ]]; then
+        echo "Usage: $0 [<torrents|usenet|webdl> [item_id]]" >&2
+        exit 2
+    fi
+    BODY="{\"type\": \"$1\""
+    if [[ $# -gt 1 ]]; then
+        BODY="${BODY}, \"item_id\": $2"
+    fi
+    BODY="${BODY}}"
+    AUTH_HEADER=()
+    if [[ -n "${CONTROL_API_TOKEN:-}" ]]; then
+        AUTH_HEADER=(-H "Authorization: Bearer ${CONTROL_API_TOKEN}")
+    fi
+    if ! curl -fsS -X POST "${CONTROL_API_URL}/refresh" -H "Content-Type: application/json" ${AUTH_HEADER[@]+"${AUTH_HEADER[@]}"} -d "${BODY}"; then
+        echo "Refresh request failed. Make sure the control API is enabled and CONTROL_API_TOKEN matches." >&2
+        exit 1
+    fi
+    echo
+    exit 0
+fi
 
 if [[ -f "${PID_FILE}" ]]; then
     PID="$(tr -d '[:space:]' < "${PID_FILE}")"
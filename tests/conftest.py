@@ -3,12 +3,47 @@ import os
 import pytest
 
 from functions.databaseFunctions import closeAllDatabases
+from functions.recordFunctions import FileRecord
 
 
 os.environ.setdefault("TORBOX_API_KEY", "test-key")
 os.environ.setdefault("ENABLE_METADATA", "true")
 os.environ.setdefault("RAW_MODE", "false")
 os.environ.setdefault("MOUNT_REFRESH_TIME", "normal")
+os.environ.setdefault("METADATA_SEARCH_RATE", "1000")
+
+
+CONTENT = bytes(index % 251 for index in range(5000))
+
+
+class FakeLinks:
+    """
+    Serves every file from CONTENT and records the downloads. Downloads wait for gate when it is set.
+    """
+    def __init__(self, gate=None):
+        self.downloads = []
+        self.downloaded_files = []
+        self.pinned = 0
+        self.gate = gate
+
+    def download(self, file, size, offset=0):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        self.downloads.append((offset, size))
+        self.downloaded_files.append(file.file_id)
+        return CONTENT[offset:offset + size]
+
+    def getLink(self, file):
+        return "https://cdn.example.com/file"
+
+    def prefetch(self, file):
+        pass
+
+    def pin(self, file):
+        self.pinned += 1
+
+    def unpin(self, file):
+        self.pinned -= 1
 
 
 @pytest.fixture(autouse=True)
@@ -17,3 +52,21 @@ def isolate_test_cwd(tmp_path, monkeypatch):
     monkeypatch.chdir(tmp_path)
     yield
     closeAllDatabases()
+
+
+@pytest.fixture
+def content():
+    return CONTENT
+
+
+@pytest.fixture
+def links():
+    return FakeLinks()
+
+
+@pytest.fixture
+def build_file():
+    def build(file_id=1, file_size=1000, file_name=None, **fields):
+        return FileRecord(type="torrents", item_id=1, file_id=file_id, file_name=file_name or f"file {file_id}.mkv", file_size=file_size, **fields)
+    return build
+
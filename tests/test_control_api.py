@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+import httpx
+
+from functions.controlFunctions import RefreshQueue, RefreshRequest, mergeRefreshRequests, startControlServer
+from functions.torboxFunctions import DownloadType
+
+
+def test_merge_keeps_the_widest_scope():
+    requests = [
+        RefreshRequest(DownloadType.torrent, 1),
+        RefreshRequest(DownloadType.torrent, 1),
+        RefreshRequest(DownloadType.usenet, 5),
+        RefreshRequest(DownloadType.usenet),
+    ]
+    assert mergeRefreshRequests(requests) == ([DownloadType.usenet], {DownloadType.torrent: [1]})
+    assert mergeRefreshRequests(requests + [RefreshRequest()]) == (None, {})
+
+
+def test_requests_queued_during_a_refresh_are_merged_into_one_run():
+    gate = threading.Event()
+    runs = []
+
+    def runner(download_types, item_ids, trigger):
+        gate.wait(timeout=5)
+        runs.append((download_types, item_ids))
+        return True, "done"
+
+    queue = RefreshQueue(runner).start()
+    first = queue.request()
+    while first.state != "running":
+        time.sleep(0.01)
+    second = queue.request(DownloadType.webdl, 7)
+    third = queue.request(DownloadType.webdl, 8)
+    gate.set()
+
+    assert second.wait(timeout=5) == (True, "done")
+    assert third.wait(timeout=5) == (True, "done")
+    assert runs == [(None, {}), ([], {DownloadType.webdl: [7, 8]})]
+    queue.stop()
+
+
+def test_download_types_queued_together_share_one_run():
+    runs = []
+
+    def runner(download_types, item_ids, trigger):
+        runs.append((download_types, trigger))
+        return True, "done"
+
+    queue = RefreshQueue(runner)
+    requests = queue.requestTypes([DownloadType.usenet, DownloadType.webdl], trigger="change")
+    queue.start()
+
+    assert [request.wait(timeout=5) for request in requests] == [(True, "done")] * 2
+    assert runs == [([DownloadType.usenet, DownloadType.webdl], "change")]
+    queue.stop()
+
+
+def test_control_api_queues_and_reports_requests():
+    queue = RefreshQueue(lambda download_types, item_ids, trigger: (True, "done")).start()
+    server = startControlServer(queue, "127.0.0.1", 0)
+    url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    try:
+        response = httpx.post(f"{url}/refresh", content=json.dumps({"type": "torrents", "item_id": 3, "wait": True}))
+        assert response.status_code == 200
+        request = response.json()["data"]
+        assert (request["type"], request["item_id"], request["state"]) == ("torrents", 3, "succeeded")
+
+        assert httpx.get(f"{url}/refresh/{request['id']}").json()["data"]["state"] == "succeeded"
+        assert httpx.get(f"{url}/status").json()["data"]["finished"][0]["id"] == request["id"]
+        assert httpx.post(f"{url}/refresh", content=json.dumps({"type": "movies"})).status_code == 400
+        assert httpx.post(f"{url}/refresh", content=json.dumps({"item_id": 3})).status_code == 400
+    finally:
+        server.shutdown()
+        queue.stop()
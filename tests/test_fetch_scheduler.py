@@ -0,0 +1,91 @@
+import threading
+import time
+
+from functions.fetchSchedulerFunctions import FetchScheduler
+
+
+CONCURRENCY = {"playback": 2, "seek": 2, "prefetch": 1, "probe": 1, "warmup": 1}
+
+
+def start_waiting(scheduler, request, started):
+    def run():
+        scheduler.acquire(request)
+        started.append(request.fetch_class)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_free_connections_go_to_the_highest_priority_waiting_fetch():
+    scheduler = FetchScheduler(CONCURRENCY, max_connections=1)
+    running = scheduler.enqueue("seek", 10)
+    scheduler.acquire(running)
+
+    started = []
+    probe = start_waiting(scheduler, scheduler.enqueue("probe", 10), started)
+    prefetch = start_waiting(scheduler, scheduler.enqueue("prefetch", 10), started)
+    playback_request = scheduler.enqueue("playback", 10)
+    playback = start_waiting(scheduler, playback_request, started)
+    time.sleep(0.05)
+    assert started == []
+
+    scheduler.release(running)
+    assert wait_until(lambda: started == ["playback"])
+    scheduler.release(playback_request)
+    assert wait_until(lambda: started == ["playback", "prefetch"])
+    for thread in (probe, prefetch, playback):
+        thread.join(timeout=0.01)
+
+
+def test_class_limits_do_not_hold_up_other_classes():
+    scheduler = FetchScheduler(CONCURRENCY, max_connections=0)
+    probe = scheduler.enqueue("probe", 10)
+    scheduler.acquire(probe)
+
+    started = []
+    start_waiting(scheduler, scheduler.enqueue("probe", 10), started)
+    start_waiting(scheduler, scheduler.enqueue("playback", 10), started)
+    assert wait_until(lambda: started == ["playback"])
+    time.sleep(0.05)
+    assert started == ["playback"]
+
+    scheduler.release(probe)
+    assert wait_until(lambda: started == ["playback", "probe"])
+
+
+def test_promoted_fetches_move_ahead_of_the_queue():
+    scheduler = FetchScheduler(CONCURRENCY, max_connections=1)
+    running = scheduler.enqueue("seek", 10)
+    scheduler.acquire(running)
+
+    started = []
+    start_waiting(scheduler, scheduler.enqueue("probe", 10), started)
+    prefetch = scheduler.enqueue("prefetch", 10)
+    start_waiting(scheduler, prefetch, started)
+    scheduler.promote(prefetch, "playback")
+    scheduler.promote(prefetch, "probe")
+    assert prefetch.fetch_class == "playback"
+
+    scheduler.release(running)
+    assert wait_until(lambda: started == ["playback"])
+
+
+def test_bandwidth_limit_paces_fetches():
+    scheduler = FetchScheduler(CONCURRENCY, max_connections=0, bandwidth_limit=1)
+    size = int(1.2 * 1024 * 1024)
+
+    started_at = time.monotonic()
+    with scheduler.fetch("playback", size):
+        pass
+    assert time.monotonic() - started_at < 0.1
+    # the first fetch overdrew the one second bucket by 0.2MB, which takes 0.2 seconds to pay off
+    with scheduler.fetch("playback", size):
+        pass
+    assert time.monotonic() - started_at >= 0.15
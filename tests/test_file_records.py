@@ -0,0 +1,92 @@
+import pytest
+
+from functions import torboxFunctions as torbox
+from functions.recordFunctions import FileRecord, parseTimestamp
+
+
+def build_item():
+    return {
+        "id": 42,
+        "name": "Some.Movie.2020.1080p",
+        "hash": "abc123",
+        "cached": True,
+    }
+
+
+def build_file():
+    return {
+        "id": 7,
+        "short_name": "Some.Movie.2020.1080p.mkv",
+        "name": "Some.Movie.2020.1080p/Some.Movie.2020.1080p.mkv",
+        "size": 1234,
+        "mimetype": "video/x-matroska",
+    }
+
+
+def test_process_file_returns_record_without_debug_or_link_fields(monkeypatch):
+    monkeypatch.setattr(torbox, "SCAN_METADATA", False)
+
+    record = torbox.process_file(build_item(), build_file(), torbox.DownloadType.torrent)
+
+    assert isinstance(record, FileRecord)
+    assert record.file_size == 1234
+    assert record["metadata_filename"] == "Some.Movie.2020.1080p.mkv"
+    stored = record.toDict()
+    assert "download_link" not in stored
+    assert not any(key.startswith("DEBUG_") for key in stored)
+
+
+def test_download_link_is_built_from_ids():
+    record = FileRecord(type="torrents", item_id=42, file_id=7)
+
+    assert record.download_link == f"{torbox.TORBOX_API_URL}/torrents/requestdl?token={torbox.TORBOX_API_KEY}&torrent_id=42&file_id=7&redirect=true"
+    assert record.get("download_link") == record.download_link
+
+
+def test_record_round_trips_and_ignores_legacy_keys():
+    legacy_row = {
+        "item_id": 1,
+        "type": "usenet",
+        "DEBUG_name": "legacy",
+        "download_link": "https://example.com",
+        "metadata_rootfoldername": "Show (2020)",
+    }
+
+    record = FileRecord.fromDict(legacy_row)
+
+    assert FileRecord.fromDict(record.toDict()) == record
+    assert record.get("DEBUG_name") is None
+    with pytest.raises(KeyError):
+        record["DEBUG_name"]
+
+
+def test_shared_strings_are_interned():
+    first = FileRecord.fromDict({"metadata_rootfoldername": "".join(["Show ", "(2020)"])})
+    second = FileRecord.fromDict({"metadata_rootfoldername": "".join(["Show ", "(2020)"])})
+
+    assert first.metadata_rootfoldername is second.metadata_rootfoldername
+
+
+def test_inode_is_stable_and_unique_per_file():
+    first = FileRecord(type="torrents", item_id=1, file_id=2)
+    same = FileRecord(type="torrents", item_id=1, file_id=2, metadata_filename="renamed.mkv")
+    other = FileRecord(type="usenet", item_id=1, file_id=2)
+
+    assert first.inode == same.inode
+    assert first.inode != other.inode
+    assert first.inode > 1
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2024-01-02T03:04:05Z", 1704164645),
+        ("2024-01-02T03:04:05.123456+00:00", 1704164645),
+        ("2024-01-02T03:04:05", 1704164645),
+        (1704164645, 1704164645),
+        ("not a date", None),
+        (None, None),
+    ],
+)
+def test_parse_timestamp(value, expected):
+    assert parseTimestamp(value) == expected
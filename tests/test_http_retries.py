@@ -0,0 +1,88 @@
+import httpx
+import pytest
+
+from library import http
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(http.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(http.time, "sleep", clock.sleep)
+    return clock
+
+
+def build_client(statuses, headers=None):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = statuses[min(len(requests), len(statuses)) - 1]
+        return httpx.Response(status, headers=headers or {})
+
+    return httpx.Client(base_url="https://cdn.example.com", transport=httpx.MockTransport(handler)), requests
+
+
+def test_rate_limits_are_retried_with_jittered_backoff(clock):
+    client, requests = build_client([429, 429, 200])
+
+    response = http.requestWrapper(client, "GET", "/file", use_cache=False, request_class="stream")
+
+    assert response.status_code == 200
+    assert len(requests) == 3
+    policy = http.RETRY_POLICIES["stream"]
+    for attempt, slept in enumerate(clock.sleeps):
+        delay = min(policy.max_delay, policy.base_delay * 2 ** attempt)
+        assert delay / 2 <= slept <= delay
+
+
+def test_stream_requests_give_up_at_their_deadline(clock):
+    client, requests = build_client([429], headers={"Retry-After": "30"})
+
+    with pytest.raises(httpx.RequestError, match="within"):
+        http.requestWrapper(client, "GET", "/file", use_cache=False, request_class="stream")
+
+    # waiting 30 seconds would pass the stream deadline, so nothing is retried
+    assert len(requests) == 1
+    assert clock.sleeps == []
+
+
+def test_background_requests_wait_out_rate_limits(clock):
+    client, requests = build_client([429, 200], headers={"Retry-After": "30"})
+
+    response = http.requestWrapper(client, "GET", "/mylist", use_cache=False)
+
+    assert response.status_code == 200
+    assert clock.sleeps == [30.0]
+
+
+def test_attempt_timeouts_never_pass_the_deadline(clock, monkeypatch):
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"])
+        clock.now += 4
+        raise httpx.ConnectError("unreachable", request=request)
+
+    client = httpx.Client(base_url="https://cdn.example.com", timeout=60, transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(http.random, "uniform", lambda low, high: 0)
+
+    with pytest.raises(httpx.RequestError):
+        http.requestWrapper(client, "GET", "/file", use_cache=False, request_class="stream")
+
+    deadline = http.RETRY_POLICIES["stream"].deadline
+    assert timeouts[0]["read"] == deadline
+    assert timeouts[1]["read"] == pytest.approx(deadline - 4 - clock.sleeps[0])
@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+import httpx
+
+from functions import torboxFunctions as torbox
+from functions.databaseFunctions import closeAllDatabases
+from functions.identityFunctions import IdentityIndex, getIdentityIndex
+
+
+FIXTURE_PATH = Path(__file__).parent / "fixtures" / "metadata_true_blood_cases.json"
+FIXTURE_DATA = json.loads(FIXTURE_PATH.read_text())
+
+
+def count_searches(monkeypatch, candidates):
+    searches = []
+
+    def request(client, method, url, **kwargs):
+        searches.append(url)
+        return httpx.Response(200, json={"data": candidates})
+
+    monkeypatch.setattr(torbox, "requestWrapper", request)
+    return searches
+
+
+def build_file(file_id, short_name):
+    return {"id": file_id, "short_name": short_name, "name": short_name, "mimetype": "video/x-matroska", "size": 100}
+
+
+def test_differently_named_releases_resolve_locally(monkeypatch):
+    searches = count_searches(monkeypatch, FIXTURE_DATA["candidates"]["true_blood_webisodes_first"])
+    pack = FIXTURE_DATA["packs"]["true_blood_s07_hash"]
+    torbox.process_file(dict(pack["item"]), dict(pack["files"][0]), torbox.DownloadType.torrent)
+    assert len(searches) == 1
+
+    releases = [
+        ({"id": 9101, "name": "TrueBlood.S02.720p", "hash": "trueblood-s02", "cached": True}, build_file(9111, "TrueBlood.S02E01.720p.HDTV.x264.mkv")),
+        ({"id": 9102, "name": "True.Blood.US.S04.1080p", "hash": "trueblood-us-s04", "cached": True}, build_file(9112, "True.Blood.US.S04E03.1080p.WEB-DL.mkv")),
+    ]
+    for item, file in releases:
+        result = torbox.process_file(item, file, torbox.DownloadType.torrent)
+        assert result["metadata_rootfoldername"] == "True Blood (2008)"
+        assert result["metadata_mediatype"] == "series"
+    assert len(searches) == 1
+
+    # a spin-off title is not close enough and still goes to the API
+    item = {"id": 9103, "name": "True.Blood.Webisodes.S01", "hash": "trueblood-webisodes", "cached": True}
+    torbox.process_file(item, build_file(9113, "True.Blood.Webisodes.S01E01.mkv"), torbox.DownloadType.torrent)
+    assert len(searches) == 2
+
+
+def test_index_is_persisted_across_restarts():
+    getIdentityIndex().add({"metadata_title": "True Blood", "metadata_mediatype": "series", "metadata_years": 2008}, ["True Blood"])
+    closeAllDatabases()
+
+    assert getIdentityIndex().lookup("TrueBlood", expects_series=True)["metadata_title"] == "True Blood"
+
+
+def test_lookup_rejects_sequels_other_types_and_ambiguous_remakes():
+    index = IdentityIndex()
+    index.add({"metadata_title": "Toy Story 2", "metadata_mediatype": "movie", "metadata_years": 1999}, [])
+    index.add({"metadata_title": "Dune", "metadata_mediatype": "movie", "metadata_years": 1984}, [])
+    index.add({"metadata_title": "Dune", "metadata_mediatype": "movie", "metadata_years": 2021}, [])
+    index.add({"metadata_title": "Spider-Man: No Way Home", "metadata_mediatype": "movie", "metadata_years": 2021}, [])
+
+    assert index.lookup("Toy Story 3") is None
+    assert index.lookup("Toy.Story.II") is None
+    assert index.lookup("Toy Story 2")["metadata_years"] == 1999
+    assert index.lookup("Spiderman No Way Home", 2021)["metadata_title"] == "Spider-Man: No Way Home"
+    assert index.lookup("Spiderman No Way Home", expects_series=True) is None
+    assert index.lookup("Dune") is None
+    assert index.lookup("Dune", 2021)["metadata_years"] == 2021
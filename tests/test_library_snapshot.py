@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from functions import snapshotFunctions
+from functions.databaseFunctions import insertData, updateFileData, promoteDatabase, closeAllDatabases
+from functions.pathIndexFunctions import buildPathIndex
+from functions.recordFunctions import FileRecord
+from functions.schedulerFunctions import AdaptiveRefreshScheduler
+from functions.snapshotFunctions import LibrarySnapshot, getLibrarySnapshot, encodeSnapshot, decodeSnapshot, saveLibrarySnapshot
+
+
+@pytest.fixture(autouse=True)
+def fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(snapshotFunctions, "_snapshot", LibrarySnapshot(0, {}, {}))
+    monkeypatch.setattr(snapshotFunctions, "_saved_version", 0)
+
+
+def restart(monkeypatch):
+    closeAllDatabases()
+    monkeypatch.setattr(snapshotFunctions, "_snapshot", LibrarySnapshot(0, {}, {}))
+    monkeypatch.setattr(snapshotFunctions, "getDatabaseVersion", lambda name: 0)
+
+
+def test_snapshot_is_reused_until_a_database_changes(monkeypatch):
+    insertData({"type": "torrents", "item_id": 1, "file_id": 1, "file_name": "a.mkv"}, "torrents")
+    insertData({"type": "usenet", "item_id": 2, "file_id": 1, "file_name": "b.mkv"}, "usenet")
+    first = getLibrarySnapshot()
+    assert sorted(file.file_name for file in first.files) == ["a.mkv", "b.mkv"]
+    with pytest.raises(AttributeError):
+        first.version = 0
+
+    reads = []
+    load = snapshotFunctions.loadTypeFiles
+    monkeypatch.setattr(snapshotFunctions, "loadTypeFiles", lambda type: reads.append(type) or load(type))
+    assert getLibrarySnapshot() is first
+    assert reads == []
+
+    updateFileData({"file_name": "renamed.mkv"}, 1, 1, "torrents")
+    second = getLibrarySnapshot()
+    assert second.version > first.version
+    assert reads == ["torrents"]
+    assert second.type_files["usenet"] is first.type_files["usenet"]
+    assert sorted(file.file_name for file in second.files) == ["b.mkv", "renamed.mkv"]
+
+
+def test_promoting_a_generation_publishes_a_new_snapshot():
+    insertData({"type": "torrents", "item_id": 1, "file_id": 1, "file_name": "old.mkv"}, "torrents")
+    before = getLibrarySnapshot()
+    insertData({"type": "torrents", "item_id": 2, "file_id": 1, "file_name": "new.mkv"}, "torrents_staging")
+    assert getLibrarySnapshot() is before
+
+    success, _ = promoteDatabase("torrents_staging", "torrents")
+    assert success
+    after = getLibrarySnapshot()
+    assert after.version > before.version
+    assert [file.file_name for file in after.files] == ["new.mkv"]
+
+
+def test_encoded_snapshot_keeps_every_value():
+    files = (
+        FileRecord(type="torrents", item_id=1, file_id=0, file_name="a.mkv", file_size=1, metadata_season=True),
+        FileRecord(type="torrents", item_id=1, file_id=1, file_name="b.mkv", file_size=1.0, metadata_years=[2020, 2021]),
+    )
+    type_files, type_stamps = decodeSnapshot(encodeSnapshot(LibrarySnapshot(1, {"torrents": files, "usenet": ()}, {}, {"torrents": [5, 10]})))
+    assert type_files == {"torrents": files, "usenet": ()}
+    assert type_stamps == {"torrents": [5, 10], "usenet": None}
+    assert [type(file.file_size) for file in type_files["torrents"]] == [int, float]
+    assert type_files["torrents"][0].metadata_season is True
+    with pytest.raises(ValueError):
+        decodeSnapshot(encodeSnapshot(LibrarySnapshot(1, {"torrents": files}, {}))[:-10])
+
+
+def test_cold_start_uses_the_persisted_snapshot_while_the_databases_match(monkeypatch):
+    insertData({"type": "torrents", "item_id": 1, "file_id": 1, "file_name": "a.mkv"}, "torrents")
+    saveLibrarySnapshot(getLibrarySnapshot())
+
+    restart(monkeypatch)
+    reads = []
+    load = snapshotFunctions.loadTypeFiles
+    monkeypatch.setattr(snapshotFunctions, "loadTypeFiles", lambda type: reads.append(type) or load(type))
+    assert [file.file_name for file in getLibrarySnapshot().files] == ["a.mkv"]
+    assert reads == []
+
+    restart(monkeypatch)
+    with open("torrents.json", "w") as file:
+        file.write('{"_default": {"1": {"type": "torrents", "item_id": 2, "file_id": 1, "file_name": "changed.mkv"}}}')
+    assert [file.file_name for file in getLibrarySnapshot().files] == ["changed.mkv"]
+    assert reads == ["torrents"]
+
+
+def test_startup_serves_the_persisted_snapshot_before_the_refresh_completes(monkeypatch):
+    insertData({"type": "torrents", "item_id": 1, "file_id": 1, "file_name": "a.mkv", "metadata_mediatype": "movie", "metadata_rootfoldername": "A (2020)", "metadata_filename": "A (2020).mkv"}, "torrents")
+    saveLibrarySnapshot(getLibrarySnapshot())
+    restart(monkeypatch)
+
+    # the change probe is the first API call of the startup refresh, here it never answers until released
+    api_released = threading.Event()
+    refreshes = []
+    scheduler = AdaptiveRefreshScheduler(refresh=lambda trigger, download_types: refreshes.append(trigger) or (True, "done"), probe=lambda: api_released.wait(5) and {})
+    thread = scheduler.startRefresh("startup")
+    try:
+        reads = []
+        monkeypatch.setattr(snapshotFunctions, "loadTypeFiles", lambda type: reads.append(type) or ())
+        index = buildPathIndex(getLibrarySnapshot().files, raw_mode=False, enable_audio=False)
+        assert index.isFile("/movies/A (2020)/A (2020).mkv")
+        assert reads == []
+        assert refreshes == []
+    finally:
+        api_released.set()
+        thread.join(timeout=5)
+    assert refreshes == ["startup"]
@@ -0,0 +1,73 @@
+import httpx
+import pytest
+
+from functions import linkFunctions as links
+from functions.recordFunctions import FileRecord
+
+
+def build_file(file_id):
+    return FileRecord(type="torrents", item_id=1, file_id=file_id, file_name=f"file-{file_id}.mkv")
+
+
+class FakeResolver:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, url, use_cache=True):
+        self.calls += 1
+        return f"https://cdn.example.com/{self.calls}"
+
+
+@pytest.fixture
+def manager():
+    resolver = FakeResolver()
+    link_manager = links.LinkManager(max_links=2, resolver=resolver)
+    yield link_manager, resolver
+    link_manager.stop()
+
+
+def test_links_are_cached_and_evicted_least_recently_used_first(manager):
+    link_manager, resolver = manager
+    first, second, third = build_file(1), build_file(2), build_file(3)
+
+    link_manager.getLink(first)
+    link_manager.getLink(second)
+    link_manager.getLink(first)
+    link_manager.getLink(third)
+
+    assert resolver.calls == 3
+    assert links.getLinkKey(second) not in link_manager.links
+    assert links.getLinkKey(first) in link_manager.links
+
+
+def test_hot_links_are_refreshed_before_they_expire(manager, monkeypatch):
+    link_manager, resolver = manager
+    now = {"value": 1_000_000.0}
+    monkeypatch.setattr(links.time, "time", lambda: now["value"])
+    file = build_file(1)
+
+    original_link = link_manager.getLink(file)
+    now["value"] += link_manager.link_age - link_manager.refresh_margin / 2
+    link_manager.getLink(file)
+
+    assert link_manager.refreshExpiring() == 1
+    assert link_manager.getLink(file) != original_link
+    assert resolver.calls == 2
+
+
+def test_expired_cdn_link_is_resolved_again_mid_stream(manager, monkeypatch):
+    link_manager, resolver = manager
+    requested_links = []
+
+    def fake_download(url, size, offset=0):
+        requested_links.append(url)
+        if len(requested_links) == 1:
+            response = httpx.Response(410, request=httpx.Request("GET", url))
+            raise httpx.HTTPStatusError("gone", request=response.request, response=response)
+        return b"data"
+
+    monkeypatch.setattr(links, "downloadFile", fake_download)
+
+    assert link_manager.download(build_file(1), 4) == b"data"
+    assert requested_links == ["https://cdn.example.com/1", "https://cdn.example.com/2"]
+    assert resolver.calls == 2
@@ -0,0 +1,48 @@
+import gzip
+import json
+
+import httpx
+
+from functions import torboxFunctions as torbox
+
+
+def build_items(count):
+    return [{"id": item_id, "cached": True, "files": []} for item_id in range(count)]
+
+
+def test_unchanged_pages_are_read_from_the_listing_cache(monkeypatch):
+    requests = []
+    items = build_items(3)
+
+    def handler(request):
+        requests.append(dict(request.headers))
+        body = json.dumps({"success": True, "data": items}).encode()
+        etag = f'"{len(items)}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=gzip.compress(body), headers={"ETag": etag, "Content-Encoding": "gzip"})
+
+    client = httpx.Client(base_url="https://api.example.com", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(torbox, "api_http_client", client)
+
+    first = list(torbox.iterUserDownloadPages(torbox.DownloadType.torrent))
+    second = list(torbox.iterUserDownloadPages(torbox.DownloadType.torrent))
+    items.append({"id": 3, "cached": True, "files": []})
+    third = list(torbox.iterUserDownloadPages(torbox.DownloadType.torrent))
+
+    assert first == second == [build_items(3)]
+    assert third == [build_items(4)]
+    assert "If-None-Match" not in requests[0] and "if-none-match" not in requests[0]
+    assert requests[1]["if-none-match"] == '"3"'
+    assert requests[2]["if-none-match"] == '"3"'
+
+
+def test_pages_without_validators_are_not_cached(monkeypatch):
+    def handler(request):
+        assert "if-none-match" not in request.headers
+        return httpx.Response(200, json={"success": True, "data": build_items(2)})
+
+    monkeypatch.setattr(torbox, "api_http_client", httpx.Client(base_url="https://api.example.com", transport=httpx.MockTransport(handler)))
+
+    for _ in range(2):
+        assert list(torbox.iterUserDownloadPages(torbox.DownloadType.usenet)) == [build_items(2)]
@@ -0,0 +1,59 @@
+from functions.enrichmentFunctions import MetadataEnrichmentQueue
+from functions.recordFunctions import FileRecord
+
+
+def build_record(file_id):
+    return FileRecord(
+        type="torrents",
+        item_id=1,
+        file_id=file_id,
+        file_name=f"Show.S01E0{file_id}.mkv",
+        metadata_title="Show",
+        metadata_mediatype="movie",
+        metadata_filename=f"Show.S01E0{file_id}.mkv",
+    )
+
+
+def test_deferred_lookups_are_resolved_and_published_in_a_batch():
+    api_calls = []
+    updates = []
+    published = []
+    resolved = {"Show": {"metadata_title": "The Show", "metadata_mediatype": "series"}}
+
+    def resolve(query, defer_api=False, **kwargs):
+        if query in resolved and api_calls:
+            return resolved[query], True, "identity cache hit"
+        if defer_api:
+            return {}, None, "deferred"
+        api_calls.append(query)
+        return resolved[query], True, "api"
+
+    def update(data, item_id, file_id, type):
+        updates.append((file_id, data["metadata_title"]))
+        return True, "updated"
+
+    queue = MetadataEnrichmentQueue(resolve=resolve, publish=published.extend, update=update, workers=1)
+    assert queue.enqueue(build_record(1), {"query": "Show"})
+    assert not queue.enqueue(build_record(1), {"query": "Show"})
+    queue.enqueue(build_record(2), {"query": "Show"})
+    queue.join()
+
+    assert api_calls == ["Show"]
+    assert sorted(updates) == [(1, "The Show"), (2, "The Show")]
+    assert [(old.metadata_title, new.metadata_title) for old, new in published] == [("Show", "The Show")] * 2
+    assert not queue.pending
+
+
+def test_failed_or_stale_lookups_are_not_published():
+    published = []
+    queue = MetadataEnrichmentQueue(
+        resolve=lambda defer_api=False, **kwargs: ({}, False, "no match") if kwargs["query"] == "Missing" else ({"metadata_title": "New"}, True, "api"),
+        publish=published.extend,
+        update=lambda data, item_id, file_id, type: (False, "File not found."),
+        workers=1,
+    )
+    queue.enqueue(build_record(1), {"query": "Missing"})
+    queue.enqueue(build_record(2), {"query": "Removed"})
+    queue.join()
+
+    assert published == []
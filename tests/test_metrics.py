@@ -0,0 +1,39 @@
+from library.metrics import Counter, Histogram, renderMetrics
+
+
+def test_counters_and_histograms_render_in_exposition_format():
+    registry = []
+    requests = Counter("test_requests_total", "Test requests.", ("status",), enabled=True, registry=registry)
+    latency = Histogram("test_latency_seconds", "Test latency.", buckets=(0.1, 1.0), enabled=True, registry=registry)
+
+    requests.labels(200).inc()
+    requests.labels(200).inc(2)
+    requests.labels(429).inc()
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    output = renderMetrics(registry)
+
+    assert "# TYPE torbox_media_center_test_requests_total counter" in output
+    assert 'torbox_media_center_test_requests_total{status="200"} 3' in output
+    assert 'torbox_media_center_test_requests_total{status="429"} 1' in output
+    assert 'torbox_media_center_test_latency_seconds_bucket{le="0.1"} 1' in output
+    assert 'torbox_media_center_test_latency_seconds_bucket{le="1"} 2' in output
+    assert 'torbox_media_center_test_latency_seconds_bucket{le="+Inf"} 3' in output
+    assert "torbox_media_center_test_latency_seconds_count 3" in output
+    assert "torbox_media_center_test_latency_seconds_sum 5.55" in output
+    assert "test_" not in renderMetrics()
+
+
+def test_disabled_metrics_record_nothing():
+    registry = []
+    requests = Counter("test_disabled_total", "Test requests.", ("status",), enabled=False, registry=registry)
+    latency = Histogram("test_disabled_seconds", "Test latency.", enabled=False, registry=registry)
+
+    requests.labels(200).inc()
+    with latency.time():
+        pass
+
+    assert requests.snapshot() == {} and latency.snapshot() == {}
+    assert registry == []
@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG_SCRIPT = """
+import json
+from library.filesystem import STRM_MOUNT_PATH, FUSE_MOUNT_PATH, getMountMethods
+print(json.dumps({"methods": getMountMethods("both"), "strm": STRM_MOUNT_PATH, "fuse": FUSE_MOUNT_PATH}))
+"""
+
+
+def loadMountConfig(**environment):
+    completed = subprocess.run(
+        [sys.executable, "-c", CONFIG_SCRIPT],
+        env={**os.environ, "PYTHONPATH": REPOSITORY_PATH, **environment},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_both_mounts_get_their_own_folders():
+    config = loadMountConfig(MOUNT_METHOD="both", MOUNT_PATH="/media/torbox")
+    assert config == {"methods": ["strm", "fuse"], "strm": "/media/torbox/strm", "fuse": "/media/torbox/fuse"}
+    assert loadMountConfig(MOUNT_METHOD="fuse", MOUNT_PATH="/media/torbox")["fuse"] == "/media/torbox"
+    assert loadMountConfig(MOUNT_METHOD="both", STRM_MOUNT_PATH="/strm", FUSE_MOUNT_PATH="/fuse")["strm"] == "/strm"
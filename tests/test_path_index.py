@@ -0,0 +1,37 @@
+from functions.pathIndexFunctions import buildPathIndex
+from functions.recordFunctions import FileRecord
+
+
+def test_metadata_layout_lists_folders_and_files_in_order():
+    files = [
+        FileRecord(item_id=1, file_id=1, created_at=200, metadata_mediatype="series", metadata_rootfoldername="Show (2020)", metadata_foldername="Season 1", metadata_filename="Show - S01E02.mkv"),
+        FileRecord(item_id=1, file_id=2, created_at=100, metadata_mediatype="anime", metadata_rootfoldername="Show (2020)", metadata_foldername="Season 1", metadata_filename="Show - S01E01.mkv"),
+        FileRecord(item_id=2, file_id=1, created_at=300, metadata_mediatype="movie", metadata_rootfoldername="Movie (1999)", metadata_filename="Movie (1999).mkv"),
+        FileRecord(item_id=3, file_id=1, metadata_mediatype="movie", metadata_rootfoldername=None, metadata_filename="Unmatched.mkv"),
+    ]
+    index = buildPathIndex(files, raw_mode=False, enable_audio=False, default_mtime=50)
+
+    assert index.listDir("/") == ["movies", "series"]
+    assert index.listDir("/series/Show (2020)/Season 1") == ["Show - S01E01.mkv", "Show - S01E02.mkv"]
+    assert index.isDir("/series/Show (2020)") and not index.isFile("/series/Show (2020)")
+    assert index.getFile("/movies/Movie (1999)/Movie (1999).mkv") is files[2]
+    assert index.getFile("/movies/Movie (1999)/Movie (1999).mkv/extra") is None
+    assert not index.isDir("/missing") and index.listDir("/missing") == []
+    assert index.getDirMtime("/series") == 200
+    assert index.getDirMtime("/") == 300
+    assert index.getDirMtime("/movies") == 300
+    assert buildPathIndex([], raw_mode=False, enable_audio=True, default_mtime=50).getDirMtime("/music") == 50
+
+
+def test_raw_layout_keeps_nested_torrent_folders():
+    files = [
+        FileRecord(item_id=1, file_id=1, path="Pack/Disc 1/a.mkv"),
+        FileRecord(item_id=1, file_id=2, path="Pack/b.mkv"),
+        FileRecord(item_id=1, file_id=3, path="Pack/Disc 2/c.mkv"),
+        FileRecord(item_id=2, file_id=1, path="single.mkv"),
+    ]
+    index = buildPathIndex(files, raw_mode=True, enable_audio=False)
+
+    assert index.listDir("/") == ["Pack", "single.mkv"]
+    assert index.listDir("/Pack") == ["Disc 1", "Disc 2", "b.mkv"]
+    assert index.isDir("/Pack/Disc 2/") and index.getFile("/Pack/Disc 2/c.mkv") is files[2]
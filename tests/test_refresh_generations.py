@@ -0,0 +1,64 @@
+import json
+
+from functions.databaseFunctions import getAllData, insertData, keepFileData, promoteDatabase
+from functions.generationFunctions import RefreshCheckpoint, getStagingName, setStagingTable, clearStagingTable, updateFileDataAllGenerations
+
+
+def test_checkpoint_resumes_pages_and_completed_files():
+    checkpoint = RefreshCheckpoint("torrents")
+    checkpoint.begin()
+    checkpoint.savePage(0, 1000, [{"id": 1}, {"id": 2}], complete=False)
+    checkpoint.markProcessed(1, 10)
+    checkpoint.markProcessed(2, 20, deferred=True)
+    checkpoint.save()
+    checkpoint.markProcessed(2, 21)
+    with open(checkpoint.getPath("processed.jsonl"), "a") as file:
+        file.write('[2, 2')
+
+    resumed = RefreshCheckpoint("torrents")
+    assert resumed.load()
+    assert resumed.next_offset == 1000 and not resumed.listing_complete
+    assert list(resumed.iterPages()) == [[{"id": 1}, {"id": 2}]]
+    assert resumed.isProcessed(1, 10)
+    assert not resumed.isProcessed(2, 20)
+    assert not resumed.isProcessed(2, 21)
+
+    resumed.clear()
+    assert not RefreshCheckpoint("torrents").load()
+
+
+def test_stale_checkpoints_are_not_resumed():
+    checkpoint = RefreshCheckpoint("usenet", clock=lambda: 0)
+    checkpoint.begin()
+    assert not RefreshCheckpoint("usenet", clock=lambda: 60 * 60 * 24).load()
+
+
+def test_staging_generation_replaces_the_live_one_when_promoted():
+    staging = getStagingName("torrents")
+    insertData({"item_id": 1, "file_id": 1, "file_name": "old.mkv"}, "torrents")
+    for file_id in (1, 2, 3):
+        insertData({"item_id": 2, "file_id": file_id, "file_name": f"new{file_id}.mkv"}, staging)
+
+    kept, success, _ = keepFileData({(2, 1), (2, 2), (9, 9)}, staging)
+    assert success and kept == {(2, 1), (2, 2)}
+
+    setStagingTable("torrents")
+    try:
+        updated, _ = updateFileDataAllGenerations({"file_name": "renamed.mkv"}, 2, 1, "torrents")
+    finally:
+        clearStagingTable("torrents")
+    assert updated
+
+    live, _, _ = getAllData("torrents")
+    assert [file["file_name"] for file in live] == ["old.mkv"]
+
+    success, _ = promoteDatabase(staging, "torrents")
+    assert success
+    live, _, _ = getAllData("torrents")
+    assert sorted(file["file_name"] for file in live) == ["new2.mkv", "renamed.mkv"]
+    with open("torrents.json") as file:
+        assert len(json.load(file)["_default"]) == 2
+
+    insertData({"item_id": 3, "file_id": 1, "file_name": "later.mkv"}, "torrents")
+    live, _, _ = getAllData("torrents")
+    assert len(live) == 3
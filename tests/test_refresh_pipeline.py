@@ -0,0 +1,64 @@
+import pytest
+
+from functions import torboxFunctions as torbox
+from functions.databaseFunctions import getAllData
+from functions.generationFunctions import RefreshCheckpoint
+from functions.recordFunctions import FileRecord
+
+
+def build_pages(item_count):
+    items = [{"id": item_id, "cached": True, "files": [{"id": 1}]} for item_id in range(item_count)]
+    # the second page repeats an item shifted by a new download at the top of the list
+    return [items[:30], items[29:]]
+
+
+def test_files_are_processed_in_bounded_chunks(monkeypatch):
+    yielded = []
+    writes = []
+
+    def iter_files():
+        for item, file in torbox.iterDownloadFiles(torbox.DownloadType.torrent, build_pages(50)):
+            yielded.append(item["id"])
+            yield item, file
+
+    def build(item, file, type, defer_metadata=False):
+        record = FileRecord(type=type.value, item_id=item["id"], file_id=file["id"], file_name=f"{item['id']}.mkv")
+        return record, {"query": "deferred"} if item["id"] == 7 else None
+
+    original_insert = torbox.insertMultipleData
+
+    def insert(data, table):
+        writes.append((len(yielded), len(data)))
+        return original_insert(data, table)
+
+    enqueued = []
+    monkeypatch.setattr(torbox, "REFRESH_CHUNK_SIZE", 5)
+    monkeypatch.setattr(torbox, "buildFileRecordTimed", build)
+    monkeypatch.setattr(torbox, "insertMultipleData", insert)
+    monkeypatch.setattr("functions.enrichmentFunctions.enqueueMetadataEnrichment", lambda record, kwargs: enqueued.append(record.item_id))
+
+    checkpoint = RefreshCheckpoint("torrents")
+    checkpoint.begin()
+    stored = torbox.processDownloadFiles(torbox.DownloadType.torrent, iter_files(), "torrents_staging", checkpoint)
+    checkpoint.save()
+
+    assert stored == 50
+    assert sum(size for _, size in writes) == 50
+    # storage is written long before the listing is exhausted
+    assert writes[0][0] < 20
+    assert enqueued == [7]
+    data, _, _ = getAllData("torrents_staging")
+    assert sorted(file["item_id"] for file in data) == list(range(50))
+    assert checkpoint.isProcessed(3, 1) and not checkpoint.isProcessed(7, 1)
+
+
+def test_failed_chunk_writes_abort_the_refresh(monkeypatch):
+    monkeypatch.setattr(torbox, "insertMultipleData", lambda data, table: (False, "disk full"))
+    checkpoint = RefreshCheckpoint("torrents")
+    checkpoint.begin()
+    record = FileRecord(type="torrents", item_id=1, file_id=1, file_name="1.mkv")
+
+    with pytest.raises(torbox.StorageError, match="disk full"):
+        torbox.storeFileChunk(torbox.DownloadType.torrent, [(1, 1, (record, None))], "torrents_staging", checkpoint)
+    # the files are processed again when the refresh resumes
+    assert not checkpoint.isProcessed(1, 1)
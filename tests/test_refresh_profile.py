@@ -0,0 +1,31 @@
+from functions import profileFunctions
+from functions.profileFunctions import finishRefreshProfile, profileCount, profileFileTiming, profilePhase, startRefreshProfile
+from library.metrics import METADATA_LOOKUPS
+
+
+def test_profile_collects_phases_counts_and_slowest_files(monkeypatch):
+    monkeypatch.setattr(METADATA_LOOKUPS, "enabled", True)
+    profile = startRefreshProfile("test")
+    with profilePhase("torrents", "pagination"):
+        pass
+    with profilePhase("torrents", "pagination"):
+        pass
+    profileCount("torrents", "files", 3)
+    for index, seconds in enumerate((0.3, 0.1, 0.5)):
+        profileFileTiming("torrents", f"file{index}.mkv", seconds)
+    METADATA_LOOKUPS.labels("cache").inc(3)
+    METADATA_LOOKUPS.labels("api").inc()
+
+    report = finishRefreshProfile(profile, True, "done")
+
+    assert profileFunctions.getActiveProfile() is None
+    assert set(report["types"]["torrents"]["phases"]) == {"pagination"}
+    assert report["types"]["torrents"]["counts"] == {"files": 3, "processed": 3}
+    assert [entry["file_name"] for entry in report["slowest_files"]][:2] == ["file2.mkv", "file0.mkv"]
+    assert report["cache_hit_ratios"]["metadata"] == 0.75
+
+
+def test_hooks_are_noops_without_an_active_profile():
+    with profilePhase("torrents", "parsing"):
+        profileCount("torrents", "files")
+        profileFileTiming("torrents", "file.mkv", 1.0)
@@ -0,0 +1,85 @@
+from functions.schedulerFunctions import AdaptiveRefreshScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_scheduler(probes, clock, full_refresh_seconds=3600):
+    refreshes = []
+    probes = iter(probes)
+
+    def refresh(trigger, download_types):
+        refreshes.append(trigger if download_types is None else (trigger, [download_type.value for download_type in download_types]))
+        return True, "done"
+
+    scheduler = AdaptiveRefreshScheduler(
+        refresh=refresh,
+        probe=lambda: next(probes),
+        min_interval=60,
+        max_interval=600,
+        full_refresh_seconds=full_refresh_seconds,
+        clock=clock,
+    )
+    return scheduler, refreshes
+
+
+def test_idle_library_backs_off_and_skips_refreshes():
+    clock = FakeClock()
+    scheduler, refreshes = build_scheduler([{"torrents": "a"}] * 6, clock)
+    scheduler.refreshNow("startup")
+
+    intervals = []
+    for _ in range(5):
+        clock.now += 60
+        intervals.append(scheduler.tick())
+
+    assert refreshes == ["startup"]
+    assert intervals == [120, 240, 480, 600, 600]
+
+
+def test_change_triggers_refresh_and_resets_interval():
+    clock = FakeClock()
+    scheduler, refreshes = build_scheduler([{"torrents": "a"}, {"torrents": "a"}, {"torrents": "b"}, {"torrents": "b"}], clock)
+    scheduler.refreshNow("startup")
+
+    assert scheduler.tick() == 120
+    assert scheduler.tick() == 60
+    assert scheduler.tick() == 120
+    assert refreshes == ["startup", ("change", ["torrents"])]
+
+
+def test_only_changed_download_types_are_refreshed():
+    clock = FakeClock()
+    scheduler, refreshes = build_scheduler([
+        {"torrents": "a", "usenet": "a", "webdl": "a"},
+        {"torrents": "a", "usenet": "b", "webdl": "b"},
+        {"torrents": "b", "usenet": "b", "webdl": "b"},
+    ], clock, full_refresh_seconds=1000)
+    scheduler.refreshNow("startup")
+
+    scheduler.tick()
+    # a change probe never counts as the full refresh, so one is still due on time
+    clock.now = 1000
+    scheduler.tick()
+
+    assert refreshes == ["startup", ("change", ["usenet", "webdl"]), "change"]
+    assert scheduler.last_full_refresh == 1000
+
+
+def test_full_refresh_still_runs_when_due_or_probe_fails():
+    clock = FakeClock()
+    scheduler, refreshes = build_scheduler([{"torrents": "a"}, {"torrents": "a"}, None], clock, full_refresh_seconds=1000)
+    scheduler.refreshNow("startup")
+
+    clock.now = 1000
+    scheduler.tick()
+    clock.now = 2000
+    scheduler.tick()
+
+    assert refreshes == ["startup", "scheduled", "scheduled"]
+    assert scheduler.fingerprints == {"torrents": "a"}
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+from functions import torboxFunctions as torbox
+from functions.searchFunctions import MetadataSearchBatcher
+
+
+FIXTURE_DATA = json.loads((Path(__file__).parent / "fixtures" / "metadata_true_blood_cases.json").read_text())
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return {"data": self._data}
+
+
+def run_searches(batcher, titles):
+    results = {}
+
+    def search(title):
+        results[title] = batcher.search(title, {"type": "file"}).json()["data"]
+
+    threads = [threading.Thread(target=search, args=(title,)) for title in titles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+def test_batches_and_dedupes_queries():
+    calls = []
+
+    def request(client, method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        return FakeResponse([[{"title": query["query"]}] for query in kwargs["json"]["queries"]])
+
+    batcher = MetadataSearchBatcher(request, None, batch_path="/meta/search/batch", batch_size=10, window=0.2, rate=1000)
+    results = run_searches(batcher, ["Show.One.S01E01", "show one s01e01", "Show Two S01E01"])
+
+    assert len(calls) == 1
+    assert calls[0][:2] == ("POST", "/meta/search/batch")
+    assert sorted(query["query"].lower() for query in calls[0][2]["json"]["queries"]) == ["show two s01e01", "show.one.s01e01"]
+    assert results["show one s01e01"] == results["Show.One.S01E01"] == [{"title": "Show.One.S01E01"}]
+
+
+def test_falls_back_to_single_searches_when_batches_are_unsupported():
+    calls = []
+
+    def request(client, method, url, **kwargs):
+        calls.append((method, url))
+        if method == "POST":
+            response = httpx.Response(404, request=httpx.Request(method, "http://search" + url))
+            raise httpx.HTTPStatusError("not found", request=response.request, response=response)
+        return FakeResponse([{"title": url}])
+
+    batcher = MetadataSearchBatcher(request, None, batch_path="/meta/search/batch", batch_size=10, window=0.2, rate=1000)
+    results = run_searches(batcher, ["A S01E01", "B S01E01"])
+
+    assert calls[0] == ("POST", "/meta/search/batch")
+    assert sorted(calls[1:]) == [("GET", "/meta/search/A S01E01"), ("GET", "/meta/search/B S01E01")]
+    assert results["A S01E01"] == [{"title": "/meta/search/A S01E01"}]
+    assert batcher.batch_path == ""
+
+
+def test_episodes_of_one_show_share_one_search(monkeypatch):
+    pack = FIXTURE_DATA["packs"]["true_blood_s07_hash"]
+    calls = []
+
+    def request(client, method, url, **kwargs):
+        calls.append(url)
+        # slow enough that every episode is searching before the first response arrives
+        time.sleep(0.3)
+        return FakeResponse(FIXTURE_DATA["candidates"]["true_blood_series_and_movie"])
+
+    monkeypatch.setattr(torbox, "requestWrapper", request)
+    monkeypatch.setattr(torbox, "_search_batcher", None)
+    results = []
+    threads = [
+        threading.Thread(target=lambda file=file: results.append(torbox.process_file(dict(pack["item"]), dict(file), torbox.DownloadType.torrent)))
+        for file in pack["files"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(calls) == 1
+    assert len(results) == len(pack["files"])
+    assert {result["metadata_rootfoldername"] for result in results} == {"True Blood (2008)"}
+    assert sorted(result["metadata_episode"] for result in results) == [1, 2, 10]
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+from functions.databaseFunctions import insertData
+from functions import snapshotFunctions
+from functions.sharedLibraryFunctions import SharedLibraryFollower, publishSharedLibrary, publishMissingSharedLibrary
+from functions.recordFunctions import FileRecord
+from functions.snapshotFunctions import LibrarySnapshot, encodeSnapshot, getLibrarySnapshot, saveLibrarySnapshot
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FOLLOWER_SCRIPT = """
+import json
+from functions.sharedLibraryFunctions import SharedLibraryFollower
+from functions.snapshotFunctions import getLibrarySnapshot
+follower = SharedLibraryFollower()
+changed = [follower.poll(), follower.poll()]
+print(json.dumps({"changed": changed, "files": sorted(file.file_name for file in getLibrarySnapshot().files)}))
+"""
+
+
+def test_follower_process_serves_the_library_published_by_the_leader(tmp_path):
+    insertData({"type": "torrents", "item_id": 1, "file_id": 1, "file_name": "a.mkv"}, "torrents")
+    insertData({"type": "usenet", "item_id": 2, "file_id": 1, "file_name": "b.mkv"}, "usenet")
+    snapshot = getLibrarySnapshot()
+    shared_path = tmp_path / "shared"
+    assert publishSharedLibrary(encodeSnapshot(snapshot), snapshot, str(shared_path))
+
+    follower_path = tmp_path / "follower"
+    follower_path.mkdir()
+    completed = subprocess.run(
+        [sys.executable, "-c", FOLLOWER_SCRIPT],
+        cwd=follower_path,
+        env={**os.environ, "PYTHONPATH": REPOSITORY_PATH, "NODE_ROLE": "follower", "SHARED_LIBRARY_PATH": str(shared_path)},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert completed.returncode == 0, completed.stderr
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert result == {"changed": [True, False], "files": ["a.mkv", "b.mkv"]}
+    # followers never create databases of their own
+    assert not list(follower_path.glob("*.json"))
+
+
+def test_follower_waits_for_a_published_library(tmp_path):
+    follower = SharedLibraryFollower(str(tmp_path / "missing"))
+    assert not follower.poll()
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "manifest.json").write_text(json.dumps({"id": "1"}))
+    assert not SharedLibraryFollower(str(tmp_path / "broken")).poll()
+
+
+def test_leader_publishes_a_missing_library_and_retries_failed_publishes(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshotFunctions, "_saved_version", 0)
+    snapshot = LibrarySnapshot(1, {"torrents": (FileRecord(type="torrents", item_id=1, file_id=1, file_name="a.mkv"),)}, {})
+    local_path = str(tmp_path / "library_snapshot.bin")
+
+    # the shared path is a file, so the publish fails and the snapshot is not marked as saved
+    blocked_path = tmp_path / "blocked"
+    blocked_path.write_text("")
+    assert not saveLibrarySnapshot(snapshot, local_path, "leader", str(blocked_path))
+    shared_path = tmp_path / "shared"
+    assert saveLibrarySnapshot(snapshot, local_path, "leader", str(shared_path))
+    assert (shared_path / "manifest.json").exists()
+    assert not saveLibrarySnapshot(snapshot, local_path, "leader", str(shared_path))
+
+    # a leader starting from its persisted snapshot publishes when the shared path has nothing yet
+    other_path = tmp_path / "other"
+    assert publishMissingSharedLibrary(str(other_path))
+    assert not publishMissingSharedLibrary(str(other_path))
+    assert SharedLibraryFollower(str(other_path)).poll()
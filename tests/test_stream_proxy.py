@@ -0,0 +1,111 @@
+import httpx
+import pytest
+
+import os
+
+from functions import snapshotFunctions
+from functions.proxyFunctions import StreamProxy, getStreamUrl, parseRange, startStreamProxy
+from functions.snapshotFunctions import LibrarySnapshot, installLibrarySnapshot
+from functions.streamFunctions import StreamManager
+
+
+FILE_SIZE = 5000
+
+
+@pytest.fixture
+def movie(build_file):
+    return build_file(file_id=2, file_size=FILE_SIZE, file_name="Movie (2020).mkv", file_mimetype="video/x-matroska")
+
+
+@pytest.fixture
+def proxy_url(links, movie):
+    lookups = []
+
+    def lookup(type, item_id, file_id):
+        lookups.append((type, item_id, file_id))
+        return movie if (type, item_id, file_id) == ("torrents", 1, 2) else None
+
+    streams = StreamManager(links, block_size=1000, max_blocks=10, probe_chunk_size=100)
+    server = startStreamProxy("127.0.0.1", 0, StreamProxy(streams, lookup=lookup, token="secret"))
+    yield f"http://127.0.0.1:{server.server_address[1]}", links, lookups
+    server.shutdown()
+    streams.stop()
+
+
+def test_parse_range():
+    assert parseRange(None, 100) is None
+    assert parseRange("bytes=10-19", 100) == (10, 19)
+    assert parseRange("bytes=90-", 100) == (90, 99)
+    assert parseRange("bytes=-30", 100) == (70, 99)
+    assert parseRange("bytes=50-500", 100) == (50, 99)
+    assert parseRange("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parseRange("bytes=100-", 100)
+
+
+def test_stream_url_keeps_the_api_key_out(movie):
+    url = getStreamUrl(movie, base_url="http://proxy:9466", token="secret")
+    assert url == "http://proxy:9466/stream/torrents/1/2/Movie%20%282020%29.mkv?token=secret"
+
+
+def test_proxy_serves_ranges_through_the_block_cache(proxy_url, content):
+    base_url, links, lookups = proxy_url
+    url = f"{base_url}/stream/torrents/1/2/Movie.mkv?token=secret"
+    with httpx.Client() as client:
+        response = client.get(url, headers={"Range": "bytes=1500-3999"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 1500-3999/{FILE_SIZE}"
+        assert response.headers["Content-Type"] == "video/x-matroska"
+        assert response.content == content[1500:4000]
+
+        fetched = len(links.downloads)
+        response = client.get(url, headers={"Range": "bytes=2000-2999"})
+        assert response.content == content[2000:3000]
+        assert len(links.downloads) == fetched
+
+        response = client.get(url)
+        assert response.status_code == 200 and response.content == content
+        assert client.head(url).headers["Content-Length"] == str(FILE_SIZE)
+
+        assert client.get(url, headers={"Range": f"bytes={FILE_SIZE}-"}).status_code == 416
+        assert client.get(f"{base_url}/stream/torrents/1/2/Movie.mkv").status_code == 401
+        assert client.get(f"{base_url}/stream/torrents/1/3/Movie.mkv?token=secret").status_code == 404
+    assert ("torrents", 1, 2) in lookups
+
+
+def test_head_requests_are_answered_from_the_record(proxy_url, monkeypatch):
+    base_url, links, _ = proxy_url
+    opened = []
+    monkeypatch.setattr(StreamManager, "open", lambda self, file: opened.append(file))
+    url = f"{base_url}/stream/torrents/1/2/Movie.mkv?token=secret"
+    with httpx.Client() as client:
+        response = client.head(url, headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 100-199/{FILE_SIZE}"
+        assert response.headers["Content-Length"] == "100"
+        assert client.head(url).headers["Content-Length"] == str(FILE_SIZE)
+    assert opened == [] and links.downloads == []
+
+
+def test_follower_proxy_serves_files_from_the_installed_snapshot(monkeypatch, links, content, movie):
+    monkeypatch.setattr(snapshotFunctions, "NODE_ROLE", "follower")
+    monkeypatch.setattr(snapshotFunctions, "_snapshot", LibrarySnapshot(0, {}, {}))
+    monkeypatch.setattr(snapshotFunctions, "_file_index", (0, {}))
+    installLibrarySnapshot({"torrents": (movie,)})
+
+    streams = StreamManager(links, block_size=1000, max_blocks=10, probe_chunk_size=100)
+    server = startStreamProxy("127.0.0.1", 0, StreamProxy(streams, token=""))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with httpx.Client() as client:
+            response = client.get(f"{base_url}/stream/torrents/1/2/Movie.mkv", headers={"Range": "bytes=0-99"})
+            assert response.status_code == 206 and response.content == content[:100]
+
+            # a new snapshot replaces the index, removed files are no longer served
+            installLibrarySnapshot({"torrents": ()})
+            assert client.get(f"{base_url}/stream/torrents/1/2/Movie.mkv").status_code == 404
+    finally:
+        server.shutdown()
+        streams.stop()
+    # followers never open their own databases
+    assert not os.path.exists("torrents.json")
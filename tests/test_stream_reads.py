@@ -0,0 +1,93 @@
+import threading
+
+from functions.streamFunctions import BlockCache, StreamManager, coalesceRanges
+
+
+def test_reads_span_blocks_and_are_served_from_cache(links, content, build_file):
+    streams = StreamManager(links, block_size=100, max_blocks=10, probe_max_read_size=0)
+    handle = streams.open(build_file())
+
+    assert streams.read(handle, 150, 50) == content[50:200]
+    assert streams.read(handle, 10, 120) == content[120:130]
+    assert links.downloads == [(0, 100), (100, 100)]
+    assert handle.stats.cache_hits == 1
+    assert handle.stats.bytes_fetched == 200
+
+    streams.release(handle)
+    streams.stop()
+
+
+def test_sequential_reads_prefetch_the_next_block(links, build_file):
+    streams = StreamManager(links, block_size=100, max_blocks=10, probe_max_read_size=0)
+    handle = streams.open(build_file())
+
+    for offset in range(0, 90, 30):
+        streams.read(handle, 30, offset)
+    for future in list(handle.prefetches.values()):
+        future.result(timeout=5)
+
+    assert (100, 100) in links.downloads
+    assert handle.stats.prefetches == 1
+
+    streams.release(handle)
+    streams.stop()
+
+
+def test_release_unpins_blocks_and_links_and_cancels_prefetch(links, build_file):
+    gate = threading.Event()
+    gate.set()
+    links.gate = gate
+    streams = StreamManager(links, block_size=100, max_blocks=10, probe_max_read_size=0)
+    handle = streams.open(build_file())
+    streams.read(handle, 30, 0)
+    streams.read(handle, 30, 30)
+    gate.clear()
+    streams.read(handle, 30, 60)
+
+    assert links.pinned == 1
+    assert handle.pinned_blocks
+    assert handle.prefetches
+
+    streams.release(handle)
+    gate.set()
+    streams.stop()
+
+    assert links.pinned == 0
+    assert not handle.pinned_blocks
+    assert not handle.prefetches
+    assert handle.id not in streams.handles
+
+
+def test_pinned_blocks_survive_eviction():
+    cache = BlockCache(max_blocks=1)
+    cache.put(("file", 0), b"a")
+    cache.pin(("file", 0))
+    cache.put(("file", 1), b"b")
+
+    assert ("file", 0) in cache
+    assert ("file", 1) in cache
+
+    cache.unpin(("file", 0))
+    assert ("file", 0) not in cache
+    assert ("file", 1) in cache
+
+
+def test_small_scattered_reads_fetch_tight_ranges(links, content, build_file):
+    streams = StreamManager(links, block_size=500, max_blocks=10, probe_chunk_size=10, probe_max_read_size=20)
+    handle = streams.open(build_file())
+
+    assert streams.read(handle, 4, 0) == content[0:4]
+    assert streams.read(handle, 8, 995) == content[995:1000]
+    assert streams.read(handle, 15, 495) == content[495:510]
+    assert streams.read(handle, 4, 2) == content[2:6]
+
+    assert links.downloads == [(0, 10), (990, 10), (490, 20)]
+    assert handle.stats.probe_reads == 4
+    assert handle.stats.bytes_fetched == 40
+
+    streams.release(handle)
+    streams.stop()
+
+
+def test_coalesce_ranges_merges_nearby_requests():
+    assert coalesceRanges([(30, 39), (0, 9), (10, 19), (100, 109)], max_gap=10) == [(0, 39), (100, 109)]
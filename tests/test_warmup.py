@@ -0,0 +1,44 @@
+from functions import streamFunctions
+from functions.snapshotFunctions import LibrarySnapshot
+from functions.streamFunctions import StreamManager
+from functions.warmupFunctions import WarmUpQueue, getNewFiles
+
+
+def build_snapshot(version, files):
+    return LibrarySnapshot(version, {"torrents": tuple(files)}, {})
+
+
+def test_warm_up_fetches_head_and_tail_into_the_probe_cache(monkeypatch, links, content, build_file):
+    # real files are far larger than the gap, here the head and tail would be fetched as one range
+    monkeypatch.setattr(streamFunctions, "PROBE_COALESCE_GAP", 0)
+    streams = StreamManager(links, block_size=500, probe_chunk_size=10, probe_max_read_size=20)
+    file = build_file(1)
+
+    assert streams.warmUp(file, 30, 15) == 50
+    assert links.downloads == [(0, 30), (980, 20)]
+
+    # the scanner's first probes of the file no longer go to the CDN
+    handle = streams.open(file)
+    assert streams.read(handle, 16, 4) == content[4:20]
+    assert streams.read(handle, 8, 990) == content[990:998]
+    assert len(links.downloads) == 2
+    assert streams.warmUp(file, 30, 15) == 0
+    streams.release(handle)
+    streams.stop()
+
+
+def test_only_new_files_are_warmed_up_newest_first_within_the_budget(links, build_file):
+    streams = StreamManager(links, block_size=500, probe_chunk_size=10, probe_max_read_size=20)
+    warmups = WarmUpQueue(lambda: streams, head_size=20, tail_size=10, budget=60)
+    existing = build_file(1)
+
+    # the first snapshot is the baseline
+    assert warmups.process(build_snapshot(1, [existing])) == 0
+    renamed = build_file(file_name="Show S01E01.mkv")
+    new_files = [build_file(2, created_at=100), build_file(3, created_at=300), build_file(4, created_at=200)]
+    assert [file.file_id for file in getNewFiles(build_snapshot(1, [existing]), build_snapshot(2, [renamed, *new_files]))] == [3, 4, 2]
+
+    assert warmups.process(build_snapshot(2, [renamed, *new_files])) == 2
+    assert sorted(set(links.downloaded_files)) == [3, 4]
+    assert warmups.process(build_snapshot(2, [renamed, *new_files])) == 0
+    streams.stop()